@@ -0,0 +1,265 @@
+import asyncio
+import io
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from desk_manager import DeskManager
+from simple_rest_server import SimpleRESTServer
+
+logger = logging.getLogger(__name__)
+
+class _StreamWriterProxy:
+    """File-like object that lets a worker thread write to an asyncio stream."""
+    FLUSH_THRESHOLD = 64 * 1024
+
+    def __init__(self, loop, writer, write_timeout_s):
+        self.loop = loop
+        self.writer = writer
+        self.write_timeout_s = write_timeout_s
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.FLUSH_THRESHOLD:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        """Hand the buffered bytes to the event loop and wait until they are drained.
+
+        Raises ConnectionError, after closing the connection, when the client leaves them unread for longer
+        than the write timeout, so a stalled client cannot hold the worker thread.
+        """
+        if not self.buffer:
+            return
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        asyncio.run_coroutine_threadsafe(self._write(data), self.loop).result()
+
+    async def _write(self, data):
+        self.writer.write(data)
+        try:
+            await asyncio.wait_for(self.writer.drain(), self.write_timeout_s)
+        except asyncio.TimeoutError:
+            self.writer.transport.abort()
+            raise ConnectionError(f"Client left the response unread for {self.write_timeout_s} s")
+
+class AsyncHandlerMixin:
+    """Runs a request handler against a single request already read by the event loop."""
+
+    def setup(self):
+        raw_request, self.wfile, self.requests_served = self.request
+        self.rfile = io.BytesIO(raw_request)
+        self.event_subscription = None
+
+    def handle(self):
+        self.handle_one_request()
+
+    def finish(self):
+        self.wfile.flush()
+
+    def _stream_events(self, subscription):
+        # The event loop streams the events once the handler returns, so the stream holds no worker thread.
+        self.event_subscription = subscription
+
+class AsyncRESTServer:
+    """Asyncio front end serving the same routes as SimpleRESTServer.
+
+    The event loop owns every connection and only frames requests. Each complete request
+    is handed to a worker thread, so DeskManager locks never block the loop, and a
+    semaphore caps how many requests are being processed at once. Event streams only use
+    a worker thread to open; the loop then writes their events itself, so long-lived
+    streams count against neither the threads nor the semaphore.
+    """
+    MAX_HEADER_BYTES = 64 * 1024
+    MAX_BODY_BYTES = 8 * 1024 * 1024
+    LISTEN_BACKLOG = 2048
+    # How long a client may leave written data unread before its connection is dropped.
+    WRITE_TIMEOUT_S = 30
+
+    def __init__(self, desk_manager: DeskManager, handler_class=SimpleRESTServer, max_in_flight=64, ssl_context=None, reuse_port=False):
+        self.desk_manager = desk_manager
+        self.handler_class = type(f"Async{handler_class.__name__}", (AsyncHandlerMixin, handler_class), {})
+        self.max_in_flight = max_in_flight
+        self.ssl_context = ssl_context
+        self.reuse_port = reuse_port
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="rest-worker")
+        self.loop = None
+        self.in_flight = None
+        self.events_published = None
+        self.stopping = None
+        # Set once the server accepts connections; server_address then holds the bound (host, port).
+        self.serving = threading.Event()
+        self.server_address = None
+
+    def serve_forever(self, host, port):
+        """Run the event loop until interrupted or shutdown() is called."""
+        raise_open_files_limit()
+        try:
+            asyncio.run(self._serve(host, port))
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _serve(self, host, port):
+        self.loop = asyncio.get_running_loop()
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        self.events_published = asyncio.Event()
+        server = await asyncio.start_server(
+            self._handle_connection, host, port,
+            ssl=self.ssl_context,
+            limit=self.MAX_HEADER_BYTES,
+            backlog=self.LISTEN_BACKLOG,
+            reuse_port=self.reuse_port or None,
+        )
+        self.server_address = server.sockets[0].getsockname()[:2]
+        self.stopping = self.loop.create_future()
+        self.serving.set()
+        logger.info("Asyncio engine listening on %s:%s (max in-flight requests: %s).", host, port, self.max_in_flight)
+        listener = lambda: self.loop.call_soon_threadsafe(self._wake_event_streams)
+        self.desk_manager.events.add_listener(listener)
+        try:
+            async with server:
+                await self.stopping
+        finally:
+            # The simulator closes the event streams after the loop is gone.
+            self.desk_manager.events.remove_listener(listener)
+
+    def shutdown(self):
+        """Make serve_forever() return; called from another thread."""
+        self.loop.call_soon_threadsafe(lambda: self.stopping.done() or self.stopping.set_result(None))
+
+    async def _handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info("peername") or ("", 0)
+        wfile = _StreamWriterProxy(self.loop, writer, self.WRITE_TIMEOUT_S)
+        requests_served = 0
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.handler_class.KEEPALIVE_TIMEOUT_S)
+                except asyncio.LimitOverrunError:
+                    await self._send_error(writer, 431, "Request header too large")
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+
+                content_length = self._content_length(head)
+                if content_length is None:
+                    await self._send_error(writer, 400, "Invalid request body framing")
+                    break
+                if content_length > self.MAX_BODY_BYTES:
+                    await self._send_error(writer, 413, "Request body too large")
+                    break
+                body = await reader.readexactly(content_length) if content_length else b""
+
+                async with self.in_flight:
+                    keep_alive, subscription = await self.loop.run_in_executor(
+                        self.executor, self._dispatch, head + body, client_address, wfile, requests_served
+                    )
+                requests_served += 1
+                if subscription is not None:
+                    await self._stream_events(subscription, writer)
+                    break
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.debug("Connection from %s dropped: %s", client_address, e)
+        except Exception:
+            logger.exception("Unexpected error while serving %s.", client_address)
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    def _dispatch(self, raw_request, client_address, wfile, requests_served):
+        """Process one request on a worker thread.
+
+        Returns whether the connection stays open, and the subscription of an event stream the request opened.
+        """
+        handler = self.handler_class(self.desk_manager, (raw_request, wfile, requests_served), client_address, self)
+        return not handler.close_connection, handler.event_subscription
+
+    def _wake_event_streams(self):
+        """Wake every event stream waiting for events; each waits on the Event that was current before it read."""
+        self.events_published.set()
+        self.events_published = asyncio.Event()
+
+    async def _stream_events(self, subscription, writer):
+        """Write an event stream's events from the event loop until either side ends it."""
+        handler_class = self.handler_class
+        last_write = time.monotonic()
+        try:
+            while True:
+                # Taken before reading, so events published during the read still wake the wait below.
+                events_published = self.events_published
+                chunk, done = handler_class.next_event_chunk(subscription, 0, last_write)
+                if chunk:
+                    writer.write(chunk)
+                    try:
+                        await asyncio.wait_for(writer.drain(), self.WRITE_TIMEOUT_S)
+                    except asyncio.TimeoutError:
+                        writer.transport.abort()
+                        raise ConnectionError(f"Client left the events unread for {self.WRITE_TIMEOUT_S} s")
+                    last_write = time.monotonic()
+                if done:
+                    break
+                if not chunk:
+                    idle_s = time.monotonic() - last_write
+                    try:
+                        await asyncio.wait_for(events_published.wait(), max(0, handler_class.SSE_HEARTBEAT_S - idle_s))
+                    except asyncio.TimeoutError:
+                        pass
+        except ConnectionError as e:
+            logger.info("Event stream client disconnected: %s", e)
+        finally:
+            subscription.close()
+
+    @staticmethod
+    def _content_length(head):
+        """Return the declared body length, 0 when absent, or None when it cannot be honoured."""
+        content_length = 0
+        for line in head.split(b"\r\n")[1:]:
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            if name == b"content-length":
+                try:
+                    content_length = int(value.strip())
+                except ValueError:
+                    return None
+                if content_length < 0:
+                    return None
+            elif name == b"transfer-encoding":
+                # Chunked request bodies are not used by any client of this API.
+                return None
+        return content_length
+
+    @staticmethod
+    async def _send_error(writer, status_code, message):
+        body = json.dumps({"error": message}).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status_code} {message}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+def raise_open_files_limit():
+    """Raise the soft open-files limit to the hard limit so thousands of sockets fit."""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            logger.info("Open files limit raised from %s to %s.", soft, hard)
+        except (ValueError, OSError) as e:
+            logger.warning("Could not raise open files limit: %s", e)
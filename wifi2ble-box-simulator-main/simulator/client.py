@@ -0,0 +1,473 @@
+import asyncio
+import http.client
+import json
+import queue
+import ssl
+import threading
+import zlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlencode
+
+logger = logging.getLogger(__name__)
+
+class DeskApiError(Exception):
+    """Raised when the server answers a request with an error status."""
+
+    def __init__(self, status, message):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.message = message
+
+class _DeskApiBase:
+    """Request building and response handling shared by the sync and async clients.
+
+    The client prefers the bulk endpoints (`?expand=all`, batch `PUT /desks`), conditional requests
+    and the change feed, and falls back to one request per desk against servers that lack them.
+    """
+    VERSION = "v2"
+    # Reading more desks than this uses one fleet snapshot instead of one request per desk.
+    BULK_THRESHOLD = 32
+    PAGE_SIZE = 1000
+    MAX_CACHED_RESPONSES = 100000
+
+    def __init__(self, host="localhost", port=8000, api_key=None, https=False, pool_size=8, timeout=10.0, ssl_context=None):
+        self.host = host
+        self.port = port
+        self.https = https
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.ssl_context = ssl_context if ssl_context is not None else (ssl.create_default_context() if https else None)
+        self.base_path = f"/api/{self.VERSION}/{api_key}/desks"
+        self.responses = {}
+        self.supports_bulk = None
+        self.supports_batch = None
+        # Local copy of the fleet kept current by sync(), and the change feed cursor it is valid at.
+        self.fleet = {}
+        self.cursor = None
+
+    def _desk_path(self, desk_id, category=None):
+        path = f"{self.base_path}/{quote(desk_id, safe=':')}"
+        return f"{path}/{category}" if category else path
+
+    def _request_headers(self, path=None, body=None):
+        headers = {"Accept-Encoding": "gzip, deflate"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        cached = self.responses.get(path) if path else None
+        if cached is not None:
+            headers["If-None-Match"] = cached[0]
+        return headers
+
+    @staticmethod
+    def _encode(data):
+        return json.dumps(data).encode("utf-8")
+
+    @staticmethod
+    def _decode(status, headers, body):
+        """Decompress and parse a response body, raising DeskApiError for error statuses."""
+        if headers.get("content-encoding") in ("gzip", "deflate"):
+            # wbits 47 accepts both gzip and zlib framing.
+            body = zlib.decompress(body, 47)
+        data = json.loads(body) if body else None
+        if status >= 400:
+            message = data.get("error", "") if isinstance(data, dict) else body.decode("utf-8", "replace")
+            raise DeskApiError(status, message)
+        return data
+
+    def _conditional_result(self, path, status, headers, body):
+        """Return the data of a conditional GET, from the local copy on 304 Not Modified."""
+        if status == 304 and path in self.responses:
+            return self.responses[path][1]
+        data = self._decode(status, headers, body)
+        etag = headers.get("etag")
+        if etag:
+            if path not in self.responses and len(self.responses) >= self.MAX_CACHED_RESPONSES:
+                del self.responses[next(iter(self.responses))]
+            self.responses[path] = (etag, data)
+        return data
+
+    def _snapshot_result(self, status, headers, body):
+        """Parse a fleet snapshot, returning (desks, cursor) or None if the server has no bulk endpoint."""
+        if status == 400:
+            self.supports_bulk = False
+            return None
+        data = self._decode(status, headers, body)
+        # Servers without ?expand=all ignore the parameter and return the list of IDs.
+        self.supports_bulk = isinstance(data, dict)
+        return (data, headers.get("x-changes-cursor")) if self.supports_bulk else None
+
+    def _load_fleet(self, desks, cursor):
+        self.fleet = desks
+        self.cursor = cursor
+        return {"desks": desks, "removed": [], "resync": True}
+
+    def _apply_changes(self, changes):
+        for desk_id, categories in changes["desks"].items():
+            self.fleet.setdefault(desk_id, {}).update(categories)
+        for desk_id in changes["removed"]:
+            self.fleet.pop(desk_id, None)
+        self.cursor = changes["cursor"]
+        return {"desks": changes["desks"], "removed": changes["removed"], "resync": False}
+
+    @staticmethod
+    def _batch_unsupported(status):
+        return status in (400, 404, 405)
+
+class DeskClient(_DeskApiBase):
+    """Blocking client with a pool of keep-alive connections, safe to share between threads.
+
+        client = DeskClient("localhost", 8000, api_key)
+        desks = client.get_desks()          # one request for the whole fleet
+        changes = client.sync()             # only what changed since the previous sync()
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(self.pool_size)
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def _connect(self):
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=self.ssl_context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None, headers=None):
+        """Send one request on a pooled connection and return (status, lower-cased headers, raw body)."""
+        with self.slots:
+            for attempt in range(2):
+                try:
+                    connection = self.idle.get_nowait()
+                    reused = True
+                except queue.Empty:
+                    connection = self._connect()
+                    reused = False
+                try:
+                    connection.request(method, path, body=body, headers=headers or {})
+                    response = connection.getresponse()
+                    data = response.read()
+                except (http.client.HTTPException, OSError):
+                    connection.close()
+                    # The server may have closed an idle keep-alive connection; retry once on a new one.
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                if response.will_close:
+                    connection.close()
+                else:
+                    self.idle.put(connection)
+                return response.status, {name.lower(): value for name, value in response.getheaders()}, data
+
+    def _get(self, path):
+        status, headers, body = self.request("GET", path, headers=self._request_headers())
+        return self._decode(status, headers, body)
+
+    def _get_conditional(self, path):
+        status, headers, body = self.request("GET", path, headers=self._request_headers(path))
+        return self._conditional_result(path, status, headers, body)
+
+    def map(self, function, items):
+        """Call `function` on every item concurrently, at most pool_size at a time, and return the results in order."""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="desk-client")
+        return list(self.executor.map(function, items))
+
+    def get_desk_ids(self):
+        return self._get(self.base_path)
+
+    def list_desk_ids(self, status=None, manufacturer=None, band=None):
+        """Return the IDs of desks matching the filters, following the page cursor to the end."""
+        params = {name: value for name, value in (("status", status), ("manufacturer", manufacturer), ("band", band)) if value}
+        params["limit"] = self.PAGE_SIZE
+        desk_ids = []
+        while True:
+            page = self._get(f"{self.base_path}?{urlencode(params)}")
+            desk_ids.extend(page["desks"])
+            if not page["next_cursor"]:
+                return desk_ids
+            params["cursor"] = page["next_cursor"]
+
+    def get_desk(self, desk_id):
+        return self._get_conditional(self._desk_path(desk_id))
+
+    def get_desk_category(self, desk_id, category):
+        return self._get_conditional(self._desk_path(desk_id, category))
+
+    def get_fleet_snapshot(self):
+        """Return ({desk ID: data}, change feed cursor) from one request, or None if the server has no bulk endpoint."""
+        if self.supports_bulk is False:
+            return None
+        status, headers, body = self.request("GET", f"{self.base_path}?expand=all", headers=self._request_headers())
+        return self._snapshot_result(status, headers, body)
+
+    def get_desks(self, desk_ids=None):
+        """Return {desk ID: data} for the given desks, or for every desk."""
+        if desk_ids is None or len(desk_ids) > self.BULK_THRESHOLD:
+            snapshot = self.get_fleet_snapshot()
+            if snapshot is not None:
+                desks = snapshot[0]
+                return desks if desk_ids is None else {desk_id: desks[desk_id] for desk_id in desk_ids if desk_id in desks}
+        if desk_ids is None:
+            desk_ids = self.get_desk_ids()
+        return dict(zip(desk_ids, self.map(self.get_desk, desk_ids)))
+
+    def set_position(self, desk_id, position_mm):
+        status, headers, body = self.request("PUT", self._desk_path(desk_id, "state"),
+                                             self._encode({"position_mm": position_mm}), self._request_headers(body=True))
+        return self._decode(status, headers, body)
+
+    def set_positions(self, positions):
+        """Move many desks, given as {desk ID: position}, with one batch request when the server supports it.
+
+        Returns the batch result: {"accepted": [...], "errors": [...]}.
+        """
+        commands = [{"desk_id": desk_id, "position_mm": position_mm} for desk_id, position_mm in positions.items()]
+        if self.supports_batch is not False:
+            status, headers, body = self.request("PUT", self.base_path, self._encode(commands), self._request_headers(body=True))
+            if not self._batch_unsupported(status):
+                self.supports_batch = True
+                return self._decode(status, headers, body)
+            self.supports_batch = False
+
+        def move(command):
+            try:
+                self.set_position(command["desk_id"], command["position_mm"])
+                return None
+            except DeskApiError as e:
+                return {"desk_id": command["desk_id"], "error": e.message}
+        results = self.map(move, commands)
+        return {
+            "accepted": [command for command, error in zip(commands, results) if error is None],
+            "errors": [error for error in results if error is not None],
+        }
+
+    def sync(self):
+        """Bring `fleet` up to date and return what changed: {"desks", "removed", "resync"}.
+
+        The first call, and any call after the change feed lost our cursor, loads the whole fleet.
+        """
+        if self.cursor is not None:
+            status, headers, body = self.request("GET", f"{self.base_path}/changes?{urlencode({'since': self.cursor})}",
+                                                 headers=self._request_headers())
+            if status != 410:
+                return self._apply_changes(self._decode(status, headers, body))
+        snapshot = self.get_fleet_snapshot()
+        if snapshot is None:
+            return self._load_fleet(self.get_desks(self.get_desk_ids()), None)
+        return self._load_fleet(*snapshot)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class _AsyncConnection:
+    """One HTTP/1.1 keep-alive connection driven by asyncio streams."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+
+    async def request(self, method, path, headers, body):
+        lines = [f"{method} {path} HTTP/1.1"] + [f"{name}: {value}" for name, value in headers.items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b""))
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by server")
+        status = int(status_line.split(b" ", 2)[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    while (await self.reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readexactly(2)
+            data = b"".join(chunks)
+        elif "content-length" in response_headers:
+            data = await self.reader.readexactly(int(response_headers["content-length"]))
+        elif status in (204, 304) or method == "HEAD":
+            data = b""
+        else:
+            data = await self.reader.read()
+            self.closed = True
+        if response_headers.get("connection", "").lower() == "close":
+            self.closed = True
+        return status, response_headers, data
+
+    def close(self):
+        self.closed = True
+        self.writer.close()
+
+class AsyncDeskClient(_DeskApiBase):
+    """Asyncio client with a pool of keep-alive connections; the coroutine twin of DeskClient.
+
+        async with AsyncDeskClient("localhost", 8000, api_key) as client:
+            desks = await client.get_desks(desk_ids)    # fan-out or one bulk request
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.idle = []
+        self.slots = None
+
+    async def _connect(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl_context if self.https else None), self.timeout
+        )
+        return _AsyncConnection(reader, writer)
+
+    async def request(self, method, path, body=None, headers=None):
+        """Send one request on a pooled connection and return (status, lower-cased headers, raw body)."""
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.pool_size)
+        headers = {"Host": f"{self.host}:{self.port}", "Content-Length": str(len(body or b"")), **(headers or {})}
+        async with self.slots:
+            for attempt in range(2):
+                reused = bool(self.idle)
+                connection = self.idle.pop() if reused else await self._connect()
+                try:
+                    response = await asyncio.wait_for(connection.request(method, path, headers, body), self.timeout)
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+                    connection.close()
+                    # The server may have closed an idle keep-alive connection; retry once on a new one.
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                if connection.closed:
+                    connection.close()
+                else:
+                    self.idle.append(connection)
+                return response
+
+    async def _get(self, path):
+        status, headers, body = await self.request("GET", path, headers=self._request_headers())
+        return self._decode(status, headers, body)
+
+    async def _get_conditional(self, path):
+        status, headers, body = await self.request("GET", path, headers=self._request_headers(path))
+        return self._conditional_result(path, status, headers, body)
+
+    async def map(self, function, items):
+        """Await `function` on every item concurrently, bounded by the connection pool, and return the results in order."""
+        return await asyncio.gather(*(function(item) for item in items))
+
+    async def get_desk_ids(self):
+        return await self._get(self.base_path)
+
+    async def list_desk_ids(self, status=None, manufacturer=None, band=None):
+        """Return the IDs of desks matching the filters, following the page cursor to the end."""
+        params = {name: value for name, value in (("status", status), ("manufacturer", manufacturer), ("band", band)) if value}
+        params["limit"] = self.PAGE_SIZE
+        desk_ids = []
+        while True:
+            page = await self._get(f"{self.base_path}?{urlencode(params)}")
+            desk_ids.extend(page["desks"])
+            if not page["next_cursor"]:
+                return desk_ids
+            params["cursor"] = page["next_cursor"]
+
+    async def get_desk(self, desk_id):
+        return await self._get_conditional(self._desk_path(desk_id))
+
+    async def get_desk_category(self, desk_id, category):
+        return await self._get_conditional(self._desk_path(desk_id, category))
+
+    async def get_fleet_snapshot(self):
+        """Return ({desk ID: data}, change feed cursor) from one request, or None if the server has no bulk endpoint."""
+        if self.supports_bulk is False:
+            return None
+        status, headers, body = await self.request("GET", f"{self.base_path}?expand=all", headers=self._request_headers())
+        return self._snapshot_result(status, headers, body)
+
+    async def get_desks(self, desk_ids=None):
+        """Return {desk ID: data} for the given desks, or for every desk."""
+        if desk_ids is None or len(desk_ids) > self.BULK_THRESHOLD:
+            snapshot = await self.get_fleet_snapshot()
+            if snapshot is not None:
+                desks = snapshot[0]
+                return desks if desk_ids is None else {desk_id: desks[desk_id] for desk_id in desk_ids if desk_id in desks}
+        if desk_ids is None:
+            desk_ids = await self.get_desk_ids()
+        return dict(zip(desk_ids, await self.map(self.get_desk, desk_ids)))
+
+    async def set_position(self, desk_id, position_mm):
+        status, headers, body = await self.request("PUT", self._desk_path(desk_id, "state"),
+                                                   self._encode({"position_mm": position_mm}), self._request_headers(body=True))
+        return self._decode(status, headers, body)
+
+    async def set_positions(self, positions):
+        """Move many desks, given as {desk ID: position}, with one batch request when the server supports it.
+
+        Returns the batch result: {"accepted": [...], "errors": [...]}.
+        """
+        commands = [{"desk_id": desk_id, "position_mm": position_mm} for desk_id, position_mm in positions.items()]
+        if self.supports_batch is not False:
+            status, headers, body = await self.request("PUT", self.base_path, self._encode(commands), self._request_headers(body=True))
+            if not self._batch_unsupported(status):
+                self.supports_batch = True
+                return self._decode(status, headers, body)
+            self.supports_batch = False
+
+        async def move(command):
+            try:
+                await self.set_position(command["desk_id"], command["position_mm"])
+                return None
+            except DeskApiError as e:
+                return {"desk_id": command["desk_id"], "error": e.message}
+        results = await self.map(move, commands)
+        return {
+            "accepted": [command for command, error in zip(commands, results) if error is None],
+            "errors": [error for error in results if error is not None],
+        }
+
+    async def sync(self):
+        """Bring `fleet` up to date and return what changed: {"desks", "removed", "resync"}.
+
+        The first call, and any call after the change feed lost our cursor, loads the whole fleet.
+        """
+        if self.cursor is not None:
+            status, headers, body = await self.request("GET", f"{self.base_path}/changes?{urlencode({'since': self.cursor})}",
+                                                       headers=self._request_headers())
+            if status != 410:
+                return self._apply_changes(self._decode(status, headers, body))
+        snapshot = await self.get_fleet_snapshot()
+        if snapshot is None:
+            return self._load_fleet(await self.get_desks(await self.get_desk_ids()), None)
+        return self._load_fleet(*snapshot)
+
+    async def close(self):
+        while self.idle:
+            self.idle.pop().close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
@@ -1,83 +1,290 @@
+import itertools
+import sys
 import threading
 import random
 import logging
+from array import array
+from enum import Enum
+from metrics import REGISTRY as METRICS
 
 logger = logging.getLogger(__name__)
 
-class Desk:
+class DeskStatus(Enum):
+    NORMAL = "Normal"
+    COLLISION = "Collision"
+
+def round_fraction(value):
+    """Round a position or clock advanced in fractional steps to three decimals, as an int when it is whole.
+
+    Desks keep the exact values; they are only rounded when shown or saved.
+    """
+    value = round(value, 3)
+    return int(value) if value == int(value) else value
+
+class DeskSpec:
+    """Manufacturer and travel limits, shared by every desk built with the same ones."""
+    __slots__ = ("manufacturer", "min_position", "max_position", "sit_stand_position")
+
+    _interned = {}
+    _interned_lock = threading.Lock()
+
+    def __init__(self, manufacturer, min_position, max_position):
+        self.manufacturer = manufacturer
+        self.min_position = min_position
+        self.max_position = max_position
+        self.sit_stand_position = (max_position - min_position) / 2 + min_position
+
+    @classmethod
+    def get(cls, manufacturer, min_position, max_position):
+        key = (manufacturer, min_position, max_position)
+        spec = cls._interned.get(key)
+        if spec is None:
+            with cls._interned_lock:
+                spec = cls._interned.setdefault(key, cls(sys.intern(manufacturer), min_position, max_position))
+        return spec
+
+class DeskViews:
+    """The dict-shaped API views of a desk's fields, shared by live desks and their frozen copies."""
+    CATEGORIES = ("config", "state", "usage", "lastErrors")
+
+    # Flags that only change when a saved state is loaded, kept as bits of `flags`.
+    POSITION_LOST = 1
+    OVERLOAD_PROTECTION_UP = 2
+    OVERLOAD_PROTECTION_DOWN = 4
+    FLAG_NAMES = (("isPositionLost", POSITION_LOST), ("isOverloadProtectionUp", OVERLOAD_PROTECTION_UP),
+                  ("isOverloadProtectionDown", OVERLOAD_PROTECTION_DOWN))
+
+    __slots__ = ()
+
+    @property
+    def min_position(self):
+        return self.spec.min_position
+
+    @property
+    def max_position(self):
+        return self.spec.max_position
+
+    @property
+    def sit_stand_position(self):
+        return self.spec.sit_stand_position
+
+    @property
+    def config(self):
+        spec = self.spec
+        return {
+            "name": self.name,
+            "manufacturer": spec.manufacturer,
+            "min_position_mm": spec.min_position,
+            "max_position_mm": spec.max_position,
+        }
+
+    @property
+    def state(self):
+        flags = self.flags
+        return {
+            "position_mm": round_fraction(self.position_mm),
+            "speed_mms": self.speed_mms,
+            "status": self.status.value,
+            "isPositionLost": bool(flags & self.POSITION_LOST),
+            "isOverloadProtectionUp": bool(flags & self.OVERLOAD_PROTECTION_UP),
+            "isOverloadProtectionDown": bool(flags & self.OVERLOAD_PROTECTION_DOWN),
+            "isAntiCollision": self.anti_collision,
+        }
+
+    @property
+    def usage(self):
+        return {
+            "activationsCounter": self.activations_counter,
+            "sitStandCounter": self.sit_stand_counter,
+        }
+
+    @property
+    def lastErrors(self):
+        errors = self.errors
+        return [{"time_s": errors[i], "errorCode": errors[i + 1]} for i in range(0, len(errors), 2)]
+
+    def _build_data(self):
+        return {
+            "config": self.config,
+            "state": self.state,
+            "usage": self.usage,
+            "lastErrors": self.lastErrors,
+        }
+
+class FrozenDesk(DeskViews):
+    """Copy of a desk's data at one point in time, published to readers that do not take any lock."""
+    __slots__ = (
+        "desk_id", "name", "spec", "position_mm", "speed_mms", "status", "anti_collision", "flags",
+        "activations_counter", "sit_stand_counter", "errors", "target_position_mm", "version",
+    )
+
+    def __init__(self, desk):
+        self.desk_id = desk.desk_id
+        self.name = desk.name
+        self.spec = desk.spec
+        self.position_mm = desk.position_mm
+        self.speed_mms = desk.speed_mms
+        self.status = desk.status
+        self.anti_collision = desk.anti_collision
+        self.flags = desk.flags
+        self.activations_counter = desk.activations_counter
+        self.sit_stand_counter = desk.sit_stand_counter
+        # Desks replace their error history instead of changing it, so it can be shared.
+        self.errors = desk.errors
+        self.target_position_mm = desk.target_position_mm
+        self.version = desk.version
+
+    def get_category(self, category):
+        """Get one category of the desk's data, or None if there is no such category."""
+        return getattr(self, category) if category in self.CATEGORIES else None
+
+    def get_data(self):
+        """Get the desk's data as the API returns it."""
+        return self._build_data()
+
+class Desk(DeskViews):
+    """One simulated desk, stored in fixed slots.
+
+    The dict-shaped API view (`config`, `state`, `usage`, `lastErrors`) is built on access, so a desk
+    costs a few hundred bytes instead of several KB. Desks share their spec, their name string when
+    names repeat, and a lock from a fixed pool of lock stripes.
+    """
     DEFAULT_SPEED_MMS = 32
     COLLISION_CHANCE = 0.03
     MAX_ERROR_COUNT = 10
     ERROR_CODE_E93 = 93
 
-    def __init__(self, desk_id, name, manufacturer, initial_position=680, min_position=680, max_position=1320):
+    # A desk this close to its target after its steps arrives there, as fractional steps are not exact in floating point.
+    POSITION_TOLERANCE_MM = 1e-6
+
+    # Error history as flat (time_s, errorCode) pairs, newest first; new desks share this initial one.
+    INITIAL_ERRORS = (120, ERROR_CODE_E93)
+
+    LOCK_STRIPES = 1024
+    _locks = [threading.RLock() for _ in range(LOCK_STRIPES)]
+
+    # Shared by all desks so a version is never reused, even by a desk re-created under the same ID.
+    _versions = itertools.count(1)
+
+    __slots__ = (
+        "desk_id", "name", "spec", "lock", "position_mm", "speed_mms", "status", "anti_collision", "flags",
+        "activations_counter", "sit_stand_counter", "errors", "target_position_mm", "clock_origin_s", "clock_steps",
+        "clock_step_s", "clock_tick", "collision_occurred", "version", "change_listener", "target_listener",
+    )
+
+    def __init__(self, desk_id, name, manufacturer, initial_position=680, min_position=680, max_position=1320, log=True):
         self.desk_id = desk_id
-        self.config = {
-            "name": name,
-            "manufacturer": manufacturer,
-            "min_position_mm": min_position,
-            "max_position_mm": max_position,
-        }
-        self.state = {
-            "position_mm": initial_position,
-            "speed_mms": 0,
-            "status": "Normal",
-            "isPositionLost": False,
-            "isOverloadProtectionUp": False,
-            "isOverloadProtectionDown": False,
-            "isAntiCollision": False,
-        }
-        self.usage = {
-            "activationsCounter": 25,
-            "sitStandCounter": 1,
-        }
-        self.lastErrors = [
-            {"time_s": 120, "errorCode": 93},
-        ]
-        self.lock = threading.RLock()
+        self.name = sys.intern(name)
+        self.spec = DeskSpec.get(manufacturer, min_position, max_position)
+        self.lock = self._locks[hash(desk_id) % self.LOCK_STRIPES]
+        self.position_mm = initial_position
+        self.speed_mms = 0
+        self.status = DeskStatus.NORMAL
+        self.anti_collision = False
+        self.flags = 0
+        self.activations_counter = 25
+        self.sit_stand_counter = 1
+        self.errors = self.INITIAL_ERRORS
         self.target_position_mm = initial_position
-        self.min_position = min_position
-        self.max_position = max_position
-        self.sit_stand_position = (max_position - min_position) / 2 + min_position
-        self.clock_s = 180
+        self.clock_origin_s = 180
+        self.clock_steps = 0
+        self.clock_step_s = 1
+        self.clock_tick = 0
         self.collision_occurred = False
+        self.version = next(self._versions)
+        self.change_listener = None
+        self.target_listener = None
 
-        logger.info(f"Desk initialized: ID={desk_id}, Name={name}, Manufacturer={manufacturer}, "
-            f"Position={initial_position}, Min={min_position}, Max={max_position}")
-
+        if log:
+            logger.info("Desk initialized: ID=%s, Name=%s, Manufacturer=%s, Position=%s, Min=%s, Max=%s",
+                desk_id, name, manufacturer, initial_position, min_position, max_position)
 
-    def get_target_position(self):
-        """Get the target position to move towards"""
+    def restore(self, data):
+        """Load state, usage counters, error history and clock from saved desk data."""
         with self.lock:
-            return self.target_position_mm
+            state = data["state"]
+            self.position_mm = self.target_position_mm = state["position_mm"]
+            self.speed_mms = state["speed_mms"]
+            self.status = DeskStatus(state["status"])
+            self.anti_collision = state["isAntiCollision"]
+            self.flags = sum(bit for name, bit in self.FLAG_NAMES if state.get(name))
+            self.activations_counter = data["usage"]["activationsCounter"]
+            self.sit_stand_counter = data["usage"]["sitStandCounter"]
+            errors = [value for error in data["lastErrors"][:self.MAX_ERROR_COUNT] for value in (error["time_s"], error["errorCode"])]
+            self.errors = self.INITIAL_ERRORS if tuple(errors) == self.INITIAL_ERRORS else array("q", errors)
+            self.clock_s = data["clock_s"]
 
-    def set_target_position(self, position_mm):
-        """Set the target position to move towards, respecting min and max limits."""
+    @property
+    def clock_s(self):
+        """Seconds of desk time, computed from the steps run since the clock was set so fractional steps never accumulate rounding errors."""
+        return self.clock_origin_s + self.clock_steps * self.clock_step_s
+
+    @clock_s.setter
+    def clock_s(self, value):
+        self.clock_origin_s = value
+        self.clock_steps = 0
+
+    def advance_clock(self, steps, step_s):
+        """Advance the clock by `steps` steps of `step_s` seconds each."""
+        if step_s != self.clock_step_s:
+            self.clock_origin_s = self.clock_s
+            self.clock_steps = 0
+            self.clock_step_s = step_s
+        self.clock_steps += steps
+
+    def _mark_changed(self, *categories):
+        """Bump the version after the given categories changed and notify the change listener, if any."""
+        self.version = next(self._versions)
+        if self.change_listener:
+            self.change_listener(self.desk_id, categories)
+
+    def set_target_position(self, position_mm, log=True):
+        """Set the target position to move towards, respecting min and max limits, and return the accepted target."""
         with self.lock:
-            self.target_position_mm = max(self.min_position, min(position_mm, self.max_position))
-            logger.info(f"Desk target position set: ID={self.desk_id}, Requested={position_mm}, Accepted={self.target_position_mm}")
-            if position_mm != self.state["position_mm"]:
-                self.usage["activationsCounter"] += 1
-                logger.info(f"Desk activated: ID={self.desk_id}, ActivationCounter={self.usage['activationsCounter']}")
+            self.target_position_mm = max(self.spec.min_position, min(position_mm, self.spec.max_position))
+            if self.target_listener:
+                self.target_listener(self.desk_id)
+            if log:
+                logger.info("Desk target position set: ID=%s, Requested=%s, Accepted=%s",
+                            self.desk_id, position_mm, self.target_position_mm, extra={"rate_key": self.desk_id})
+            if position_mm != self.position_mm:
+                self.activations_counter += 1
+                self._mark_changed("usage")
+                if log:
+                    logger.info("Desk activated: ID=%s, ActivationCounter=%s",
+                                self.desk_id, self.activations_counter, extra={"rate_key": self.desk_id})
+            return self.target_position_mm
 
     def _generate_error(self):
         """Generate an error during movement."""
         with self.lock:
-            self.lastErrors.insert(0, {"time_s": self.clock_s, "errorCode": self.ERROR_CODE_E93})
-            if len(self.lastErrors) > self.MAX_ERROR_COUNT:
-                self.lastErrors.pop()
+            errors = array("q", (int(round_fraction(self.clock_s)), self.ERROR_CODE_E93))
+            errors.extend(self.errors[:2 * (self.MAX_ERROR_COUNT - 1)])
+            self.errors = errors
 
-            self.state["isAntiCollision"] = True
-            self.state["status"] = "Collision"
+            self.anti_collision = True
+            self.status = DeskStatus.COLLISION
             self.collision_occurred = True
+            self._mark_changed("state", "lastErrors")
+            METRICS.inc("simulator_collisions_total")
+
+            logger.error("Desk collision detected: ID=%s, Time=%s, Position=%s", self.desk_id,
+                         round_fraction(self.clock_s), round_fraction(self.position_mm), extra={"rate_key": self.desk_id})
+
+    def is_settled(self):
+        """Whether update() would only advance the clock: the desk is stopped at its target and not recovering from a collision."""
+        return self.position_mm == self.target_position_mm and self.speed_mms == 0 and not self.collision_occurred
 
-            logger.error(f"Desk collision detected: ID={self.desk_id}, Time={self.clock_s}, Position={self.state['position_mm']}")
+    @classmethod
+    def collision_chance(cls, step_s):
+        """The chance of a collision in one step of movement lasting `step_s` seconds."""
+        return cls.COLLISION_CHANCE if step_s == 1 else 1 - (1 - cls.COLLISION_CHANCE) ** step_s
 
-    def update(self):
+    def update(self, step_s=1):
         """Update clock and position gradually toward target_position_mm within limits, increment sitStandCounter on crossing."""
-        """Must be called every 1s"""
+        """Must be called once per tick, with the seconds of desk time the tick covers."""
         with self.lock:
-            self.clock_s += 1
+            self.advance_clock(1, step_s)
 
             successful_movement = False
 
@@ -85,58 +292,85 @@ class Desk:
                 self.collision_occurred = False
                 return
 
-            previous_position = self.state["position_mm"]
-            if self.state["position_mm"] < self.target_position_mm:
-                self.state["position_mm"] += min(self.DEFAULT_SPEED_MMS, self.target_position_mm - self.state["position_mm"])
-                self.state["position_mm"] = min(self.state["position_mm"], self.max_position)
-                self.state["speed_mms"] = self.DEFAULT_SPEED_MMS
+            spec = self.spec
+            previous_position = self.position_mm
+            previous_speed = self.speed_mms
+            previous_status = self.status
+            previous_sit_stand_counter = self.sit_stand_counter
+
+            step_mm = self.DEFAULT_SPEED_MMS * step_s
+            if self.position_mm < self.target_position_mm:
+                if self.target_position_mm - self.position_mm <= step_mm + self.POSITION_TOLERANCE_MM:
+                    self.position_mm = self.target_position_mm
+                else:
+                    self.position_mm += step_mm
+                self.position_mm = min(self.position_mm, spec.max_position)
+                self.speed_mms = self.DEFAULT_SPEED_MMS
                 successful_movement = True
-                logger.info(f"Desk moving up: ID={self.desk_id}, Position={self.state['position_mm']}")
-            elif self.state["position_mm"] > self.target_position_mm:
-                self.state["position_mm"] -= min(self.DEFAULT_SPEED_MMS, self.state["position_mm"] - self.target_position_mm)
-                self.state["position_mm"] = max(self.state["position_mm"], self.min_position)
-                self.state["speed_mms"] = -self.DEFAULT_SPEED_MMS
+                logger.info("Desk moving up: ID=%s, Position=%s", self.desk_id, round_fraction(self.position_mm), extra={"rate_key": self.desk_id})
+            elif self.position_mm > self.target_position_mm:
+                if self.position_mm - self.target_position_mm <= step_mm + self.POSITION_TOLERANCE_MM:
+                    self.position_mm = self.target_position_mm
+                else:
+                    self.position_mm -= step_mm
+                self.position_mm = max(self.position_mm, spec.min_position)
+                self.speed_mms = -self.DEFAULT_SPEED_MMS
                 successful_movement = True
-                logger.info(f"Desk moving down: ID={self.desk_id}, Position={self.state['position_mm']}")
+                logger.info("Desk moving down: ID=%s, Position=%s", self.desk_id, round_fraction(self.position_mm), extra={"rate_key": self.desk_id})
             else:
-                self.state["speed_mms"] = 0
+                self.speed_mms = 0
 
-            if (previous_position < self.sit_stand_position <= self.state["position_mm"]) or \
-               (previous_position > self.sit_stand_position >= self.state["position_mm"]):
-                self.usage["sitStandCounter"] += 1
-                logger.info(f"Desk crossed sit/stand position: ID={self.desk_id}, SitStandCounter={self.usage['sitStandCounter']}")
+            if (previous_position < spec.sit_stand_position <= self.position_mm) or \
+               (previous_position > spec.sit_stand_position >= self.position_mm):
+                self.sit_stand_counter += 1
+                logger.info("Desk crossed sit/stand position: ID=%s, SitStandCounter=%s",
+                            self.desk_id, self.sit_stand_counter, extra={"rate_key": self.desk_id})
 
 
             if successful_movement:
-                if self.state["isAntiCollision"]:
-                    self.state["isAntiCollision"] = False
-                    self.state["status"] = "Normal"
-                    logger.info(f"Desk reset from collision: ID={self.desk_id}, Time={self.clock_s}, Position={self.state['position_mm']}")
-                elif random.random() < self.COLLISION_CHANCE:
+                if self.anti_collision:
+                    self.anti_collision = False
+                    self.status = DeskStatus.NORMAL
+                    logger.info("Desk reset from collision: ID=%s, Time=%s, Position=%s", self.desk_id,
+                                round_fraction(self.clock_s), round_fraction(self.position_mm), extra={"rate_key": self.desk_id})
+                elif random.random() < self.collision_chance(step_s):
                     self._generate_error()
-                    if self.state["speed_mms"] > 0:
-                        self.state["position_mm"] = max(self.state["position_mm"] - 10, self.min_position)
-                    elif self.state["speed_mms"] < 0:
-                        self.state["position_mm"] = min(self.state["position_mm"] + 10, self.max_position)
+                    if self.speed_mms > 0:
+                        self.position_mm = max(self.position_mm - 10, spec.min_position)
+                    elif self.speed_mms < 0:
+                        self.position_mm = min(self.position_mm + 10, spec.max_position)
+
+                    self.target_position_mm = self.position_mm
+                    self.speed_mms = 0
 
-                    self.target_position_mm = self.state["position_mm"]
-                    self.state["speed_mms"] = 0
+            state_changed = (self.position_mm != previous_position or self.speed_mms != previous_speed or
+                             self.status != previous_status)
+            usage_changed = self.sit_stand_counter != previous_sit_stand_counter
+            if state_changed and usage_changed:
+                self._mark_changed("state", "usage")
+            elif state_changed:
+                self._mark_changed("state")
+            elif usage_changed:
+                self._mark_changed("usage")
+
+    def get_category(self, category):
+        """Get one category of the desk's data, or None if there is no such category."""
+        if category not in self.CATEGORIES:
+            return None
+        with self.lock:
+            return getattr(self, category)
 
     def get_data(self):
         """Get a snapshot of the desk's data."""
         with self.lock:
-            return {
-                "config": self.config,
-                "state": self.state,
-                "usage": self.usage,
-                "lastErrors": self.lastErrors,
-            }
-
-    def update_category(self, category, data):
-        """Update a specific category of the desk."""
-        with self.lock:
-            if category == "state" and "position_mm" in data:
-                self.set_target_position(data["position_mm"])
-                return True
+            return self._build_data()
+
+    def get_snapshot(self):
+        """Get a copy of the desk's data that later updates will not modify."""
+        # The views are built on every call, so a snapshot is just the data.
+        return self.get_data()
 
-            return False
+    def freeze(self):
+        """Get a read-only copy of the desk for publishing to lock-free readers."""
+        with self.lock:
+            return FrozenDesk(self)
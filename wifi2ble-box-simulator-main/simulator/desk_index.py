@@ -0,0 +1,248 @@
+import bisect
+import itertools
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SortedIdSet:
+    """Desk IDs kept in sorted order, so a page can start after a cursor by bisection.
+
+    The IDs are split into sorted segments of about SEGMENT_SIZE. A frozen() copy shares the segments,
+    and the set copies a shared segment before changing it, so freezing and changing the set cost a
+    segment instead of every ID.
+    """
+    SEGMENT_SIZE = 512
+
+    def __init__(self):
+        self._load([])
+
+    def _load(self, ids):
+        """Replace the contents with the sorted list `ids`."""
+        size = self.SEGMENT_SIZE
+        self.segments = [ids[start:start + size] for start in range(0, len(ids), size)]
+        self.maxes = [segment[-1] for segment in self.segments]
+        # Whether each segment is this set's own, rather than shared with a frozen copy.
+        self.owned = [True] * len(self.segments)
+        self.count = len(ids)
+        self.frozen_copy = None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.segments)
+
+    def _locate(self, desk_id):
+        """Return the index of the segment that holds `desk_id`, or would hold it; the set must not be empty."""
+        return min(bisect.bisect_left(self.maxes, desk_id), len(self.maxes) - 1)
+
+    def __contains__(self, desk_id):
+        if not self.count:
+            return False
+        segment = self.segments[self._locate(desk_id)]
+        position = bisect.bisect_left(segment, desk_id)
+        return position < len(segment) and segment[position] == desk_id
+
+    def _own(self, index):
+        """Return segment `index` for changing, copied first if a frozen copy shares it."""
+        if not self.owned[index]:
+            self.segments[index] = list(self.segments[index])
+            self.owned[index] = True
+        self.frozen_copy = None
+        return self.segments[index]
+
+    def add(self, desk_id):
+        if not self.count:
+            self._load([desk_id])
+            return
+        index = self._locate(desk_id)
+        segment = self.segments[index]
+        position = bisect.bisect_left(segment, desk_id)
+        if position < len(segment) and segment[position] == desk_id:
+            return
+        segment = self._own(index)
+        segment.insert(position, desk_id)
+        self.maxes[index] = segment[-1]
+        self.count += 1
+        if len(segment) > 2 * self.SEGMENT_SIZE:
+            half = len(segment) // 2
+            self.segments[index:index + 1] = [segment[:half], segment[half:]]
+            self.maxes[index:index + 1] = [segment[half - 1], segment[-1]]
+            self.owned[index:index + 1] = [True, True]
+
+    def discard(self, desk_id):
+        if not self.count:
+            return
+        index = self._locate(desk_id)
+        segment = self.segments[index]
+        position = bisect.bisect_left(segment, desk_id)
+        if position == len(segment) or segment[position] != desk_id:
+            return
+        segment = self._own(index)
+        del segment[position]
+        self.count -= 1
+        if segment:
+            self.maxes[index] = segment[-1]
+        else:
+            del self.segments[index], self.maxes[index], self.owned[index]
+
+    def update(self, desk_ids):
+        """Add many IDs, with one sort instead of one insertion each when they are many."""
+        desk_ids = set(desk_ids)
+        if len(desk_ids) * 8 < self.count:
+            for desk_id in desk_ids:
+                self.add(desk_id)
+        elif desk_ids:
+            self._load(sorted(desk_ids.union(self)))
+
+    def difference_update(self, desk_ids):
+        """Remove many IDs, with one pass over the set instead of one removal each when they are many."""
+        desk_ids = set(desk_ids)
+        if len(desk_ids) * 8 < self.count:
+            for desk_id in desk_ids:
+                self.discard(desk_id)
+        elif desk_ids:
+            self._load([desk_id for desk_id in self if desk_id not in desk_ids])
+
+    def iter_after(self, after=None):
+        """Iterate over the IDs in order, starting after `after` when given."""
+        segments = self.segments
+        if after is None:
+            index, position = 0, 0
+        else:
+            index = bisect.bisect_right(self.maxes, after)
+            position = bisect.bisect_right(segments[index], after) if index < len(segments) else 0
+        for segment in itertools.islice(segments, index, None):
+            yield from itertools.islice(segment, position, None)
+            position = 0
+
+    def frozen(self):
+        """Return a copy that is never modified, reused until this set next changes."""
+        if self.frozen_copy is None:
+            copy = SortedIdSet.__new__(SortedIdSet)
+            copy.segments = list(self.segments)
+            copy.maxes = list(self.maxes)
+            copy.owned = [False] * len(self.segments)
+            copy.count = self.count
+            copy.frozen_copy = copy
+            self.owned = [False] * len(self.segments)
+            self.frozen_copy = copy
+        return self.frozen_copy
+
+class DeskIndex:
+    """Active desk IDs plus secondary indexes by status, manufacturer and sit/stand band.
+
+    The indexes are updated incrementally as desks are added, removed, powered off or change state,
+    so listings never scan the whole fleet. Callers serialize access; DeskManager holds its lock.
+    Readers without the lock page through a frozen() copy instead, which shares the unchanged
+    segments of every ID set.
+    """
+    FILTERS = ("status", "manufacturer", "band")
+    BANDS = ("sitting", "standing")
+
+    def __init__(self):
+        self.active = SortedIdSet()
+        self.indexes = {name: {} for name in self.FILTERS}
+        self.keys = {}
+
+    @staticmethod
+    def desk_keys(desk):
+        """Return the (status, manufacturer, band) a desk is currently indexed under."""
+        band = "standing" if desk.position_mm >= desk.spec.sit_stand_position else "sitting"
+        return desk.status.value, desk.spec.manufacturer, band
+
+    def add(self, desk):
+        self.active.add(desk.desk_id)
+        self.refresh(desk)
+
+    def add_many(self, desks):
+        """Index many new desks at once, sorting each affected index once."""
+        desks = [desk for desk in desks if desk.desk_id not in self.keys]
+        self.active.update(desk.desk_id for desk in desks)
+        groups = {}
+        for desk in desks:
+            keys = self.desk_keys(desk)
+            self.keys[desk.desk_id] = keys
+            for name, value in zip(self.FILTERS, keys):
+                groups.setdefault((name, value), []).append(desk.desk_id)
+        for (name, value), desk_ids in groups.items():
+            self.indexes[name].setdefault(value, SortedIdSet()).update(desk_ids)
+
+    def refresh(self, desk):
+        """Move an active desk to the index entries matching its current state."""
+        desk_id = desk.desk_id
+        if desk_id not in self.active:
+            return
+        new_keys = self.desk_keys(desk)
+        old_keys = self.keys.get(desk_id)
+        if new_keys == old_keys:
+            return
+        for name, old_value, new_value in zip(self.FILTERS, old_keys or (None,) * len(self.FILTERS), new_keys):
+            if old_value != new_value:
+                if old_keys is not None:
+                    self._discard_from(name, old_value, desk_id)
+                self.indexes[name].setdefault(new_value, SortedIdSet()).add(desk_id)
+        self.keys[desk_id] = new_keys
+
+    def discard(self, desk_id):
+        """Remove a desk that was removed or powered off from every index."""
+        self.active.discard(desk_id)
+        old_keys = self.keys.pop(desk_id, None)
+        if old_keys is not None:
+            for name, value in zip(self.FILTERS, old_keys):
+                self._discard_from(name, value, desk_id)
+
+    def discard_many(self, desk_ids):
+        """Remove many desks from every index, filtering each affected index once."""
+        self.active.difference_update(desk_ids)
+        groups = {}
+        for desk_id in desk_ids:
+            old_keys = self.keys.pop(desk_id, None)
+            if old_keys is not None:
+                for name, value in zip(self.FILTERS, old_keys):
+                    groups.setdefault((name, value), []).append(desk_id)
+        for (name, value), removed in groups.items():
+            entries = self.indexes[name].get(value)
+            if entries is not None:
+                entries.difference_update(removed)
+                if not entries:
+                    del self.indexes[name][value]
+
+    def _discard_from(self, name, value, desk_id):
+        entries = self.indexes[name].get(value)
+        if entries is not None:
+            entries.discard(desk_id)
+            if not entries:
+                del self.indexes[name][value]
+
+    def frozen(self):
+        """Return a read-only copy for paging without a lock, sharing the ID set segments unchanged since the last one."""
+        index = DeskIndex()
+        index.active = self.active.frozen()
+        index.indexes = {name: {value: entries.frozen() for value, entries in values.items()}
+                         for name, values in self.indexes.items()}
+        return index
+
+    def page(self, filters, after=None, limit=100):
+        """Return up to `limit` desk IDs matching every filter, in ID order after `after`, and the next cursor.
+
+        The walk starts from the smallest matching index, so listing a rare status only touches desks with that status.
+        The next cursor is None once the listing is complete.
+        """
+        candidates = [self.indexes[name].get(value) for name, value in filters.items()]
+        if any(entries is None for entries in candidates):
+            return [], None
+        candidates.sort(key=len)
+        base = candidates[0] if candidates else self.active
+        others = candidates[1:]
+
+        page = []
+        more = False
+        for desk_id in base.iter_after(after):
+            if len(page) >= limit:
+                more = True
+                break
+            if all(desk_id in entries for entries in others):
+                page.append(desk_id)
+        next_cursor = page[-1] if page and more else None
+        return page, next_cursor
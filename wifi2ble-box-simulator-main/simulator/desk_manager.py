@@ -1,106 +1,374 @@
 import threading
 import time
 import json
+import struct
 import os
 import random
 import logging
-from desk import Desk
-from users import SeatedUser, StandingUser, ActiveUser, UserType
+from collections import deque
+from active_set import ActiveSet
+from desk import Desk, round_fraction
+from desk_index import DeskIndex
+from event_stream import EventBroadcaster
+from fleet_snapshot import FleetSnapshot
+from metrics import REGISTRY as METRICS, InstrumentedLock
+from scheduler import EventScheduler
+import state_file
+import population
+import vector_engine
+from users import SeatedUser, StandingUser, ActiveUser, MarkovUser, UserType
 
 logger = logging.getLogger(__name__)
 
+def generate_desk_id():
+    return ":".join(f"{random.randint(0, 255):02x}" for _ in range(6))
+
+def generate_desk_name():
+    return f"DESK {random.randint(1000, 9999)}"
+
 class DeskManager:
     STATE_FILE = "data/desks_state.json"
+    BINARY_STATE_FILE = "data/desks_state.bin"
     SECONDS_PER_DAY = 86400
     DAY_START_HOUR = 6
     NIGHT_START_HOUR = 18
-    POWER_OFF_CHANCE = 0.03
+    # Simulated seconds between random power failures on average, about one every 167 ticks at the default speed.
+    POWER_OFF_MEAN_INTERVAL_S = 10000
+    JOURNAL_MAX_RECORDS = 100000
+    # Ticks a late simulation runs back to back to catch up; when further behind, the missed ticks are skipped.
+    MAX_CATCH_UP_TICKS = 5
 
-    def __init__(self, simulation_speed=60):
+    def __init__(self, simulation_speed=60, shard=None, tick_engine="object", tick_hz=1, desk_time="real", behavior_engine="object", seed=None,
+                 state_format="json"):
+        self.shard = shard
+        self.state_format = state_format
+        self.tick_hz = tick_hz
+        self.desk_time = desk_time
+        self.tick_origin_s = None
+        self.tick_index = 0
+        # Bumped whenever desks are added or removed, so the numpy tick engine knows to reload its arrays.
+        self.fleet_version = 0
+        self.vector_engine = vector_engine.VectorTickEngine(seed=seed) if tick_engine == "numpy" else None
+        # With the population engine, every user is a MarkovUser and all of them decide in one batched step.
+        self.population = population.PopulationBehaviorEngine(seed=seed) if behavior_engine == "population" else None
+        # The object engine only updates desks in the active set; the numpy engine updates all of them.
+        self.active_set = ActiveSet()
+        self.changed_targets = set()
         self.desks = {}
         self.users = {}
         self.powered_off_desks = {}
-        self.update_thread = None
-        self.simulation_thread = None
-        self.power_off_thread = None
-        self.stop_event = threading.Event()
-        self.lock = threading.Lock()
-        self.current_time_s = 43200
+        self.index = DeskIndex()
+        self.changes_lock = threading.Lock()
+        self.pending_changes = {}
+        # Entries before journal_start were dropped; published snapshots read ranges of the list, so it only
+        # grows at the end and is replaced by a copy of the live entries when compacted.
+        self.journal = []
+        self.journal_start = 0
+        self.journal_records = 0
+        self.journal_cursor = 0
+        self.journal_floor = 0
+        # Request threads read the latest published snapshot and queue their writes for the next tick.
+        self.snapshot = FleetSnapshot()
+        self.commands = deque()
+        self.events = EventBroadcaster()
+        # Optional trajectory writer told about every tick's desk changes, used by headless runs.
+        self.recorder = None
+        # Headless runs have no readers and turn off publishing a snapshot every tick.
+        self.publish_snapshots = True
+        self.lock = InstrumentedLock("desk_manager")
+        # Ticks, user wake-ups and power failures all run as events of one scheduler on one thread.
+        self.scheduler = EventScheduler(self.lock, now_s=43200)
+        self.scheduler_thread = None
         self.simulation_speed = simulation_speed
         self.load_state()
+        # Seconds of desk time covered by one tick: real seconds, or simulated ones so desks move at the simulation speed.
+        desk_step_s = (self.simulation_speed if desk_time == "simulated" else 1) / tick_hz
+        self.desk_step_s = int(desk_step_s) if desk_step_s.is_integer() else desk_step_s
+        self.active_set.step_s = self.desk_step_s
+        if self.vector_engine:
+            self.vector_engine.step_s = self.desk_step_s
+        with self.lock:
+            self._publish(self.desks)
+        METRICS.register_collector(self._collect_metrics)
+
+    @property
+    def current_time_s(self):
+        """The simulated time, in seconds, of the event being run or last run."""
+        return self.scheduler.now_s
+
+    @current_time_s.setter
+    def current_time_s(self, time_s):
+        self.scheduler.now_s = time_s
+
+    def owns_desk(self, desk_id):
+        """Whether this manager's shard owns the desk; always True without sharding."""
+        return self.shard is None or self.shard.owns(desk_id)
+
+    def new_desk_id(self):
+        """Generate an unused desk ID owned by this manager's shard."""
+        desk_id = generate_desk_id()
+        while desk_id in self.desks or not self.owns_desk(desk_id):
+            desk_id = generate_desk_id()
+        return desk_id
 
     def get_desk_ids(self):
-        """Return the list of desk IDs, excluding powered-off desks."""
-        with self.lock:
-            return [desk_id for desk_id in self.desks if desk_id not in self.powered_off_desks]
+        """Return the list of desk IDs in ID order, excluding powered-off desks."""
+        return list(self.snapshot.index.active)
 
-    def get_desk(self, desk_id):
-        """Get a desk by its ID."""
-        with self.lock:
-            if desk_id in self.powered_off_desks:
-                logger.warning(f"Desk ID={desk_id} is currently powered off.")
-                return None
-            return self.desks.get(desk_id)
+    def list_desk_ids(self, filters=None, after=None, limit=100):
+        """Return one page of active desk IDs matching the filters, and the cursor of the next page (None at the end)."""
+        return self.snapshot.index.page(filters or {}, after, limit)
 
     def get_desk_data(self, desk_id):
-        """Get a desk's data snapshot by its ID."""
-        logger.debug(f"Retrieving data for desk ID={desk_id}.")
-        desk = self.get_desk(desk_id)
+        """Get a desk's data, as of the latest published snapshot, by its ID."""
+        logger.debug("Retrieving data for desk ID=%s.", desk_id)
+        desk = self.snapshot.get_desk(desk_id)
         return desk.get_data() if desk else None
 
+    def get_desk_version(self, desk_id):
+        """Get a desk's data version by its ID, or None if the desk is unavailable."""
+        desk = self.snapshot.get_desk(desk_id)
+        return desk.version if desk else None
+
+    def get_fleet_snapshot(self):
+        """Return the journal cursor, the number of active desks and an iterator of their (desk ID, data) pairs.
+
+        Everything comes from one published snapshot, which never changes, so the data of each desk is
+        only built as the iterator reaches it.
+        """
+        snapshot = self.snapshot
+        desk_ids = snapshot.index.active
+        return snapshot.cursor, len(desk_ids), ((desk_id, snapshot.get_desk(desk_id).get_data()) for desk_id in desk_ids)
+
+    def get_changes_since(self, cursor):
+        """Return the current journal cursor with the desks changed after `cursor`.
+
+        Changed desks map to the current data of their changed categories; desks that were removed
+        or powered off are listed separately. Returns None if the journal no longer covers `cursor`.
+        """
+        return self.snapshot.get_changes_since(cursor)
+
     def get_desk_category(self, desk_id, category):
-        """Get a specific category from a desk."""
-        desk = self.get_desk(desk_id)
-        if desk:
-            data = desk.get_data()
-            return data.get(category)
-        return None
+        """Get a specific category from a desk, as of the latest published snapshot."""
+        desk = self.snapshot.get_desk(desk_id)
+        return desk.get_category(category) if desk else None
 
     def update_desk_category(self, desk_id, category, data):
-        """Update a specific category of a desk."""
-        desk = self.get_desk(desk_id)
-        return desk.update_category(category, data) if desk else False
+        """Queue an update of a specific category of a desk for the next tick.
+
+        Returns the accepted target position, or None if the desk or category does not exist.
+        """
+        desk = self.snapshot.get_desk(desk_id)
+        if desk is None or category != "state" or "position_mm" not in data:
+            return None
+        position_mm = data["position_mm"]
+        accepted = max(desk.min_position, min(position_mm, desk.max_position))
+        self.commands.append((desk_id, position_mm, True))
+        return accepted
+
+    def set_target_positions(self, commands):
+        """Queue (index, desk ID, position) commands for the next tick.
+
+        Returns the accepted targets and the per-desk errors, which carry the index of their command, both in command order.
+        """
+        accepted = []
+        errors = []
+        snapshot = self.snapshot
+        for index, desk_id, position_mm in commands:
+            desk = snapshot.get_desk(desk_id)
+            if desk is None:
+                errors.append({"index": index, "desk_id": desk_id, "error": "Desk not found"})
+                continue
+            accepted.append({"desk_id": desk_id, "position_mm": max(desk.min_position, min(position_mm, desk.max_position))})
+            self.commands.append((desk_id, position_mm, False))
+        logger.info("Batch command queued: %s accepted, %s rejected.", len(accepted), len(errors))
+        return accepted, errors
+
+    def _apply_commands(self):
+        """Apply the target position commands queued since the previous tick. Must hold self.lock."""
+        # Only the commands queued so far, so a steady stream of new ones cannot hold up the tick.
+        for _ in range(len(self.commands)):
+            desk_id, position_mm, log = self.commands.popleft()
+            desk = self.desks.get(desk_id)
+            if desk is None or desk_id in self.powered_off_desks:
+                logger.warning("Dropped command for unavailable desk ID=%s.", desk_id, extra={"rate_key": desk_id})
+                continue
+            desk.set_target_position(position_mm, log=log)
 
     def add_desk(self, desk_id, name, manufacturer, user_type: UserType):
         """Add a new desk with a unique ID."""
         with self.lock:
             if desk_id not in self.desks:
                 desk = Desk(desk_id, name, manufacturer)
-                self.desks[desk_id] = desk
-                self.users[desk_id] = self._create_user(desk, user_type)
-                logger.info(f"Desk ID={desk_id} added with user type {user_type}.")
+                self._attach(desk, self._create_user(desk, user_type))
+                self.fleet_version += 1
+                self.index.add(desk)
+                self._on_desk_changed(desk_id, Desk.CATEGORIES)
+                self._publish((desk_id,))
+                logger.info("Desk ID=%s added with user type %s.", desk_id, user_type)
                 return True
-            logger.warning(f"Desk ID={desk_id} already exists. Skipping addition.")
+            logger.warning("Desk ID=%s already exists. Skipping addition.", desk_id)
             return False
 
+    def add_desks(self, specs):
+        """Add many desks under a single lock acquisition, without per-desk logging.
+
+        Each spec is a dict with `user_type` and optional `desk_id`, `name`, `manufacturer`,
+        `initial_position`, `min_position` and `max_position`; a missing desk ID is generated.
+        Returns the added desk IDs and the per-desk errors, both in spec order.
+        """
+        added = []
+        errors = []
+        with self.lock:
+            new_desks = []
+            for index, spec in enumerate(specs):
+                desk_id = spec.get("desk_id")
+                if desk_id is None:
+                    desk_id = self.new_desk_id()
+                elif desk_id in self.desks:
+                    errors.append({"index": index, "desk_id": desk_id, "error": "Desk already exists"})
+                    continue
+                positions = {name: spec[name] for name in ("initial_position", "min_position", "max_position") if name in spec}
+                desk = Desk(desk_id, spec.get("name") or generate_desk_name(), spec.get("manufacturer", "Desk-O-Matic Co."),
+                            log=False, **positions)
+                self._attach(desk, self._create_user(desk, spec["user_type"]))
+                self._on_desk_changed(desk_id, Desk.CATEGORIES)
+                new_desks.append(desk)
+                added.append(desk_id)
+            self.fleet_version += 1
+            self.index.add_many(new_desks)
+            self._publish(added)
+        logger.info("Batch add applied: %s added, %s rejected.", len(added), len(errors))
+        return added, errors
+
+    def remove_desks(self, desk_ids):
+        """Remove many desks under a single lock acquisition, without per-desk logging.
+
+        Returns the removed desk IDs and the per-desk errors, both in request order.
+        """
+        removed = []
+        errors = []
+        with self.lock:
+            for desk_id in desk_ids:
+                desk = self.desks.pop(desk_id, None)
+                if desk is None:
+                    errors.append({"desk_id": desk_id, "error": "Desk not found"})
+                    continue
+                self._detach(desk)
+                self.powered_off_desks.pop(desk_id, None)
+                self._on_desk_changed(desk_id, ())
+                removed.append(desk_id)
+            self.fleet_version += 1
+            self.index.discard_many(removed)
+            self._publish(removed)
+        logger.info("Batch removal applied: %s removed, %s rejected.", len(removed), len(errors))
+        return removed, errors
+
     def remove_desk(self, desk_id):
         """Remove a desk by its ID."""
         with self.lock:
             if desk_id in self.desks:
-                del self.desks[desk_id]
-                del self.users[desk_id]
+                self._detach(self.desks.pop(desk_id))
+                self.fleet_version += 1
                 self.powered_off_desks.pop(desk_id, None)
-                logger.info(f"Desk ID={desk_id} and user removed.")
+                self.index.discard(desk_id)
+                self._on_desk_changed(desk_id, ())
+                self._publish((desk_id,))
+                logger.info("Desk ID=%s and user removed.", desk_id)
                 return True
-            logger.warning(f"Attempted to remove non-existent desk ID={desk_id}.")
+            logger.warning("Attempted to remove non-existent desk ID=%s.", desk_id)
             return False
 
+    def _attach(self, desk, user, wake=True):
+        """Register a new desk and its user, and have both looked at by the next tick and user pass.
+
+        With `wake` False the caller schedules the user's first wake-up itself, to batch them.
+        """
+        desk.change_listener = self._on_desk_changed
+        desk.target_listener = self._on_target_changed
+        self.desks[desk.desk_id] = desk
+        self.users[desk.desk_id] = user
+        self.active_set.start_clock(desk)
+        self.changed_targets.add(desk.desk_id)
+        if wake and self.population is None:
+            self._schedule_user(desk.desk_id, self.current_time_s)
+
+    def _detach(self, desk):
+        """Unregister a removed desk and its user; their pending wake-ups are skipped when they come up."""
+        desk.change_listener = None
+        desk.target_listener = None
+        del self.users[desk.desk_id]
+        self.active_set.discard(desk.desk_id)
+
+    def _on_target_changed(self, desk_id):
+        # Called with self.lock held; the next tick reads the new target and wakes the desk.
+        self.changed_targets.add(desk_id)
+
+    def _schedule_user(self, desk_id, time_s):
+        self.scheduler.schedule(time_s, self._wake_user, desk_id, self.users[desk_id])
+
+    def _on_desk_changed(self, desk_id, categories):
+        """Collect desk changes until the next tick records them in the journal."""
+        with self.changes_lock:
+            self.pending_changes.setdefault(desk_id, set()).update(categories)
+
+    def _record_changes(self):
+        """Record the changes collected since the previous tick as one journal entry and return them. Must hold self.lock."""
+        with self.changes_lock:
+            pending, self.pending_changes = self.pending_changes, {}
+        if not pending:
+            return pending
+
+        for desk_id, categories in pending.items():
+            if "state" in categories and desk_id in self.desks:
+                self.index.refresh(self.desks[desk_id])
+
+        self.events.publish_changes(pending, self.desks)
+
+        self.journal_cursor += 1
+        self.journal.append((self.journal_cursor, pending))
+        self.journal_records += len(pending)
+
+        # Bounded memory: drop whole ticks from the oldest end, but always keep the latest one.
+        while self.journal_records > self.JOURNAL_MAX_RECORDS and len(self.journal) - self.journal_start > 1:
+            dropped_cursor, dropped = self.journal[self.journal_start]
+            self.journal_start += 1
+            self.journal_records -= len(dropped)
+            self.journal_floor = dropped_cursor
+        if self.journal_start > len(self.journal) // 2:
+            self.journal = self.journal[self.journal_start:]
+            self.journal_start = 0
+        return pending
+
+    def _publish(self, desk_ids):
+        """Publish a new snapshot with fresh copies of the given desks, sharing everything else. Must hold self.lock."""
+        frozen_desks = {}
+        for desk_id in desk_ids:
+            desk = self.desks.get(desk_id)
+            frozen_desks[desk_id] = None if desk is None or desk_id in self.powered_off_desks else desk.freeze()
+        self.snapshot = self.snapshot.publish(frozen_desks, self.journal_cursor, self.journal_floor, self.journal,
+                                              self.journal_start, self.index.frozen())
+
     def is_daytime(self):
         """Check if the current time is during the day."""
         simulated_time_h = (self.current_time_s % self.SECONDS_PER_DAY) / 3600
         daytime = self.DAY_START_HOUR <= simulated_time_h < self.NIGHT_START_HOUR
-        logger.info(f"Daytime check: {'Day' if daytime else 'Night'} (Simulated hour: {simulated_time_h:.2f}).")
+        logger.debug("Daytime check: %s (Simulated hour: %.2f).", "Day" if daytime else "Night", simulated_time_h)
         return daytime
 
-    def increment_time(self):
-        """Increment the simulation time by one second."""
-        with self.lock:
-            self.current_time_s += self.simulation_speed
-            logger.debug(f"Simulation time incremented to {self.current_time_s} seconds.")
-
+    def next_daytime(self, time_s):
+        """Return `time_s` if it falls during the day, otherwise the start of the next day."""
+        day_start_s = time_s - time_s % self.SECONDS_PER_DAY + self.DAY_START_HOUR * 3600
+        if time_s < day_start_s:
+            return day_start_s
+        if time_s < day_start_s - self.DAY_START_HOUR * 3600 + self.NIGHT_START_HOUR * 3600:
+            return time_s
+        return day_start_s + self.SECONDS_PER_DAY
 
     def _create_user(self, desk, user_type: UserType):
         """Create a behavior instance based on the behavior type."""
+        if self.population is not None and isinstance(user_type, UserType):
+            return MarkovUser(desk, user_type)
         if user_type == UserType.SEATED:
             return SeatedUser(desk)
         elif user_type == UserType.STANDING:
@@ -110,125 +378,254 @@ class DeskManager:
         else:
             raise ValueError(f"Unknown behavior type: {user_type}")
 
-    def _update_all_desks(self):
-        """Continuously update each desk's position."""
-        while not self.stop_event.is_set():
-            with self.lock:
-                for desk_id, desk in self.desks.items():
-                    if desk_id not in self.powered_off_desks:
-                        desk.update()
-            time.sleep(1)
-            self.increment_time()
-
-    def _simulate_user_interactions(self):
-        """Simulate local user interactions for all desks."""
-        while not self.stop_event.is_set():
-            if self.is_daytime():
-                with self.lock:
-                    for desk_id, user in self.users.items():
-                        if desk_id not in self.powered_off_desks:
-                            logger.debug(f"User simulation for desk {desk_id}.")
-                            user.simulate(5*self.simulation_speed)
-            time.sleep(5)
-
-    def _simulate_power_off(self):
-        """Randomly power off desks for a period of time."""
-        while not self.stop_event.is_set():
-            with self.lock:
-                if self.desks and random.random() < self.POWER_OFF_CHANCE:
-                    desk_id = random.choice(list(self.desks.keys()))
-                    if desk_id not in self.powered_off_desks:
-                        power_off_duration_s = random.randint(5*60, 2*60*60)
-                        self.powered_off_desks[desk_id] = self.current_time_s + power_off_duration_s
-                        logger.warning(f"Desk ID={desk_id} powered off for {power_off_duration_s // 60} minutes.")
-            time.sleep(5)
+    def tick_period_s(self):
+        """Simulated seconds between ticks."""
+        return self.simulation_speed / self.tick_hz
+
+    def _schedule_next_tick(self):
+        """Schedule the next tick on a fixed grid from the first one, so tick times never drift.
+
+        A late tick is followed at once by the next one until the schedule is caught up again. Once
+        MAX_CATCH_UP_TICKS or more ticks are overdue, the overdue ones are skipped and counted instead.
+        """
+        period_s = self.tick_period_s()
+        self.tick_index += 1
+        overdue = int((self.scheduler.simulated_now() - (self.tick_origin_s + self.tick_index * period_s)) // period_s)
+        if overdue >= self.MAX_CATCH_UP_TICKS:
+            self.tick_index += overdue
+            METRICS.inc("simulator_ticks_skipped_total", amount=overdue)
+            logger.warning("Simulation fell behind; skipped %s ticks.", overdue, extra={"rate_key": "tick_overrun"})
+        self.scheduler.schedule(round_fraction(self.tick_origin_s + self.tick_index * period_s), self._tick)
+
+    def _tick(self):
+        """Advance the desks by one tick and publish the result."""
+        self._schedule_next_tick()
+        started = time.perf_counter()
+        METRICS.set_gauge("simulator_tick_lag_seconds", self.scheduler.lateness_s)
+        self._apply_commands()
+        if self.vector_engine:
+            settled = self.vector_engine.tick(self.desks, self.powered_off_desks, self.fleet_version, self.changed_targets)
+        else:
+            settled = self.active_set.tick(self.desks, self.powered_off_desks, self.changed_targets)
+        for desk_id in settled:
+            user = self.users.get(desk_id)
+            if user is not None and user.WAKE_ON_SETTLE:
+                self._schedule_user(desk_id, self.current_time_s)
+        changes = self._record_changes()
+        if self.recorder:
+            self.recorder.record(self.current_time_s, changes, self.desks, self.powered_off_desks)
+        if self.publish_snapshots:
+            self._publish(changes)
+        duration_s = time.perf_counter() - started
+        METRICS.observe("simulator_tick_duration_seconds", duration_s)
+        METRICS.inc("simulator_ticks_total")
+        if duration_s > 1 / self.tick_hz:
+            METRICS.inc("simulator_tick_overruns_total")
+
+    def _collect_metrics(self):
+        """Desk gauges for the metrics endpoint. Reads sizes without the lock, so values may be a tick stale."""
+        return [
+            ("simulator_desks", (("state", "active"),), len(self.index.active)),
+            ("simulator_desks", (("state", "powered_off"),), len(self.powered_off_desks)),
+            ("simulator_event_subscribers", (), self.events.subscriber_count),
+            ("simulator_active_set_desks", (), len(self.active_set)),
+            ("simulator_scheduled_events", (), len(self.scheduler)),
+            ("simulator_simulated_time_seconds", (), self.current_time_s),
+        ]
+
+    def _wake_user(self, desk_id, user):
+        """Let a user act on its desk, postponing the wake-up while it is night or the desk is powered off."""
+        if self.users.get(desk_id) is not user:
+            return
+        if desk_id in self.powered_off_desks:
+            self.scheduler.schedule(self.powered_off_desks[desk_id], self._wake_user, desk_id, user)
+            return
+        daytime_s = self.next_daytime(self.current_time_s)
+        if daytime_s != self.current_time_s:
+            self.scheduler.schedule(daytime_s, self._wake_user, desk_id, user)
+            return
+        logger.debug("User simulation for desk %s.", desk_id)
+        next_wake_s = user.wake(self.current_time_s)
+        if next_wake_s is not None:
+            self.scheduler.schedule(next_wake_s, self._wake_user, desk_id, user)
+
+    def _population_step(self):
+        """Run one batched step of every Markov user's decisions, and schedule the next one during the day."""
+        self.scheduler.schedule(self.next_daytime(self.current_time_s + self.population.STEP_S), self._population_step)
+        self.population.step(self.users, self.powered_off_desks, self.fleet_version)
+
+    def _schedule_power_failure(self):
+        delay_s = max(1, round(random.expovariate(1 / self.POWER_OFF_MEAN_INTERVAL_S)))
+        self.scheduler.schedule(self.current_time_s + delay_s, self._power_off_random_desk)
+
+    def _power_off_random_desk(self):
+        """Power off a random desk for a while, and schedule the next failure."""
+        self._schedule_power_failure()
+        if self.desks:
+            desk_id = random.choice(list(self.desks.keys()))
+            if desk_id not in self.powered_off_desks:
+                power_off_duration_s = random.randint(5*60, 2*60*60)
+                power_on_time_s = self.current_time_s + power_off_duration_s
+                self.powered_off_desks[desk_id] = power_on_time_s
+                if not self.vector_engine:
+                    self.active_set.suspend(self.desks[desk_id])
+                self.index.discard(desk_id)
+                self._on_desk_changed(desk_id, ())
+                self.scheduler.schedule(power_on_time_s, self._power_on, desk_id, power_on_time_s)
+                logger.warning("Desk ID=%s powered off for %s minutes.", desk_id, power_off_duration_s // 60)
+
+    def _power_on(self, desk_id, power_on_time_s):
+        """Restore a powered-off desk, unless it was removed or powered off again since."""
+        if self.powered_off_desks.get(desk_id) != power_on_time_s:
+            return
+        logger.info("Desk ID=%s restored from power-off state.", desk_id)
+        del self.powered_off_desks[desk_id]
+        self.active_set.start_clock(self.desks[desk_id])
+        self.changed_targets.add(desk_id)
+        self.index.add(self.desks[desk_id])
+        self._on_desk_changed(desk_id, Desk.CATEGORIES)
 
+    def _seed_events(self):
+        """Schedule the first tick and power failure. Both reschedule themselves, so this only happens once."""
+        if self.tick_origin_s is None:
             with self.lock:
-                desks_to_restore = [
-                    desk_id for desk_id, power_on_time_s in self.powered_off_desks.items()
-                    if self.current_time_s >= power_on_time_s
-                ]
-                for desk_id in desks_to_restore:
-                    logger.info(f"Desk ID={desk_id} restored from power-off state.")
-                    del self.powered_off_desks[desk_id]
+                self.tick_origin_s = self.current_time_s
+                self.scheduler.schedule(self.tick_origin_s, self._tick)
+                self._schedule_power_failure()
+                if self.population:
+                    self.scheduler.schedule(self.next_daytime(self.current_time_s), self._population_step)
 
     def start_updates(self):
-        """Start the update and simulation threads."""
-        if self.update_thread is None or not self.update_thread.is_alive():
-            self.stop_event.clear()
-            self.update_thread = threading.Thread(target=self._update_all_desks)
-            self.update_thread.start()
-            logger.info("Update thread started.")
-
-        if self.simulation_thread is None or not self.simulation_thread.is_alive():
-            self.simulation_thread = threading.Thread(target=self._simulate_user_interactions)
-            self.simulation_thread.start()
-            logger.info("User simulation thread started.")
-
-        if self.power_off_thread is None or not self.power_off_thread.is_alive():
-            self.power_off_thread = threading.Thread(target=self._simulate_power_off)
-            self.power_off_thread.start()
-            logger.info("Power-off simulation thread started.")
-
-    def stop_updates(self):
-        """Stop the update and simulation threads."""
-        if self.update_thread or self.simulation_thread:
-            self.stop_event.set()
-            if self.update_thread:
-                self.update_thread.join()
-                logger.info("Update thread stopped.")
-            if self.simulation_thread:
-                self.simulation_thread.join()
-                logger.info("User simulation thread stopped.")
-            if self.power_off_thread:
-                self.power_off_thread.join()
-                logger.info("Power-off simulation thread stopped.")
-        self.save_state()
+        """Start the scheduler thread running ticks, user wake-ups and power failures."""
+        self._seed_events()
+        if self.scheduler_thread is None or not self.scheduler_thread.is_alive():
+            self.scheduler_thread = threading.Thread(target=self.scheduler.run, args=(self.simulation_speed,))
+            self.scheduler_thread.start()
+            logger.info("Scheduler thread started.")
 
-    def save_state(self):
-        """Save the current state of desks and users."""
+    def fast_forward(self, duration_s):
+        """Simulate the next `duration_s` simulated seconds as fast as possible on the calling thread.
+
+        Runs the same events as the scheduler thread, on a virtual clock; use instead of start_updates().
+        """
+        self._seed_events()
+        self.scheduler.run_until(self.current_time_s + duration_s)
+
+    def stop_updates(self, save=True):
+        """Stop the scheduler thread, and save the state unless `save` is False."""
+        self.events.close()
+        if self.scheduler_thread:
+            self.scheduler.stop()
+            self.scheduler_thread.join()
+            logger.info("Scheduler thread stopped.")
+        with self.lock:
+            self._apply_commands()
+        if save:
+            self.save_state()
+
+    def _sync_clocks(self):
+        """Bring every desk's clock up to date before saving. Must hold self.lock."""
+        if self.vector_engine:
+            self.vector_engine.flush()
+        else:
+            for desk_id, desk in self.desks.items():
+                if desk_id not in self.powered_off_desks:
+                    self.active_set.sync_clock(desk)
+
+    def export_state(self):
+        """Return the current state of desks and users in the JSON state file format."""
         state = {}
         with self.lock:
+            self._sync_clocks()
             for desk_id, desk in self.desks.items():
                 state[desk_id] = {
                     "desk_data": desk.get_data(),
-                    "user": self.users[desk_id].__class__.__name__.replace("User", "").lower(),
+                    "user": self.users[desk_id].user_type.value,
                 }
-                state[desk_id]["desk_data"]["clock_s"] = desk.clock_s
-                state["current_time_s"] = self.current_time_s
-                state["simulation_speed"] = self.simulation_speed
-        with open(self.STATE_FILE, "w") as f:
+                state[desk_id]["desk_data"]["clock_s"] = round_fraction(desk.clock_s)
+            state["current_time_s"] = self.current_time_s
+            state["simulation_speed"] = self.simulation_speed
+        return state
+
+    def save_state(self):
+        """Save the current state of desks and users in the configured state format."""
+        if self.state_format != "binary":
+            self.write_state(self.export_state())
+            return
+        # Only copying the desk fields needs the lock; encoding and writing the file happen after it is released.
+        with self.lock:
+            self._sync_clocks()
+            records = [state_file.desk_record(desk, self.users[desk_id].user_type.value)
+                       for desk_id, desk in self.desks.items()]
+            current_time_s = self.current_time_s
+        state_file.write(self.BINARY_STATE_FILE, current_time_s, self.simulation_speed, records)
+        logger.info("Desk Manager state of %s desks saved to %s.", len(records), self.BINARY_STATE_FILE)
+
+    @classmethod
+    def write_state(cls, state, state_format="json"):
+        """Write exported state, possibly merged from several shards, to the state file of the given format."""
+        if state_format == "binary":
+            records = (state_file.json_record(desk_id, saved) for desk_id, saved in state.items()
+                       if desk_id not in ("current_time_s", "simulation_speed"))
+            state_file.write(cls.BINARY_STATE_FILE, state["current_time_s"], state["simulation_speed"], records)
+            logger.info("Desk Manager state saved to %s.", cls.BINARY_STATE_FILE)
+            return
+        with open(cls.STATE_FILE, "w") as f:
             json.dump(state, f)
-        logger.info(f"Desk Manager state saved to {self.STATE_FILE}.")
+        logger.info("Desk Manager state saved to %s.", cls.STATE_FILE)
 
     def load_state(self):
-        """Load the state of desks and users from a JSON file, if it exists."""
+        """Load the state of desks and users, from the binary state file if using that format and it exists, else from JSON."""
+        if self.state_format == "binary" and os.path.exists(self.BINARY_STATE_FILE):
+            self._load_binary_state()
+        else:
+            self._load_json_state()
+
+    def _restore_desks(self, records):
+        """Add the desks of saved records owned by this shard, in one batch and without per-desk logging."""
+        desks = []
+        try:
+            for record in records:
+                if not self.owns_desk(record.desk_id):
+                    continue
+                user_type = UserType(record.user)
+                desk = state_file.restore_desk(record)
+                self._attach(desk, self._create_user(desk, user_type), wake=False)
+                desks.append(desk)
+        finally:
+            # Desks restored before a bad record stay, as they did when each was indexed on its own.
+            self.index.add_many(desks)
+            if self.population is None:
+                self.scheduler.schedule_many((self.current_time_s, self._wake_user, (desk.desk_id, self.users[desk.desk_id]))
+                                             for desk in desks)
+        return len(desks)
+
+    def _load_binary_state(self):
+        started = time.perf_counter()
+        try:
+            with state_file.StateReader(self.BINARY_STATE_FILE) as reader:
+                self.current_time_s = reader.current_time_s
+                self.simulation_speed = reader.simulation_speed
+                count = self._restore_desks(reader)
+            logger.info("Desk Manager state of %s desks loaded from %s "
+                        "in %.2f s.", count, self.BINARY_STATE_FILE, time.perf_counter() - started)
+        except (OSError, ValueError, struct.error, IndexError) as e:
+            logger.error("Failed to load state from %s: %s. Starting with default state.", self.BINARY_STATE_FILE, e)
+
+    def _load_json_state(self):
+        """Load the JSON state file, which a binary state format setup also imports when it has no binary file yet."""
         if os.path.exists(self.STATE_FILE):
+            started = time.perf_counter()
             with open(self.STATE_FILE, "r") as f:
                 try:
                     data = json.load(f)
                     self.current_time_s = data.get("current_time_s", 43200)
                     self.simulation_speed = data.get("simulation_speed", 60)
-                    for desk_id, saved_data in data.items():
-                        if desk_id in [ "current_time_s", "simulation_speed" ]:
-                            continue
-                        desk_data = saved_data["desk_data"]
-                        user_type = UserType(saved_data["user"])
-                        desk = Desk(
-                            desk_id,
-                            desk_data["config"]["name"],
-                            desk_data["config"]["manufacturer"],
-                            desk_data["state"]["position_mm"],
-                        )
-                        desk.config.update(desk_data["config"])
-                        desk.state.update(desk_data["state"])
-                        desk.usage.update(desk_data["usage"])
-                        desk.lastErrors = desk_data["lastErrors"]
-                        desk.clock_s = desk_data["clock_s"]
-                        self.desks[desk_id] = desk
-                        self.users[desk_id] = self._create_user(desk, user_type)
-                    logger.info(f"Desk Manager state loaded from {self.STATE_FILE}")
+                    count = self._restore_desks(state_file.json_record(desk_id, saved_data) for desk_id, saved_data in data.items()
+                                                if desk_id not in ("current_time_s", "simulation_speed"))
+                    logger.info("Desk Manager state of %s desks loaded from %s "
+                                "in %.2f s.", count, self.STATE_FILE, time.perf_counter() - started)
                 except (json.JSONDecodeError, KeyError, ValueError) as e:
-                    logger.error(f"Failed to load state from {self.STATE_FILE}: {e}. Starting with default state.")
+                    logger.error("Failed to load state from %s: %s. Starting with default state.", self.STATE_FILE, e)
         else:
-            logger.warning(f"No state file found at {self.STATE_FILE}. Starting with default state.")
+            logger.warning("No state file found at %s. Starting with default state.", self.STATE_FILE)
@@ -0,0 +1,157 @@
+import itertools
+import json
+import threading
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+class SubscriberOverflow(Exception):
+    """Raised when a subscriber using the disconnect policy falls too far behind."""
+
+class EventBroadcaster:
+    """Shared fan-out of desk events to Server-Sent Events subscribers.
+
+    Each event is encoded once into a shared ring. Subscribers keep their own position in the
+    ring and read at their own pace, so publishing costs O(events) however many clients listen.
+    """
+    RING_SIZE = 65536
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.ring = deque(maxlen=self.RING_SIZE)
+        self.next_seq = 1
+        self.subscriber_count = 0
+        self.closed = False
+        self.last_status = {}
+        self.listeners = []
+
+    def add_listener(self, callback):
+        """Call `callback()` after every publish and on close, for subscribers that cannot block on the condition."""
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self.listeners.remove(callback)
+
+    def _notify_listeners(self):
+        for callback in self.listeners:
+            callback()
+
+    def has_subscribers(self):
+        return self.subscriber_count > 0
+
+    def publish_changes(self, changes, desks):
+        """Turn one tick's desk changes into position, status and collision events. Caller holds the desk manager lock.
+
+        Call it on every tick: the last status of each desk is tracked even while nobody listens, so a
+        new subscriber only gets status events for changes made after it connected.
+        """
+        if not self.has_subscribers():
+            for desk_id, categories in changes.items():
+                desk = desks.get(desk_id)
+                if desk is None:
+                    self.last_status.pop(desk_id, None)
+                elif "state" in categories:
+                    self.last_status[desk_id] = desk.status.value
+            return
+
+        events = []
+        for desk_id, categories in changes.items():
+            desk = desks.get(desk_id)
+            if desk is None:
+                self.last_status.pop(desk_id, None)
+                continue
+            data = desk.get_snapshot()
+            state = data["state"]
+            if "state" in categories:
+                events.append((desk_id, "position", {
+                    "desk_id": desk_id,
+                    "position_mm": state["position_mm"],
+                    "speed_mms": state["speed_mms"],
+                }))
+                if self.last_status.get(desk_id, "Normal") != state["status"]:
+                    events.append((desk_id, "status", {"desk_id": desk_id, "status": state["status"]}))
+                self.last_status[desk_id] = state["status"]
+            if "lastErrors" in categories and data["lastErrors"]:
+                events.append((desk_id, "collision", {"desk_id": desk_id, **data["lastErrors"][0]}))
+        self.publish(events)
+
+    def publish(self, events):
+        """Encode (desk ID, event type, payload) events once and wake up every subscriber."""
+        if not events:
+            return
+        with self.condition:
+            for desk_id, event_type, payload in events:
+                encoded = f"id: {self.next_seq}\nevent: {event_type}\ndata: {json.dumps(payload)}\n\n".encode("utf-8")
+                self.ring.append((self.next_seq, desk_id, encoded))
+                self.next_seq += 1
+            self.condition.notify_all()
+        self._notify_listeners()
+
+    def subscribe(self, desk_ids=None, max_buffer=1024, policy="drop-oldest", last_event_id=None):
+        return Subscription(self, desk_ids, max_buffer, policy, last_event_id)
+
+    def close(self):
+        """End every subscription, for example when the simulator shuts down."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self._notify_listeners()
+
+class Subscription:
+    """One subscriber's position in the shared ring, with its own buffer limit and overflow policy."""
+    POLICIES = ("drop-oldest", "disconnect")
+
+    def __init__(self, broadcaster: EventBroadcaster, desk_ids, max_buffer, policy, last_event_id):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.broadcaster = broadcaster
+        self.desk_ids = set(desk_ids) if desk_ids else None
+        self.max_buffer = max(1, min(max_buffer, broadcaster.RING_SIZE))
+        self.policy = policy
+        self.dropped = 0
+        with broadcaster.condition:
+            latest = broadcaster.next_seq - 1
+            if last_event_id is not None and 0 <= last_event_id <= latest:
+                # Resume after a reconnect; the overflow policy applies if the gap is too large.
+                self.cursor = last_event_id
+            else:
+                self.cursor = latest
+            broadcaster.subscriber_count += 1
+
+    def read(self, timeout):
+        """Wait up to `timeout` seconds and return the matching encoded events, or None once the stream is closed.
+
+        An empty list means the wait timed out. Having more than `max_buffer` matching events pending
+        either skips the oldest of them (counted in `dropped`) or raises SubscriberOverflow. Events of
+        other desks never count against the buffer. Events that left the ring before they were read
+        are lost whether they matched or not, and are treated as an overflow as well.
+        """
+        broadcaster = self.broadcaster
+        with broadcaster.condition:
+            if broadcaster.next_seq - 1 == self.cursor and not broadcaster.closed:
+                broadcaster.condition.wait(timeout)
+            if broadcaster.closed:
+                return None
+
+            latest = broadcaster.next_seq - 1
+            ring = broadcaster.ring
+            lost = max(0, latest - self.cursor - len(ring))
+            # Indexing a deque is O(n) away from its ends, so walk the unread tail back from the newest entry.
+            entries = list(itertools.islice(reversed(ring), latest - self.cursor - lost))[::-1]
+            self.cursor = latest
+
+        if self.desk_ids is None:
+            events = [encoded for _, _, encoded in entries]
+        else:
+            events = [encoded for _, desk_id, encoded in entries if desk_id in self.desk_ids]
+        if lost or len(events) > self.max_buffer:
+            if self.policy == "disconnect":
+                raise SubscriberOverflow(f"{len(events) + lost} events pending, limit is {self.max_buffer}")
+            self.dropped += lost + max(0, len(events) - self.max_buffer)
+            events = events[-self.max_buffer:]
+        return events
+
+    def close(self):
+        with self.broadcaster.condition:
+            self.broadcaster.subscriber_count -= 1
@@ -0,0 +1,79 @@
+from desk import Desk
+from desk_index import DeskIndex
+
+# Marks a desk the overlay does not mention, as None marks one that left.
+_UNCHANGED = object()
+
+class FleetSnapshot:
+    """Fleet state published by DeskManager for request threads, which read it without taking any lock.
+
+    A snapshot is never modified after it is published, and publishing the next one costs what changed
+    rather than the fleet size. The frozen desks are a base dict shared between snapshots plus an
+    overlay of the desks changed since it was built (None for desks that left), folded into a new base
+    once it outgrows OVERLAY_MIN and 1/OVERLAY_FRACTION of the base. The journal is the range of
+    entries from `journal_start` to `journal_end` in DeskManager's journal list, which only grows at
+    the end, and the index shares its unchanged segments with the previous one.
+    """
+    OVERLAY_MIN = 1024
+    OVERLAY_FRACTION = 16
+
+    __slots__ = ("cursor", "journal_floor", "journal", "journal_start", "journal_end", "desks", "overlay", "index")
+
+    def __init__(self, cursor=0, journal_floor=0, journal=(), journal_start=0, journal_end=0, desks=None,
+                 overlay=None, index=None):
+        self.cursor = cursor
+        self.journal_floor = journal_floor
+        self.journal = journal
+        self.journal_start = journal_start
+        self.journal_end = journal_end
+        self.desks = desks if desks is not None else {}
+        self.overlay = overlay if overlay is not None else {}
+        self.index = index if index is not None else DeskIndex()
+
+    def publish(self, frozen_desks, cursor, journal_floor, journal, journal_start, index):
+        """Return the next snapshot, with `frozen_desks` (desk ID to frozen desk, or None if it left) replacing these desks.
+
+        `journal` is DeskManager's journal list; the snapshot covers its entries from `journal_start` to its current end.
+        """
+        desks = self.desks
+        overlay = self.overlay
+        if frozen_desks:
+            overlay = {**overlay, **frozen_desks}
+            if len(overlay) > max(self.OVERLAY_MIN, len(desks) // self.OVERLAY_FRACTION):
+                desks = dict(desks)
+                for desk_id, desk in overlay.items():
+                    if desk is None:
+                        desks.pop(desk_id, None)
+                    else:
+                        desks[desk_id] = desk
+                overlay = {}
+        return FleetSnapshot(cursor, journal_floor, journal, journal_start, len(journal), desks, overlay, index)
+
+    def get_desk(self, desk_id):
+        """Get the frozen copy of an active desk, or None if the desk is missing or powered off."""
+        desk = self.overlay.get(desk_id, _UNCHANGED)
+        return self.desks.get(desk_id) if desk is _UNCHANGED else desk
+
+    def get_changes_since(self, cursor):
+        """Return the cursor with the desks changed after `cursor` and the desks removed since, or None if too old."""
+        if cursor < self.journal_floor or cursor > self.cursor:
+            return None
+
+        changed = {}
+        journal = self.journal
+        for position in range(self.journal_end - 1, self.journal_start - 1, -1):
+            entry_cursor, entry = journal[position]
+            if entry_cursor <= cursor:
+                break
+            for desk_id, categories in entry.items():
+                changed.setdefault(desk_id, set()).update(categories)
+
+        desks = {}
+        removed = []
+        for desk_id, categories in changed.items():
+            desk = self.get_desk(desk_id)
+            if desk is None:
+                removed.append(desk_id)
+                continue
+            desks[desk_id] = {category: getattr(desk, category) for category in Desk.CATEGORIES if category in categories}
+        return self.cursor, desks, removed
@@ -0,0 +1,100 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+logger = logging.getLogger(__name__)
+
+# Argument types that cannot change between the logging call and the background write.
+IMMUTABLE_ARG_TYPES = (str, int, float, bool, type(None), bytes)
+
+class RateLimitFilter(logging.Filter):
+    """Rate limit and sample records that carry a `rate_key` (usually a desk ID), per key and message.
+
+    Within each interval the first `burst` records of a (key, message) pair pass, then only every
+    `sample_every`-th one. Records without a `rate_key` always pass.
+    """
+
+    def __init__(self, burst=5, interval_s=10.0, sample_every=100):
+        super().__init__()
+        self.burst = burst
+        self.interval_s = interval_s
+        self.sample_every = sample_every
+        self.counts = {}
+        self.suppressed = 0
+        self.window_start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        rate_key = getattr(record, "rate_key", None)
+        if rate_key is None or self.burst <= 0:
+            return True
+
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= self.interval_s:
+                suppressed, self.suppressed = self.suppressed, 0
+                self.counts.clear()
+                self.window_start = now
+            else:
+                suppressed = 0
+            key = (rate_key, record.msg)
+            count = self.counts.get(key, 0) + 1
+            self.counts[key] = count
+            allowed = count <= self.burst or (count - self.burst) % self.sample_every == 0
+            if not allowed:
+                self.suppressed += 1
+
+        if suppressed:
+            logger.info("Rate limiting suppressed %d log records in the last %.0fs.", suppressed, self.interval_s)
+        return allowed
+
+class DeferredQueueHandler(QueueHandler):
+    """Queue handler that leaves message formatting to the background listener.
+
+    The stock QueueHandler formats every record in the calling thread. Here the message is only
+    merged early when an argument is mutable (for example a live desk state dict), so hot paths pay
+    for a queue put instead of string formatting.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.args and (
+            not isinstance(record.args, tuple)
+            or not all(isinstance(arg, IMMUTABLE_ARG_TYPES) for arg in record.args)
+        ):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block the simulation on a slow log destination.
+            self.dropped += 1
+
+def setup_logging(numeric_level, log_format, burst=5, interval_s=10.0, sample_every=100, queue_size=100000):
+    """Route all logging through a bounded queue drained by a background writer thread."""
+    log_queue = queue.Queue(queue_size)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(log_format))
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(burst, interval_s, sample_every))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(numeric_level)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
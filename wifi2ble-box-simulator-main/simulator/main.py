@@ -1,45 +1,62 @@
 import argparse
-import ssl
+import multiprocessing
+import queue
 import random
+import signal
+import socket
+import ssl
 import logging
-from http.server import HTTPServer
+import threading
+import time
+from http.server import ThreadingHTTPServer
 from users import UserType
 from desk_manager import DeskManager
 from simple_rest_server import SimpleRESTServer
+from async_rest_server import AsyncRESTServer
+from sharding import Shard, ShardedRESTServer, ReusePortHTTPServer
+import log_pipeline
+import population
+import trajectory
+import vector_engine
 
 logger = logging.getLogger("main")
 
-def setup_logging(log_level):
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+WORKER_LOG_FORMAT = "%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s"
+WORKER_STOP_TIMEOUT_S = 60
+
+def setup_logging(log_level, log_burst=5, log_interval=10.0, log_sample=100, log_format=LOG_FORMAT):
     """Configure logging based on the log level."""
     numeric_level = getattr(logging, log_level.upper(), None)
     if not isinstance(numeric_level, int):
         raise ValueError(f"Invalid log level: {log_level}")
 
-    logging.basicConfig(
-        level=numeric_level,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    log_pipeline.setup_logging(
+        numeric_level,
+        log_format,
+        burst=log_burst,
+        interval_s=log_interval,
+        sample_every=log_sample,
     )
     logger.info(f"Logging initialized at {log_level} level.")
 
-def generate_desk_id():
-    return ":".join(f"{random.randint(0, 255):02x}" for _ in range(6))
+def run(server_class=ThreadingHTTPServer, handler_class=SimpleRESTServer, port=8000, use_https=False, cert_file=None, key_file=None, desks=2, speed=60,
+        engine="simple", max_in_flight=64, compress_min_bytes=1024, compress_level=6, tick_engine="object", tick_hz=1, desk_time="real", behavior_engine="object", state_format="json", shard=None):
+    internal_httpd = None
+    if shard is not None:
+        # The supervisor stops workers with SIGTERM; Ctrl+C in a terminal is handled by the supervisor alone.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+        ShardedRESTServer.configure(shard)
+        server_class = ReusePortHTTPServer
+        handler_class = ShardedRESTServer
+        # Each shard needs its share of the minimum desk count.
+        desks = -(-desks // shard.count)
 
-def generate_desk_name():
-    return f"DESK {random.randint(1000, 9999)}"
-
-def run(server_class=HTTPServer, handler_class=SimpleRESTServer, port=8000, use_https=False, cert_file=None, key_file=None, desks=2, speed=60):
     logger.info(f"Initializing DeskManager with simulation speed: {speed}")
-    desk_manager = DeskManager(speed)
-
-    logger.info("Adding default desks...")
-    desk_manager.add_desk("cd:fb:1a:53:fb:e6", "DESK 4486", "Desk-O-Matic Co.", UserType.ACTIVE)
-    desk_manager.add_desk("ee:62:5b:b8:73:1d", "DESK 6743", "Desk-O-Matic Co.", UserType.STANDING)
-
-    if len(desk_manager.get_desk_ids()) < desks:
-        logger.info(f"Adding {desks - len(desk_manager.get_desk_ids())} additional desks.")
-        for i in range(desks - len(desk_manager.get_desk_ids())):
-            desk_manager.add_desk(generate_desk_id(), generate_desk_name(), "Desk-O-Matic Co.", UserType.ACTIVE)
-
+    desk_manager = DeskManager(speed, shard=shard, tick_engine=tick_engine, tick_hz=tick_hz, desk_time=desk_time,
+                               behavior_engine=behavior_engine, state_format=state_format)
+    add_default_desks(desk_manager, desks)
     desk_manager.start_updates()
 
     def handler(*args, **kwargs):
@@ -48,30 +65,163 @@ def run(server_class=HTTPServer, handler_class=SimpleRESTServer, port=8000, use_
     # Listen on all interfaces so Docker/other containers can reach it
     server_address = ("0.0.0.0", port)
     SimpleRESTServer.initialize_api_keys()
-    httpd = server_class(server_address, handler)
+    handler_class.COMPRESSION_MIN_BYTES = compress_min_bytes
+    handler_class.COMPRESSION_LEVEL = compress_level
 
+    context = None
     if use_https:
         if not cert_file or not key_file:
             logger.error("Both certificate and key files must be provided for HTTPS.")
             raise ValueError("Both certificate and key files must be provided for HTTPS.")
         context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
         context.load_cert_chain(certfile=cert_file, keyfile=key_file)
-
-        httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
         protocol = "HTTPS"
     else:
         protocol = "HTTP"
 
-    logger.info(f"Starting {protocol} server on port {port}...")
+    if shard is not None:
+        # Other shards reach this one over plain HTTP on the loopback interface.
+        internal_httpd = ThreadingHTTPServer(shard.internal_address(shard.index), handler)
+        threading.Thread(target=internal_httpd.serve_forever, name="shard-internal", daemon=True).start()
+        logger.info(f"Shard {shard.index + 1}/{shard.count} listening internally on port {shard.internal_address(shard.index)[1]}.")
+
+    logger.info(f"Starting {protocol} server on port {port} with the {engine} engine...")
+
+    if engine == "asyncio":
+        server = AsyncRESTServer(desk_manager, handler_class, max_in_flight=max_in_flight, ssl_context=context,
+                                 reuse_port=shard is not None)
+        try:
+            server.serve_forever(*server_address)
+        except KeyboardInterrupt:
+            logger.info("Shutting down server...")
+        finally:
+            _stop(desk_manager, shard, internal_httpd)
+            logger.info("Server stopped.")
+        return
+
+    httpd = server_class(server_address, handler)
+    if context:
+        # Handshakes run in each connection's handler thread instead of blocking accept().
+        httpd.socket = context.wrap_socket(httpd.socket, server_side=True, do_handshake_on_connect=False)
 
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
         logger.info("Shutting down server...")
     finally:
-        desk_manager.stop_updates()  # Stop the desk updates
+        _stop(desk_manager, shard, internal_httpd)
         logger.info("Server stopped.")
 
+def add_default_desks(desk_manager, desks):
+    """Add the two default desks, then active-user desks until there are at least `desks`."""
+    logger.info("Adding default desks...")
+    for desk_id, name, user_type in (
+        ("cd:fb:1a:53:fb:e6", "DESK 4486", UserType.ACTIVE),
+        ("ee:62:5b:b8:73:1d", "DESK 6743", UserType.STANDING),
+    ):
+        if desk_manager.owns_desk(desk_id):
+            desk_manager.add_desk(desk_id, name, "Desk-O-Matic Co.", user_type)
+
+    missing_desks = desks - len(desk_manager.get_desk_ids())
+    if missing_desks > 0:
+        logger.info(f"Adding {missing_desks} additional desks.")
+        desk_manager.add_desks([{"user_type": UserType.ACTIVE}] * missing_desks)
+
+def run_headless(days, seed=None, output="-", output_format=None, desks=2, speed=60, tick_engine="object", tick_hz=1,
+                 desk_time="real", behavior_engine="object", state_format="json"):
+    """Simulate `days` days as fast as possible without a server, writing the desk trajectories to `output`.
+
+    Starts from the state file like the server but does not save it. The same state file and seed
+    give the same trajectories.
+    """
+    if seed is not None:
+        random.seed(seed)
+    desk_manager = DeskManager(speed, tick_engine=tick_engine, tick_hz=tick_hz, desk_time=desk_time,
+                               behavior_engine=behavior_engine, seed=seed, state_format=state_format)
+    add_default_desks(desk_manager, desks)
+    writer = trajectory.open_writer(output, output_format)
+    desk_manager.recorder = writer
+    desk_manager.publish_snapshots = False
+    total_s = days * DeskManager.SECONDS_PER_DAY
+    done_s = 0
+    started = time.perf_counter()
+    try:
+        while done_s < total_s:
+            # One simulated day at a time, to report progress.
+            step_s = min(DeskManager.SECONDS_PER_DAY, total_s - done_s)
+            step_started = time.perf_counter()
+            desk_manager.fast_forward(step_s)
+            done_s += step_s
+            logger.info(f"Simulated {done_s / DeskManager.SECONDS_PER_DAY:g} of {days:g} days "
+                        f"({step_s / (time.perf_counter() - step_started):.0f} simulated seconds per second).")
+    except KeyboardInterrupt:
+        logger.info("Headless run interrupted.")
+    finally:
+        writer.close()
+    elapsed_s = time.perf_counter() - started
+    logger.info(f"Simulated {done_s / DeskManager.SECONDS_PER_DAY:g} days of {len(desk_manager.desks)} desks in {elapsed_s:.1f} s "
+                f"({done_s / elapsed_s:.0f} simulated seconds per second), {writer.records} records written.")
+
+def _stop(desk_manager, shard, internal_httpd):
+    """Stop the desk updates, and hand a shard's state to the supervisor instead of saving it."""
+    desk_manager.stop_updates(save=shard is None)
+    if shard is not None:
+        internal_httpd.shutdown()
+        shard.results.put((shard.index, desk_manager.export_state()))
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def _run_worker(log_settings, run_kwargs):
+    """Entry point of a worker process."""
+    setup_logging(*log_settings)
+    run(**run_kwargs)
+
+def run_workers(workers, internal_port, log_settings, **run_kwargs):
+    """Run one process per shard, all serving the same port, and save their combined state when stopped."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=_run_worker,
+            args=(log_settings, dict(run_kwargs, shard=Shard(index, workers, internal_port, results))),
+            name=f"shard-{index}",
+        )
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Started {workers} worker processes.")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        logger.info("Stopping worker processes...")
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    states = {}
+    while len(states) < workers:
+        try:
+            index, state = results.get(timeout=WORKER_STOP_TIMEOUT_S)
+        except queue.Empty:
+            break
+        states[index] = state
+    for process in processes:
+        process.join()
+
+    if len(states) < workers:
+        # Saving only some shards would drop the other shards' desks from the state file.
+        logger.error(f"Only {len(states)} of {workers} workers reported their state; state file not saved.")
+        return
+    merged = {}
+    for index in sorted(states):
+        merged.update(states[index])
+    DeskManager.write_state(merged, run_kwargs["state_format"])
+    logger.info("Server stopped.")
+
 """
     To execute the script as HTTPS, use the following command:
         python main.py --port 8443 --https --certfile cert.pem --keyfile key.pem
@@ -88,11 +238,55 @@ if __name__ == "__main__":
     parser.add_argument("--keyfile", type=str, help="Path to the SSL key file")
     parser.add_argument("--desks", type=int, default=2, help="Minimum number of desks to simulate (default: 2)")
     parser.add_argument("--speed", type=int, default=60, help="Simulation speed (default: 60)")
+    parser.add_argument("--engine", type=str, choices=["simple", "asyncio"], default="simple", help="HTTP server engine (default: simple)")
+    parser.add_argument("--max-inflight", type=int, default=64, help="Maximum concurrently processed requests for the asyncio engine (default: 64)")
+    parser.add_argument("--tick-engine", type=str, choices=["object", "numpy"], default="object", help="Desk update engine; numpy advances all desks with array operations and needs NumPy (default: object)")
+    parser.add_argument("--behavior-engine", type=str, choices=["object", "population"], default="object", help="User behavior engine; population gives every user personal sit/stand habits decided in batched NumPy steps and needs NumPy (default: object)")
+    parser.add_argument("--tick-hz", type=float, default=1, help="Ticks per real second; each tick moves the desks a proportionally smaller step (default: 1)")
+    parser.add_argument("--desk-time", type=str, choices=["real", "simulated"], default="real", help="Clock desk motion follows; simulated moves desks simulation-speed times faster (default: real)")
+    parser.add_argument("--headless", action="store_true", help="Simulate --days days as fast as possible without a server and write the desk trajectories")
+    parser.add_argument("--days", type=float, default=1, help="Simulated days to run in headless mode (default: 1)")
+    parser.add_argument("--seed", type=int, help="Random seed for a reproducible headless run")
+    parser.add_argument("--output", type=str, default="-", help="Trajectory file of a headless run, - for standard output (default: -)")
+    parser.add_argument("--format", type=str, choices=["ndjson", "csv"], help="Trajectory format (default: csv for a .csv output file, otherwise ndjson)")
+    parser.add_argument("--state-format", type=str, choices=["json", "binary"], default="json", help="State file format; binary loads and saves large fleets much faster and imports the JSON file if it has no binary one yet (default: json)")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes, each simulating its own shard of the desks (default: 1)")
+    parser.add_argument("--internal-port", type=int, help="First of the loopback ports the workers use to reach each other (default: port + 1)")
+    parser.add_argument("--compress-min-bytes", type=int, default=1024, help="Smallest response body compressed with gzip/deflate (default: 1024)")
+    parser.add_argument("--compress-level", type=int, choices=range(0, 10), default=6, metavar="{0-9}", help="gzip/deflate compression level, 0 disables compression (default: 6)")
     parser.add_argument("--log-level", type=str, default="INFO", help="Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)")
+    parser.add_argument("--log-burst", type=int, default=5, help="Per-desk log records let through per interval before sampling starts, 0 disables rate limiting (default: 5)")
+    parser.add_argument("--log-interval", type=float, default=10.0, help="Log rate limiting interval in seconds (default: 10)")
+    parser.add_argument("--log-sample", type=int, default=100, help="After the burst, log every Nth per-desk record (default: 100)")
 
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("--workers needs SO_REUSEPORT, which this platform does not support")
+    if args.days <= 0:
+        parser.error("--days must be greater than 0")
+    if args.headless and args.workers > 1:
+        parser.error("--headless runs in a single process; drop --workers")
+    if args.tick_hz <= 0:
+        parser.error("--tick-hz must be greater than 0")
+    if args.tick_engine == "numpy" and not vector_engine.AVAILABLE:
+        parser.error("--tick-engine numpy needs NumPy; install it with 'pip install numpy'")
+    if args.behavior_engine == "population" and not population.AVAILABLE:
+        parser.error("--behavior-engine population needs NumPy; install it with 'pip install numpy'")
 
-    setup_logging(args.log_level)
+    log_settings = (args.log_level, args.log_burst, args.log_interval, args.log_sample,
+                    WORKER_LOG_FORMAT if args.workers > 1 else LOG_FORMAT)
+    setup_logging(*log_settings)
+
+    if args.headless:
+        logger.info(f"Headless run: {args.days:g} days, {args.desks} desks, seed {args.seed}, "
+                    f"speed {args.speed}, {args.tick_engine} tick engine at {args.tick_hz} Hz, {args.desk_time} desk time, "
+                    f"{args.behavior_engine} behavior engine")
+        run_headless(args.days, seed=args.seed, output=args.output, output_format=args.format, desks=args.desks,
+                     speed=args.speed, tick_engine=args.tick_engine, tick_hz=args.tick_hz, desk_time=args.desk_time,
+                     behavior_engine=args.behavior_engine, state_format=args.state_format)
+        raise SystemExit(0)
 
     logger.info("Starting server with the following configuration:")
     logger.info(f"Port: {args.port}")
@@ -102,13 +296,33 @@ if __name__ == "__main__":
         logger.info(f"Key file: {args.keyfile}")
     logger.info(f"Number of desks: {args.desks}")
     logger.info(f"Simulation speed: {args.speed}")
+    logger.info(f"Server engine: {args.engine}")
+    logger.info(f"Tick engine: {args.tick_engine}")
+    logger.info(f"Tick rate: {args.tick_hz} Hz, desks moving in {args.desk_time} time")
+    logger.info(f"Behavior engine: {args.behavior_engine}")
+    logger.info(f"State format: {args.state_format}")
+    logger.info(f"Worker processes: {args.workers}")
+    logger.info(f"Compression: level {args.compress_level}, bodies of {args.compress_min_bytes} bytes or more")
     logger.info(f"Logging level: {args.log_level}")
 
-    run(
+    run_kwargs = dict(
         port=args.port,
         use_https=args.https,
         cert_file=args.certfile,
         key_file=args.keyfile,
         desks=args.desks,
-        speed=args.speed
+        speed=args.speed,
+        engine=args.engine,
+        max_in_flight=args.max_inflight,
+        compress_min_bytes=args.compress_min_bytes,
+        compress_level=args.compress_level,
+        tick_engine=args.tick_engine,
+        tick_hz=args.tick_hz,
+        desk_time=args.desk_time,
+        behavior_engine=args.behavior_engine,
+        state_format=args.state_format,
     )
+    if args.workers > 1:
+        run_workers(args.workers, args.internal_port or args.port + 1, log_settings, **run_kwargs)
+    else:
+        run(**run_kwargs)
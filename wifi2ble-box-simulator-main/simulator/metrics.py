@@ -0,0 +1,218 @@
+import bisect
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOCK_BUCKETS = (0.000001, 0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0)
+TICK_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class MetricsRegistry:
+    """Counters, gauges and histograms rendered in the Prometheus text format.
+
+    Counters and histograms are written to a shard owned by the calling thread, so recording takes
+    no lock; a scrape sums the shards of every thread. Shards of finished threads are folded into
+    one retired shard, so short-lived connection threads do not accumulate.
+    """
+    MAX_LIVE_SHARDS = 256
+
+    def __init__(self):
+        self.families = {}
+        self.local = threading.local()
+        self.shards = []
+        self.retired = ({}, {})
+        self.shards_lock = threading.Lock()
+        self.gauges = {}
+        self.collectors = []
+        self.constant_labels = ()
+
+    def counter(self, name, help_text, zero_labels=None):
+        """Register a counter; with `zero_labels`, that series is exported as 0 before its first increment."""
+        self.families[name] = ("counter", help_text, None)
+        if zero_labels is not None:
+            self.retired[0][(name, zero_labels)] = 0
+
+    def gauge(self, name, help_text):
+        self.families[name] = ("gauge", help_text, None)
+
+    def histogram(self, name, help_text, buckets):
+        self.families[name] = ("histogram", help_text, buckets)
+
+    def register_collector(self, collector):
+        """Register a callable returning (name, labels, value) samples, evaluated at every scrape."""
+        self.collectors.append(collector)
+
+    def _shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = ({}, {})
+            with self.shards_lock:
+                if len(self.shards) >= self.MAX_LIVE_SHARDS:
+                    self._retire_finished_threads()
+                self.shards.append((threading.current_thread(), shard))
+            return shard
+
+    def inc(self, name, labels=(), amount=1):
+        counters = self._shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        histograms = self._shard()[1]
+        key = (name, labels)
+        state = histograms.get(key)
+        if state is None:
+            # One count per bucket, one for +Inf, then the sum of observed values.
+            state = histograms[key] = [0] * (len(self.families[name][2]) + 2)
+        state[bisect.bisect_left(self.families[name][2], value)] += 1
+        state[-1] += value
+
+    def set_gauge(self, name, value, labels=()):
+        self.gauges[(name, labels)] = value
+
+    def _retire_finished_threads(self):
+        """Fold the shards of finished threads into the retired shard. Must hold self.shards_lock."""
+        live = []
+        for thread, shard in self.shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge_into(self.retired, shard)
+        self.shards = live
+
+    @staticmethod
+    def _merge_into(target, shard):
+        counters, histograms = target
+        for key, value in shard[0].copy().items():
+            counters[key] = counters.get(key, 0) + value
+        for key, state in shard[1].copy().items():
+            total = histograms.get(key)
+            if total is None:
+                histograms[key] = list(state)
+            else:
+                for index, value in enumerate(state):
+                    total[index] += value
+
+    def collect(self):
+        """Return merged counters, histograms and gauge-like samples from every shard and collector."""
+        merged = ({}, {})
+        with self.shards_lock:
+            self._retire_finished_threads()
+            self._merge_into(merged, self.retired)
+            for _, shard in self.shards:
+                self._merge_into(merged, shard)
+        samples = dict(self.gauges)
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                samples[(name, labels)] = value
+        return merged[0], merged[1], samples
+
+    def render(self):
+        """Render every registered family in the Prometheus text exposition format."""
+        counters, histograms, samples = self.collect()
+        by_family = {}
+        for values in (counters, samples):
+            for (name, labels), value in values.items():
+                by_family.setdefault(name, []).append((labels, value))
+        for (name, labels), state in histograms.items():
+            by_family.setdefault(name, []).append((labels, state))
+
+        lines = []
+        for name, (kind, help_text, buckets) in self.families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(by_family.get(name, ()), key=lambda item: item[0]):
+                labels = self.constant_labels + labels
+                if kind != "histogram":
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float("inf"),), value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', format_value(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(value[-1])}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label_value(value)}"' for key, value in labels) + "}"
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def merge_expositions(texts):
+    """Merge the expositions of several processes, keeping the samples of each family together."""
+    families = {}
+    for text in texts:
+        current = None
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                current = families.setdefault(line.split(" ", 3)[2], ([], []))
+                if line not in current[0]:
+                    current[0].append(line)
+            elif line and current is not None:
+                current[1].append(line)
+    return "".join("\n".join(headers + samples) + "\n" for headers, samples in families.values())
+
+class InstrumentedLock:
+    """Lock that records how long callers wait to acquire it and how long it is held."""
+
+    def __init__(self, name, registry=None):
+        self.lock = threading.Lock()
+        self.registry = registry or REGISTRY
+        self.labels = (("lock", name),)
+        self.acquired_at = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        started = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        if acquired:
+            self.acquired_at = now = time.perf_counter()
+            self.registry.observe("simulator_lock_wait_seconds", now - started, self.labels)
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self.acquired_at
+        self.lock.release()
+        self.registry.observe("simulator_lock_hold_seconds", held, self.labels)
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+REGISTRY = MetricsRegistry()
+REGISTRY.counter("simulator_http_requests_total", "HTTP requests served, by route, method and status code.")
+REGISTRY.histogram("simulator_http_request_duration_seconds", "Time from parsing a request to finishing its response.", LATENCY_BUCKETS)
+REGISTRY.histogram("simulator_lock_wait_seconds", "Time spent waiting to acquire a lock.", LOCK_BUCKETS)
+REGISTRY.histogram("simulator_lock_hold_seconds", "Time a lock was held.", LOCK_BUCKETS)
+REGISTRY.histogram("simulator_tick_duration_seconds", "Time taken by one simulation tick over all desks.", TICK_BUCKETS)
+REGISTRY.gauge("simulator_tick_lag_seconds", "How far the latest tick started behind its schedule.")
+REGISTRY.counter("simulator_ticks_total", "Simulation ticks run.", zero_labels=())
+REGISTRY.counter("simulator_tick_overruns_total", "Ticks that took longer than the tick period.", zero_labels=())
+REGISTRY.counter("simulator_ticks_skipped_total", "Ticks dropped because the simulation fell too far behind to catch up.", zero_labels=())
+REGISTRY.gauge("simulator_simulated_time_seconds", "Simulated time of the latest event, in seconds.")
+REGISTRY.gauge("simulator_desks", "Desks by power state.")
+REGISTRY.counter("simulator_collisions_total", "Desk collisions detected.", zero_labels=())
+REGISTRY.gauge("simulator_active_set_desks", "Desks updated by each tick of the object engine because they are moving or recovering from a collision.")
+REGISTRY.gauge("simulator_scheduled_events", "Events waiting in the simulation scheduler.")
+REGISTRY.gauge("simulator_event_subscribers", "Open Server-Sent Events subscriptions.")
+REGISTRY.counter("simulator_response_cache_hits_total", "Desk responses served from the response cache.")
+REGISTRY.counter("simulator_response_cache_misses_total", "Desk responses that had to be encoded.")
+REGISTRY.gauge("simulator_response_cache_entries", "Entries in the response cache.")
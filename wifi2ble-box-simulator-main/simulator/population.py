@@ -0,0 +1,75 @@
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+AVAILABLE = np is not None
+
+class PopulationBehaviorEngine:
+    """Makes the sit/stand decisions of every MarkovUser in one batched NumPy step.
+
+    Each step covers STEP_S simulated seconds. A user leaves their current posture during a step with
+    probability 1 - exp(-STEP_S / mean bout length), so bouts last their mean on average. The chances
+    and heights are kept in arrays with one row per user and rebuilt from the users when desks are
+    added or removed; only the users who switch are touched as objects, to move their desks.
+    """
+    STEP_S = 300
+
+    def __init__(self, seed=None):
+        if np is None:
+            raise RuntimeError("The population behavior engine requires NumPy; install it with 'pip install numpy'.")
+        self.rng = np.random.default_rng(seed)
+        self.fleet_version = None
+        self.users = []
+        self.rows = {}
+
+    def _rebuild(self, users, fleet_version):
+        """Load the arrays from the users after desks were added or removed."""
+        self.users = list(users.values())
+        self.rows = {user.desk.desk_id: row for row, user in enumerate(self.users)}
+        self.fleet_version = fleet_version
+
+        def column(values, dtype):
+            return np.fromiter(values, dtype, len(self.users))
+        mean_bout_s = np.stack([
+            column((user.mean_seated_s for user in self.users), np.float64),
+            column((user.mean_standing_s for user in self.users), np.float64),
+        ], axis=1)
+        # Chance of leaving the seated (column 0) or standing (column 1) posture during one step.
+        self.leave_chance = -np.expm1(-self.STEP_S / mean_bout_s)
+        self.position = np.stack([
+            column((user.seated_position for user in self.users), np.int64),
+            column((user.standing_position for user in self.users), np.int64),
+        ], axis=1)
+        self.standing = column((user.standing for user in self.users), np.bool_)
+
+    def step(self, users, powered_off_desks, fleet_version):
+        """Let the user of every powered-on desk decide whether to switch posture, and move the desks of those who do.
+
+        Returns the number of users who switched. Callers hold the DeskManager lock.
+        """
+        if fleet_version != self.fleet_version:
+            self._rebuild(users, fleet_version)
+        if not self.users:
+            return 0
+
+        rows = np.arange(len(self.users))
+        switch = self.rng.random(len(self.users)) < self.leave_chance[rows, self.standing.view(np.uint8)]
+        for desk_id in powered_off_desks:
+            row = self.rows.get(desk_id)
+            if row is not None:
+                switch[row] = False
+        self.standing ^= switch
+
+        switched = np.flatnonzero(switch)
+        targets = self.position[switched, self.standing[switched].view(np.uint8)]
+        for row, standing, target in zip(switched.tolist(), self.standing[switched].tolist(), targets.tolist()):
+            user = self.users[row]
+            user.standing = standing
+            user.desk.set_target_position(target, log=False)
+        logger.debug("Population step: %s of %s users switched posture.", len(switched), len(self.users))
+        return len(switched)
@@ -0,0 +1,64 @@
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """Encoded JSON response bodies per desk and category, valid for one desk version.
+
+    Desks bump their version only when update(), set_target_position() or _generate_error()
+    actually change data, so a cached body stays valid exactly until the next real change.
+    Compressed variants are kept next to the uncompressed body, keyed by content encoding.
+    """
+    MAX_ENTRIES = 200000
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, desk_id, category, version, encoding=None):
+        """Return the cached body for this desk version and content encoding, or None."""
+        with self.lock:
+            entry = self.entries.get((desk_id, category))
+            body = entry[1].get(encoding) if entry is not None and entry[0] == version else None
+            if body is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return body
+
+    def put(self, desk_id, category, version, body, encoding=None):
+        """Store a body encoded from data at least as new as `version`."""
+        with self.lock:
+            key = (desk_id, category)
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > version:
+                return
+            if entry is not None and entry[0] == version:
+                entry[1][encoding] = body
+                return
+            if entry is None and len(self.entries) >= self.max_entries:
+                # Evict the oldest inserted entry; stale entries of removed desks age out this way.
+                del self.entries[next(iter(self.entries))]
+            self.entries[key] = (version, {encoding: body})
+
+    def collect_metrics(self):
+        """Cache samples for the metrics endpoint."""
+        return [
+            ("simulator_response_cache_hits_total", (), self.hits),
+            ("simulator_response_cache_misses_total", (), self.misses),
+            ("simulator_response_cache_entries", (), len(self.entries)),
+        ]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self.entries),
+            }
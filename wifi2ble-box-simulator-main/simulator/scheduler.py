@@ -0,0 +1,116 @@
+import heapq
+import itertools
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class EventScheduler:
+    """Discrete-event loop running timed callbacks in simulated-time order on a single thread.
+
+    Events sit in a heap keyed by simulated time. While running, simulated time advances at `speed`
+    simulated seconds per real second; the loop sleeps until the next event is due, then runs every
+    due event in one batch under `lock`, with `now_s` set to each event's time as it runs. Events can
+    be scheduled from any thread. run_until() instead runs events back to back on a virtual clock.
+    """
+
+    def __init__(self, lock, now_s=0):
+        self.lock = lock
+        self.now_s = now_s
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.speed = 1
+        self.real_start = None
+        self.simulated_start = now_s
+        # How late, in real seconds, the event being run started compared with its due time.
+        self.lateness_s = 0.0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def schedule(self, time_s, callback, *args):
+        """Run `callback(*args)` at simulated time `time_s`, or as soon as possible if that time has passed."""
+        with self.condition:
+            heapq.heappush(self.queue, (time_s, next(self.sequence), callback, args))
+            if self.queue[0][0] == time_s:
+                self.condition.notify()
+
+    def schedule_many(self, events):
+        """Schedule many (time_s, callback, args) events at once, in linear time rather than one heap push each."""
+        with self.condition:
+            self.queue.extend((time_s, next(self.sequence), callback, args) for time_s, callback, args in events)
+            heapq.heapify(self.queue)
+            self.condition.notify()
+
+    def real_time(self, time_s):
+        """The monotonic clock time at which simulated time `time_s` is due."""
+        return self.real_start + (time_s - self.simulated_start) / self.speed
+
+    def simulated_now(self):
+        """The simulated time the clock has reached, which may be ahead of the events run so far."""
+        if self.real_start is None:
+            # Not running in real time, so the clock is wherever the events have brought it.
+            return self.now_s
+        return self.simulated_start + (time.monotonic() - self.real_start) * self.speed
+
+    def run(self, speed):
+        """Run events as they come due until stop() is called."""
+        with self.condition:
+            self.stopped = False
+            self.speed = speed
+            self.real_start = time.monotonic()
+            self.simulated_start = self.now_s
+        while True:
+            with self.condition:
+                due = self._wait_for_due_events()
+            if due is None:
+                return
+            with self.lock:
+                for time_s, _, callback, args in due:
+                    self.lateness_s = max(0.0, time.monotonic() - self.real_time(time_s))
+                    self._run_event(time_s, callback, args)
+
+    def run_until(self, end_s):
+        """Run every event due up to simulated time `end_s` in order, as fast as possible, on the calling thread.
+
+        Holds `lock` throughout and leaves `now_s` at `end_s`. Must not be used while run() is running.
+        """
+        with self.lock:
+            while True:
+                with self.condition:
+                    if not self.queue or self.queue[0][0] > end_s:
+                        break
+                    time_s, _, callback, args = heapq.heappop(self.queue)
+                self._run_event(time_s, callback, args)
+            self.now_s = max(self.now_s, end_s)
+
+    def _run_event(self, time_s, callback, args):
+        self.now_s = max(self.now_s, time_s)
+        try:
+            callback(*args)
+        except Exception:
+            logger.exception(f"Scheduled event {callback.__name__} failed.")
+
+    def _wait_for_due_events(self):
+        """Wait until at least one event is due and pop all due events, or return None once stopped. Must hold self.condition."""
+        while not self.stopped:
+            if self.queue:
+                wait_s = self.real_time(self.queue[0][0]) - time.monotonic()
+                if wait_s <= 0:
+                    due = []
+                    now_s = self.simulated_now()
+                    while self.queue and self.queue[0][0] <= now_s:
+                        due.append(heapq.heappop(self.queue))
+                    return due
+                self.condition.wait(wait_s)
+            else:
+                self.condition.wait()
+        return None
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
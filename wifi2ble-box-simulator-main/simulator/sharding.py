@@ -0,0 +1,530 @@
+import heapq
+import http.client
+import itertools
+import json
+import logging
+import socket
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlencode, urlsplit
+from desk_manager import generate_desk_id
+from metrics import REGISTRY as METRICS, CONTENT_TYPE as METRICS_CONTENT_TYPE, merge_expositions
+from simple_rest_server import SimpleRESTServer
+
+logger = logging.getLogger(__name__)
+
+def shard_for(desk_id, shard_count):
+    """Return the index of the shard owning a desk. crc32 is stable across processes and restarts, unlike hash()."""
+    return zlib.crc32(desk_id.encode("utf-8")) % shard_count
+
+class Shard:
+    """One worker process's place in the shard layout, and where to reach the other shards."""
+    INTERNAL_HOST = "127.0.0.1"
+
+    def __init__(self, index, count, internal_base_port, results=None):
+        self.index = index
+        self.count = count
+        self.internal_base_port = internal_base_port
+        self.results = results
+
+    def owns(self, desk_id):
+        return shard_for(desk_id, self.count) == self.index
+
+    def internal_address(self, index):
+        return self.INTERNAL_HOST, self.internal_base_port + index
+
+class ReusePortHTTPServer(ThreadingHTTPServer):
+    """Threading HTTP server whose port is shared by every worker process; the kernel spreads connections across them."""
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+class ShardClient:
+    """Keep-alive connections from this process to the internal port of every shard, one set per thread."""
+    TIMEOUT_S = 30
+    FAN_OUT_THREADS = 32
+
+    def __init__(self, shard: Shard):
+        self.shard = shard
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=self.FAN_OUT_THREADS, thread_name_prefix="shard-client")
+
+    def request(self, index, method, path, body=None, headers=None):
+        """Send one request to a shard and return the status, headers and body of its response."""
+        return self.read(index, self.open(index, method, path, body, headers))
+
+    def read(self, index, response):
+        """Return the status, headers and body of a response from open(), or a 502 response if the shard failed."""
+        if response is not None:
+            try:
+                return response.status, response.getheaders(), response.read()
+            except (http.client.HTTPException, OSError) as e:
+                self.close(index)
+                logger.error(f"Shard {index} unavailable: {e}")
+        return 502, [], json.dumps({"error": "Shard unavailable"}).encode("utf-8")
+
+    def open(self, index, method, path, body=None, headers=None):
+        """Send one request to a shard and return its response with the body unread, or None if the shard is unavailable.
+
+        The body must be read to the end, or the connection closed, before this thread sends the shard another request.
+        """
+        connections = self.local.__dict__.setdefault("connections", {})
+        headers = {**(headers or {}), ShardedRESTServer.SHARD_HEADER: "1"}
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        for attempt in range(2):
+            connection = connections.get(index)
+            if connection is None:
+                connection = connections[index] = http.client.HTTPConnection(*self.shard.internal_address(index), timeout=self.TIMEOUT_S)
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                return connection.getresponse()
+            except (http.client.HTTPException, OSError) as e:
+                # The shard may have closed an idle keep-alive connection; retry once on a new one.
+                self.close(index)
+                if attempt:
+                    logger.error(f"Shard {index} unavailable: {e}")
+                    return None
+
+    def close(self, index):
+        """Close this thread's connection to a shard, for example after leaving a response unread."""
+        connection = self.local.__dict__.setdefault("connections", {}).pop(index, None)
+        if connection is not None:
+            connection.close()
+
+    def fan_out(self, requests, headers=None):
+        """Send {shard index: (method, path, body)} requests in parallel and return {shard index: response}."""
+        futures = {
+            index: self.executor.submit(self.request, index, method, path, body, headers)
+            for index, (method, path, body) in requests.items()
+        }
+        return {index: future.result() for index, future in futures.items()}
+
+class ShardedRESTServer(SimpleRESTServer):
+    """Front end of one shard worker.
+
+    Requests for a desk are served here if this shard owns the desk and forwarded to the owning
+    shard's internal port otherwise. Fleet-wide requests are sent to every shard and merged.
+    Requests carrying the X-Shard-Local header come from another shard and are always served locally.
+    """
+    SHARD_HEADER = "X-Shard-Local"
+    FORWARDED_HEADERS = ("Accept", "Accept-Encoding", "If-None-Match", "Last-Event-ID")
+    HOP_BY_HOP_HEADERS = ("connection", "keep-alive", "transfer-encoding", "content-length", "date", "server")
+    CURSOR_SEPARATOR = "~"
+    STREAM_CHUNK_BYTES = 64 * 1024
+    SHARD = None
+    CLIENT = None
+
+    @classmethod
+    def configure(cls, shard: Shard):
+        cls.SHARD = shard
+        cls.CLIENT = ShardClient(shard)
+        METRICS.constant_labels = (("shard", str(shard.index)),)
+
+    def _is_shard_local(self):
+        return self.headers.get(self.SHARD_HEADER) == "1"
+
+    def _owner(self, desk_id):
+        return shard_for(desk_id, self.SHARD.count)
+
+    def do_GET(self):
+        if self._is_shard_local():
+            super().do_GET()
+            return
+        if not self._is_valid_path():
+            return
+
+        parts = self.path_parts
+        if parts[3] == "cache" and len(parts) == 4:
+            self._aggregate_cache_stats()
+        elif parts[3] == "metrics" and len(parts) == 4:
+            self._aggregate_metrics()
+        elif parts[3] != "desks":
+            super().do_GET()
+        elif len(parts) == 4 and "expand" in self.query:
+            self._aggregate_fleet_snapshot()
+        elif len(parts) == 4 and any(param in self.query for param in self.LIST_PARAMS):
+            self._aggregate_desk_page()
+        elif len(parts) == 4:
+            self._aggregate_desk_ids()
+        elif len(parts) == 5 and parts[4] == "changes":
+            self._aggregate_changes()
+        elif len(parts) == 5 and parts[4] == "events":
+            self._route_event_stream()
+        else:
+            self._route_to_owner(parts[4], super().do_GET)
+
+    def do_PUT(self):
+        if self._is_shard_local():
+            super().do_PUT()
+            return
+        if not self._is_valid_path():
+            return
+
+        parts = self.path_parts
+        if parts[3] == "desks" and len(parts) == 4:
+            self._route_batch_command()
+        elif parts[3] == "desks" and len(parts) == 6:
+            self._route_to_owner(parts[4], super().do_PUT)
+        else:
+            super().do_PUT()
+
+    def do_POST(self):
+        if self._is_shard_local():
+            super().do_POST()
+            return
+        if not self._is_valid_path():
+            return
+
+        if self.path_parts[3] == "desks" and len(self.path_parts) == 4:
+            self._route_desk_creation()
+        else:
+            super().do_POST()
+
+    def do_DELETE(self):
+        if self._is_shard_local():
+            super().do_DELETE()
+            return
+        if not self._is_valid_path():
+            return
+
+        parts = self.path_parts
+        if parts[3] == "desks" and len(parts) == 4:
+            self._route_desk_removal()
+        elif parts[3] == "desks" and len(parts) == 5:
+            self._route_to_owner(parts[4], super().do_DELETE)
+        else:
+            super().do_DELETE()
+
+    def _route_to_owner(self, desk_id, local_handler):
+        """Serve a single-desk request here if this shard owns the desk, or forward it to the owner."""
+        owner = self._owner(desk_id)
+        if owner == self.SHARD.index:
+            local_handler()
+            return
+        body = self._read_body() if self.headers.get("Content-Length") else None
+        headers = {name: self.headers[name] for name in self.FORWARDED_HEADERS if name in self.headers}
+        self._relay(*self.CLIENT.request(owner, self.command, self.path, body, headers))
+
+    def _relay(self, status_code, headers, body):
+        """Pass a shard's response on to the client unchanged."""
+        self._drain_body()
+        self.send_response(status_code)
+        for name, value in headers:
+            if name.lower() not in self.HOP_BY_HOP_HEADERS:
+                self.send_header(name, value)
+        if status_code != 304:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if status_code != 304:
+            self.wfile.write(body)
+
+    def _fan_out_all(self, path=None, method="GET"):
+        """Send the same bodiless request to every shard. Returns the responses, or None after relaying a shard's error."""
+        path = path or self.path
+        responses = self.CLIENT.fan_out({index: (method, path, None) for index in range(self.SHARD.count)})
+        return self._check_responses(responses)
+
+    def _check_responses(self, responses):
+        for status_code, headers, body in responses.values():
+            if status_code != 200:
+                self._relay(status_code, headers, body)
+                return None
+        return responses
+
+    def _aggregate_desk_ids(self):
+        responses = self._fan_out_all()
+        if responses is None:
+            return
+        desk_ids = heapq.merge(*(json.loads(body) for _, _, body in responses.values()))
+        self._send_response(200, list(desk_ids))
+
+    def _aggregate_desk_page(self):
+        """Merge the pages of every shard; each holds that shard's first `limit` matches after the cursor."""
+        responses = self._fan_out_all()
+        if responses is None:
+            return
+        limit = int(self.query.get("limit", [self.DEFAULT_PAGE_SIZE])[-1])
+        pages = [json.loads(body) for _, _, body in responses.values()]
+        desk_ids = sorted(desk_id for page in pages for desk_id in page["desks"])
+        more = len(desk_ids) > limit or any(page["next_cursor"] for page in pages)
+        desk_ids = desk_ids[:limit]
+        self._send_response(200, {"desks": desk_ids, "next_cursor": desk_ids[-1] if more and desk_ids else None})
+
+    def _aggregate_fleet_snapshot(self):
+        """Stream the fleet snapshots of every shard as one response, with a composite change feed cursor.
+
+        The shard bodies are forwarded chunk by chunk as they arrive, so no shard's fleet is held in memory.
+        """
+        # Accept selects the format; Accept-Encoding is left out so shard bodies can be joined, then compressed once.
+        headers = {"Accept": self.headers["Accept"]} if "Accept" in self.headers else None
+        responses = [self.CLIENT.open(index, "GET", self.path, headers=headers) for index in range(self.SHARD.count)]
+        failed = next((index for index, response in enumerate(responses) if response is None or response.status != 200), None)
+        if failed is not None:
+            for index, response in enumerate(responses):
+                if index != failed and response is not None:
+                    self.CLIENT.close(index)
+            self._relay(*self.CLIENT.read(failed, responses[failed]))
+            return
+
+        cursors = [response.getheader("X-Changes-Cursor", "") for response in responses]
+        content_type = responses[-1].getheader("Content-Type", "application/json")
+        bodies = (self._read_shard_body(index, response) for index, response in enumerate(responses))
+        if content_type == self.NDJSON_CONTENT_TYPE:
+            chunks = itertools.chain.from_iterable(bodies)
+        else:
+            chunks = self._merge_json_objects(bodies)
+        self._send_chunked(200, content_type, chunks, {"X-Changes-Cursor": self.CURSOR_SEPARATOR.join(cursors)})
+
+    def _read_shard_body(self, index, response):
+        """Yield a shard's response body in chunks of up to STREAM_CHUNK_BYTES."""
+        try:
+            while chunk := response.read(self.STREAM_CHUNK_BYTES):
+                yield chunk
+        except (http.client.HTTPException, OSError) as e:
+            self.CLIENT.close(index)
+            # Ends this response unfinished, so the client can tell it is incomplete.
+            raise ConnectionError(f"Shard {index} failed while streaming: {e}")
+
+    @staticmethod
+    def _merge_json_objects(bodies):
+        """Join streamed JSON objects, each an iterator of byte chunks, into one object without decoding them."""
+        yield b"{"
+        separator = b""
+        for chunks in bodies:
+            opened = False
+            started = False
+            held = b""
+            for chunk in chunks:
+                data = held + chunk
+                if not opened:
+                    data = data.lstrip()
+                    if not data:
+                        continue
+                    # Drop the opening brace.
+                    data = data[1:]
+                    opened = True
+                content = data.rstrip()
+                # Hold back the last non-whitespace byte and what follows it, as it may be the closing brace.
+                held = data[max(len(content) - 1, 0):]
+                members = content[:-1]
+                if not started:
+                    members = members.lstrip()
+                if members:
+                    yield members if started else separator + members
+                    started = True
+            if started:
+                separator = b", "
+        yield b"}"
+
+    def _aggregate_changes(self):
+        """Split a composite cursor into per-shard cursors and merge every shard's changes."""
+        since = self.query.get("since", [""])[-1]
+        if not since:
+            logger.warning(f"Missing since cursor for changes: {self.path}")
+            self._send_response(400, {"error": "Missing since cursor"})
+            return
+        cursors = since.split(self.CURSOR_SEPARATOR)
+        if len(cursors) != self.SHARD.count:
+            logger.warning(f"Change feed cursor does not match the shard layout: {since}")
+            self._send_response(410, {"error": "Cursor too old, resync required", "resync": True})
+            return
+
+        path = urlsplit(self.path).path
+        responses = self._check_responses(self.CLIENT.fan_out({
+            index: ("GET", f"{path}?{urlencode({'since': cursor})}", None) for index, cursor in enumerate(cursors)
+        }))
+        if responses is None:
+            return
+        new_cursors = []
+        desks = {}
+        removed = []
+        for _, _, body in responses.values():
+            changes = json.loads(body)
+            new_cursors.append(changes["cursor"])
+            desks.update(changes["desks"])
+            removed.extend(changes["removed"])
+        self._send_response(200, {"cursor": self.CURSOR_SEPARATOR.join(new_cursors), "desks": desks, "removed": removed})
+
+    def _route_event_stream(self):
+        """Relay the event stream of the one shard owning every requested desk."""
+        desk_ids = [desk_id for desk_id in self.query.get("desks", [""])[-1].split(",") if desk_id]
+        owners = {self._owner(desk_id) for desk_id in desk_ids}
+        if len(owners) != 1:
+            logger.warning(f"Event stream spans several shards: {self.path}")
+            self._send_response(501, {"error": "With several workers, event streams must list desks of a single shard"})
+            return
+        owner = owners.pop()
+        if owner == self.SHARD.index:
+            self._send_event_stream()
+            return
+
+        headers = {name: self.headers[name] for name in self.FORWARDED_HEADERS if name in self.headers}
+        headers[self.SHARD_HEADER] = "1"
+        connection = http.client.HTTPConnection(*self.SHARD.internal_address(owner))
+        try:
+            connection.request("GET", self.path, headers=headers)
+            response = connection.getresponse()
+            self._drain_body()
+            self.close_connection = True
+            self.send_response(response.status)
+            for name, value in response.getheaders():
+                if name.lower() not in self.HOP_BY_HOP_HEADERS:
+                    self.send_header(name, value)
+            self.end_headers()
+            while chunk := response.read1(64 * 1024):
+                self.wfile.write(chunk)
+                self.wfile.flush()
+        except OSError as e:
+            logger.info(f"Relayed event stream closed: {e}")
+        finally:
+            connection.close()
+
+    def _aggregate_cache_stats(self):
+        responses = self._fan_out_all()
+        if responses is None:
+            return
+        stats = [json.loads(body) for _, _, body in responses.values()]
+        hits = sum(shard_stats["hits"] for shard_stats in stats)
+        misses = sum(shard_stats["misses"] for shard_stats in stats)
+        self._send_response(200, {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "entries": sum(shard_stats["entries"] for shard_stats in stats),
+        })
+
+    def _aggregate_metrics(self):
+        """Serve every shard's metrics in one exposition; each shard labels its own samples."""
+        responses = self._fan_out_all()
+        if responses is None:
+            return
+        texts = [body.decode("utf-8") for _, _, body in responses.values()]
+        self._send_body(200, merge_expositions(texts).encode("utf-8"), content_type=METRICS_CONTENT_TYPE)
+
+    def _route_batch_command(self):
+        """Split a batch command by owning shard and merge the results back into command order."""
+        commands = self._read_batch_commands()
+        if commands is None:
+            return
+        valid_commands, invalid = commands
+
+        groups = {}
+        for command in valid_commands:
+            groups.setdefault(self._owner(command[1]), []).append(command)
+        responses = self._check_responses(self.CLIENT.fan_out({
+            owner: ("PUT", self.path, json.dumps([{"desk_id": desk_id, "position_mm": position_mm} for _, desk_id, position_mm in group]))
+            for owner, group in groups.items()
+        }))
+        if responses is None:
+            return
+
+        accepted = []
+        errors = list(invalid)
+        for owner, (_, _, body) in responses.items():
+            result = json.loads(body)
+            group = groups[owner]
+            rejected = set()
+            for error in result["errors"]:
+                # The shard numbers its errors by position in its own part of the batch.
+                rejected.add(error["index"])
+                error["index"] = group[error["index"]][0]
+                errors.append(error)
+            # Every other command was accepted, and the shard reports those in command order.
+            shard_accepted = iter(result["accepted"])
+            accepted.extend((index, next(shard_accepted)) for position, (index, _, _) in enumerate(group) if position not in rejected)
+        accepted.sort(key=lambda item: item[0])
+        self._send_response(200, {
+            "accepted": [item for _, item in accepted],
+            "errors": sorted(errors, key=lambda error: error["index"]),
+        })
+
+    def _route_desk_creation(self):
+        """Give new desks their IDs here, so each one can be sent to the shard that will own it."""
+        try:
+            body = json.loads(self._read_body())
+        except (TypeError, ValueError):
+            logger.error(f"Invalid data format for POST: {self.path}")
+            self._send_response(400, {"error": "Invalid data"})
+            return
+
+        if isinstance(body, dict):
+            if body.get("desk_id") is None:
+                body["desk_id"] = generate_desk_id()
+            elif not isinstance(body["desk_id"], str):
+                self._send_response(400, {"error": "Invalid desk_id"})
+                return
+            self._relay(*self.CLIENT.request(self._owner(body["desk_id"]), "POST", self.path, json.dumps(body)))
+            return
+
+        if not isinstance(body, list):
+            logger.error(f"POST body is not a desk object or list: {self.path}")
+            self._send_response(400, {"error": "Expected a desk object or a list of desk objects"})
+            return
+
+        groups = {}
+        errors = []
+        for index, spec in enumerate(body):
+            if not isinstance(spec, dict):
+                errors.append({"index": index, "error": "Expected a desk object"})
+                continue
+            if spec.get("desk_id") is None:
+                spec["desk_id"] = generate_desk_id()
+            elif not isinstance(spec["desk_id"], str):
+                errors.append({"index": index, "error": "Invalid desk_id"})
+                continue
+            groups.setdefault(self._owner(spec["desk_id"]), []).append((index, spec))
+
+        responses = self._check_responses(self.CLIENT.fan_out({
+            owner: ("POST", self.path, json.dumps([spec for _, spec in group])) for owner, group in groups.items()
+        }))
+        if responses is None:
+            return
+
+        created = []
+        for owner, (_, _, response_body) in responses.items():
+            result = json.loads(response_body)
+            group = groups[owner]
+            rejected = set()
+            for error in result["errors"]:
+                rejected.add(error["index"])
+                error["index"] = group[error["index"]][0]
+                errors.append(error)
+            accepted_indexes = [index for position, (index, _) in enumerate(group) if position not in rejected]
+            created.extend(zip(accepted_indexes, result["created"]))
+        created.sort(key=lambda item: item[0])
+        errors.sort(key=lambda error: error["index"])
+        self._send_response(200, {"created": [desk_id for _, desk_id in created], "errors": errors})
+
+    def _route_desk_removal(self):
+        try:
+            desk_ids = json.loads(self._read_body())
+        except (TypeError, ValueError):
+            logger.error(f"Invalid data format for DELETE: {self.path}")
+            self._send_response(400, {"error": "Invalid data"})
+            return
+        if not isinstance(desk_ids, list) or not all(isinstance(desk_id, str) for desk_id in desk_ids):
+            logger.error(f"DELETE body is not a list of desk IDs: {self.path}")
+            self._send_response(400, {"error": "Expected a list of desk IDs"})
+            return
+
+        groups = {}
+        for desk_id in desk_ids:
+            groups.setdefault(self._owner(desk_id), []).append(desk_id)
+        responses = self._check_responses(self.CLIENT.fan_out({
+            owner: ("DELETE", self.path, json.dumps(group)) for owner, group in groups.items()
+        }))
+        if responses is None:
+            return
+        removed = []
+        errors = []
+        for _, _, body in responses.values():
+            result = json.loads(body)
+            removed.extend(result["removed"])
+            errors.extend(result["errors"])
+        self._send_response(200, {"removed": removed, "errors": errors})
@@ -1,7 +1,19 @@
+import itertools
 import json
 import logging
+import os
+import ssl
+import time
+import zlib
 from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit, parse_qs
+from desk import Desk
+from desk_index import DeskIndex
 from desk_manager import DeskManager
+from event_stream import SubscriberOverflow
+from metrics import REGISTRY as METRICS, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from response_cache import ResponseCache
+from users import UserType
 
 logger = logging.getLogger(__name__)
 
@@ -9,12 +21,58 @@ class SimpleRESTServer(BaseHTTPRequestHandler):
     VERSION = "v2"
     API_KEYS_FILE = "config/api_keys.json"
     API_KEYS = []
+    RESPONSE_CACHE = ResponseCache()
+
+    # Persistent HTTP/1.1 connections
+    protocol_version = "HTTP/1.1"
+    KEEPALIVE_TIMEOUT_S = 15
+    MAX_KEEPALIVE_REQUESTS = 1000
+    MAX_DRAIN_BYTES = 1024 * 1024
+    timeout = KEEPALIVE_TIMEOUT_S
+    disable_nagle_algorithm = True
+    wbufsize = 64 * 1024
+
+    # Desk versions and journal cursors restart with the process, so ETags and cursors carry a per-process epoch.
+    EPOCH = os.urandom(4).hex()
+
+    # Server-Sent Events
+    SSE_HEARTBEAT_S = 10
+    SSE_DEFAULT_BUFFER = 1024
+    SSE_RETRY_MS = 3000
+
+    # Fleet-wide streaming responses
+    NDJSON_CONTENT_TYPE = "application/x-ndjson"
+    STREAM_BATCH_SIZE = 256
+
+    # Paged desk listings
+    LIST_PARAMS = ("limit", "cursor", "status", "manufacturer", "band")
+    DEFAULT_PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 1000
+
+    # Response compression; a level of 0 disables it. gzip wins ties with deflate.
+    COMPRESSION_MIN_BYTES = 1024
+    COMPRESSION_LEVEL = 6
+    COMPRESSION_WBITS = {"gzip": 31, "deflate": 15}
+
+    # Request metrics; other methods are counted as "other" to keep label values bounded.
+    METRIC_METHODS = ("GET", "PUT", "POST", "DELETE", "HEAD")
 
     def __init__(self, desk_manager: DeskManager, *args, **kwargs):
         self.desk_manager = desk_manager
         self.path_parts = []
+        self.query = {}
+        self.requests_served = 0
+        self.body_consumed = False
+        self.request_started = None
+        self.status_code = None
         super().__init__(*args, **kwargs)
 
+    def setup(self):
+        super().setup()
+        if isinstance(self.request, ssl.SSLSocket):
+            # The listening socket defers the TLS handshake to the connection's own thread.
+            self.request.do_handshake()
+
     @staticmethod
     def load_api_keys(api_keys_file):
         """Static method to load API keys from a file."""
@@ -35,18 +93,565 @@ class SimpleRESTServer(BaseHTTPRequestHandler):
         """Class method to initialize the API_KEYS static attribute."""
         cls.API_KEYS = cls.load_api_keys(cls.API_KEYS_FILE)
 
-    def _send_response(self, status_code, data):
+    def log_message(self, format, *args):
+        """Send the access log through the logging pipeline, rate limited per client address."""
+        client = self.address_string()
+        logger.info("%s - " + format, client, *args, extra={"rate_key": client})
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError as e:
+            # The client went away, for example by closing an event stream.
+            logger.debug(f"Client disconnected: {e}")
+            self.close_connection = True
+
+    def finish(self):
+        try:
+            super().finish()
+        except ConnectionError:
+            pass
+
+    def handle_one_request(self):
+        self.request_started = None
+        super().handle_one_request()
+        if self.request_started is not None:
+            self._record_request_metrics(time.perf_counter() - self.request_started)
+
+    def _record_request_metrics(self, duration_s):
+        route = self._route_label()
+        method = self.command if self.command in self.METRIC_METHODS else "other"
+        METRICS.inc("simulator_http_requests_total", (("route", route), ("method", method), ("status", str(self.status_code))))
+        METRICS.observe("simulator_http_request_duration_seconds", duration_s, (("route", route), ("method", method)))
+
+    def _route_label(self):
+        """Return the route template of the current request, so desk IDs do not become label values."""
+        parts = self.path_parts
+        if len(parts) < 4 or parts[0] != "api":
+            return "other"
+        if parts[3] in ("cache", "metrics") and len(parts) == 4:
+            return "/" + parts[3]
+        if parts[3] != "desks":
+            return "other"
+        if len(parts) == 4:
+            return "/desks"
+        if len(parts) == 5:
+            return "/desks/" + parts[4] if parts[4] in ("changes", "events") else "/desks/{desk_id}"
+        if len(parts) == 6:
+            return "/desks/{desk_id}/" + parts[5] if parts[5] in Desk.CATEGORIES else "/desks/{desk_id}/{category}"
+        return "other"
+
+    def parse_request(self):
+        """Parse the request line and headers, and track how many requests this connection served."""
+        self.request_started = time.perf_counter()
+        self.status_code = None
+        self.path_parts = []
+        self.body_consumed = False
+        if not super().parse_request():
+            return False
+        self.requests_served += 1
+        return True
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        super().send_response(code, message)
+
+    def end_headers(self):
+        if self.close_connection or self.requests_served >= self.MAX_KEEPALIVE_REQUESTS:
+            self.send_header("Connection", "close")
+        elif self.request_version == "HTTP/1.0":
+            self.send_header("Connection", "keep-alive")
+        super().end_headers()
+
+    def send_error(self, code, message=None, explain=None):
+        """Report protocol-level errors as JSON with a Content-Length, then close the connection."""
+        self.close_connection = True
+        if self.request_version == "HTTP/0.9":
+            # A request line that could not be parsed keeps the HTTP/0.9 default, which sends no status line or headers.
+            self.request_version = self.protocol_version
+        self._send_response(code, {"error": message or self.responses.get(code, ("Error",))[0]})
+
+    def _read_body(self):
+        """Read the request body declared by Content-Length."""
+        content_length = int(self.headers["Content-Length"])
+        self.body_consumed = True
+        return self.rfile.read(content_length)
+
+    def _drain_body(self):
+        """Discard an unread request body so the connection can be reused for the next request."""
+        if self.body_consumed or self.close_connection:
+            return
+        self.body_consumed = True
+        if self.headers.get("Transfer-Encoding"):
+            self.close_connection = True
+            return
+        try:
+            remaining = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            remaining = -1
+        if remaining < 0 or remaining > self.MAX_DRAIN_BYTES:
+            self.close_connection = True
+            return
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 64 * 1024))
+            if not chunk:
+                self.close_connection = True
+                return
+            remaining -= len(chunk)
+
+    def _send_response(self, status_code, data, headers=None):
         response_body = json.dumps(data).encode("utf-8")
+        self._send_body(status_code, response_body, headers)
+        # The body can be large; only format it when debug logging is on.
+        logger.debug("Response sent: %s - %s", status_code, data)
+
+    def _send_body(self, status_code, response_body, headers=None, content_encoding=None, content_type="application/json"):
+        """Send an already encoded body, JSON unless `content_type` says otherwise, compressed if the client accepts it and it is large enough.
+
+        Pass `content_encoding` when the body is already compressed with that encoding.
+        """
+        if content_encoding is None:
+            content_encoding = self._choose_encoding(len(response_body))
+            if content_encoding:
+                response_body = self._compress(response_body, content_encoding)
+        self._drain_body()
         self.send_response(status_code)
-        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Type", content_type)
         self.send_header("Content-Length", str(len(response_body)))
+        self.send_header("Vary", "Accept-Encoding")
+        if content_encoding:
+            self.send_header("Content-Encoding", content_encoding)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
         self.wfile.write(response_body)
-        logger.info(f"Response sent: {status_code} - {data}")
+
+    def _send_desk_response(self, desk_id, category):
+        """Send a desk's data, or one category of it, from the response cache when the desk has not changed.
+
+        Returns False if the desk or category does not exist.
+        """
+        version = self.desk_manager.get_desk_version(desk_id)
+        if version is None or (category is not None and category not in Desk.CATEGORIES):
+            return False
+        etag = f'W/"{self.EPOCH}-{version}"'
+        if self._is_not_modified(etag):
+            self._send_not_modified(etag)
+            return True
+
+        response_body = self.RESPONSE_CACHE.get(desk_id, category, version)
+        if response_body is None:
+            if category is None:
+                data = self.desk_manager.get_desk_data(desk_id)
+            else:
+                data = self.desk_manager.get_desk_category(desk_id, category)
+            if not data:
+                return False
+            # The data was read after the version, so it is at least as new as that version.
+            response_body = json.dumps(data).encode("utf-8")
+            self.RESPONSE_CACHE.put(desk_id, category, version, response_body)
+
+        content_encoding = self._choose_encoding(len(response_body))
+        if content_encoding:
+            compressed_body = self.RESPONSE_CACHE.get(desk_id, category, version, content_encoding)
+            if compressed_body is None:
+                compressed_body = self._compress(response_body, content_encoding)
+                self.RESPONSE_CACHE.put(desk_id, category, version, compressed_body, content_encoding)
+            response_body = compressed_body
+        self._send_body(200, response_body, {"ETag": etag}, content_encoding)
+        logger.debug("Response sent: 200 - %d bytes for desk %s", len(response_body), desk_id)
+        return True
+
+    def _is_not_modified(self, etag):
+        """Check the request's If-None-Match header against an ETag, using weak comparison."""
+        if_none_match = self.headers.get("If-None-Match")
+        if not if_none_match:
+            return False
+        candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+        return "*" in candidates or etag.removeprefix("W/") in [candidate.removeprefix("W/") for candidate in candidates]
+
+    def _send_not_modified(self, etag):
+        """Answer a conditional GET whose representation did not change, without a body."""
+        self._drain_body()
+        self.send_response(304)
+        self.send_header("ETag", etag)
+        self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        logger.debug("Response sent: 304 - %s", etag)
+
+    def _choose_encoding(self, size=None):
+        """Pick gzip or deflate from the Accept-Encoding header, or None to send the body as is.
+
+        Bodies smaller than COMPRESSION_MIN_BYTES are sent as is; streamed bodies of unknown size pass None.
+        Errors for a request line that could not be parsed have no headers, and are sent as is.
+        """
+        headers = getattr(self, "headers", None)
+        accept_encoding = headers.get("Accept-Encoding") if headers is not None else None
+        if not accept_encoding or self.COMPRESSION_LEVEL <= 0:
+            return None
+        if size is not None and size < self.COMPRESSION_MIN_BYTES:
+            return None
+
+        qualities = {}
+        for item in accept_encoding.split(","):
+            coding, _, params = item.partition(";")
+            quality = 1.0
+            name, _, value = params.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+            qualities[coding.strip().lower()] = quality
+
+        wildcard = qualities.get("*", 0.0)
+        encoding = max(self.COMPRESSION_WBITS, key=lambda coding: qualities.get(coding, wildcard))
+        return encoding if qualities.get(encoding, wildcard) > 0 else None
+
+    def _compressor(self, encoding):
+        return zlib.compressobj(self.COMPRESSION_LEVEL, zlib.DEFLATED, self.COMPRESSION_WBITS[encoding])
+
+    def _compress(self, body, encoding):
+        compressor = self._compressor(encoding)
+        return compressor.compress(body) + compressor.flush()
+
+    def _compress_stream(self, chunks, encoding):
+        """Compress a stream of byte chunks into one gzip or deflate body."""
+        compressor = self._compressor(encoding)
+        for chunk in chunks:
+            yield compressor.compress(chunk)
+        yield compressor.flush()
+
+    def _send_chunked(self, status_code, content_type, chunks, headers=None):
+        """Stream byte chunks, using chunked transfer encoding for HTTP/1.1 clients."""
+        self._drain_body()
+        chunked = self.request_version != "HTTP/1.0"
+        if not chunked:
+            # Without chunked encoding, the end of the body is signalled by closing the connection.
+            self.close_connection = True
+        content_encoding = self._choose_encoding()
+        if content_encoding:
+            chunks = self._compress_stream(chunks, content_encoding)
+        self.send_response(status_code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Vary", "Accept-Encoding")
+        if content_encoding:
+            self.send_header("Content-Encoding", content_encoding)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if chunked:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            else:
+                self.wfile.write(chunk)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    @classmethod
+    def _batches(cls, desks):
+        """Split an iterator of (desk ID, data) pairs into lists of up to STREAM_BATCH_SIZE pairs."""
+        desks = iter(desks)
+        while batch := list(itertools.islice(desks, cls.STREAM_BATCH_SIZE)):
+            yield batch
+
+    @classmethod
+    def _encode_fleet_json(cls, desks):
+        """Encode a fleet snapshot as one JSON object keyed by desk ID, one batch of desks at a time."""
+        yield b"{"
+        separator = ""
+        for batch in cls._batches(desks):
+            yield (separator + ", ".join(f"{json.dumps(desk_id)}: {json.dumps(data)}" for desk_id, data in batch)).encode("utf-8")
+            separator = ", "
+        yield b"}"
+
+    @classmethod
+    def _encode_fleet_ndjson(cls, desks):
+        """Encode a fleet snapshot as newline-delimited JSON, one desk per line."""
+        for batch in cls._batches(desks):
+            yield "".join(json.dumps({"desk_id": desk_id, **data}) + "\n" for desk_id, data in batch).encode("utf-8")
+
+    def _send_fleet_snapshot(self):
+        """Stream every active desk's data taken from one consistent snapshot."""
+        expand = self.query.get("expand", [""])[-1]
+        if expand != "all":
+            logger.warning(f"Invalid expand value: {expand}")
+            self._send_response(400, {"error": "Invalid expand value"})
+            return
+
+        output_format = self.query.get("format", [""])[-1]
+        if not output_format:
+            output_format = "ndjson" if self.NDJSON_CONTENT_TYPE in self.headers.get("Accept", "") else "json"
+
+        if output_format == "json":
+            encoder, content_type = self._encode_fleet_json, "application/json"
+        elif output_format == "ndjson":
+            encoder, content_type = self._encode_fleet_ndjson, self.NDJSON_CONTENT_TYPE
+        else:
+            logger.warning(f"Invalid format value: {output_format}")
+            self._send_response(400, {"error": "Invalid format"})
+            return
+
+        cursor, count, desks = self.desk_manager.get_fleet_snapshot()
+        self._send_chunked(200, content_type, encoder(desks), {"X-Changes-Cursor": self._format_cursor(cursor)})
+        logger.info(f"Fleet snapshot streamed: {count} desks as {output_format}")
+
+    def _send_desk_page(self):
+        """Send one page of desk IDs, filtered by status, manufacturer and sit/stand band, with the cursor of the next page."""
+        try:
+            limit = int(self.query.get("limit", [self.DEFAULT_PAGE_SIZE])[-1])
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= self.MAX_PAGE_SIZE:
+            logger.warning(f"Invalid limit value: {self.path}")
+            self._send_response(400, {"error": f"limit must be between 1 and {self.MAX_PAGE_SIZE}"})
+            return
+
+        filters = {name: self.query[name][-1] for name in DeskIndex.FILTERS if name in self.query}
+        if "band" in filters and filters["band"] not in DeskIndex.BANDS:
+            logger.warning(f"Invalid band value: {filters['band']}")
+            self._send_response(400, {"error": "Invalid band"})
+            return
+
+        cursor = self.query.get("cursor", [""])[-1] or None
+        desk_ids, next_cursor = self.desk_manager.list_desk_ids(filters, cursor, limit)
+        self._send_response(200, {"desks": desk_ids, "next_cursor": next_cursor})
+
+    @staticmethod
+    def _parse_desk_spec(spec):
+        """Validate one desk definition of a POST body and convert it to a DeskManager.add_desks spec."""
+        if not isinstance(spec, dict):
+            raise ValueError("Expected a desk object")
+        parsed = {}
+        for field in ("desk_id", "name", "manufacturer"):
+            value = spec.get(field)
+            if value is not None:
+                if not isinstance(value, str) or not value or (field == "desk_id" and "/" in value):
+                    raise ValueError(f"Invalid {field}")
+                parsed[field] = value
+        try:
+            parsed["user_type"] = UserType(spec.get("user_type", UserType.ACTIVE.value))
+        except ValueError:
+            raise ValueError("Invalid user_type")
+
+        min_position = spec.get("min_position_mm", 680)
+        max_position = spec.get("max_position_mm", 1320)
+        initial_position = spec.get("position_mm", min_position)
+        for value in (min_position, max_position, initial_position):
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise ValueError("Positions must be integers")
+        if not min_position < max_position or not min_position <= initial_position <= max_position:
+            raise ValueError("Invalid position range")
+        parsed.update(min_position=min_position, max_position=max_position, initial_position=initial_position)
+        return parsed
+
+    def _send_desk_creation(self):
+        """Create one desk from an object, or many desks from a list, in one DeskManager call."""
+        try:
+            body = json.loads(self._read_body())
+        except (TypeError, ValueError):
+            logger.error(f"Invalid data format for POST: {self.path}")
+            self._send_response(400, {"error": "Invalid data"})
+            return
+
+        if isinstance(body, dict):
+            try:
+                spec = self._parse_desk_spec(body)
+            except ValueError as e:
+                self._send_response(400, {"error": str(e)})
+                return
+            added, errors = self.desk_manager.add_desks([spec])
+            if errors:
+                self._send_response(409, {"error": "Desk already exists"})
+                return
+            self._send_response(201, {"desk_id": added[0], **self.desk_manager.get_desk_data(added[0])})
+            return
+
+        if not isinstance(body, list):
+            logger.error(f"POST body is not a desk object or list: {self.path}")
+            self._send_response(400, {"error": "Expected a desk object or a list of desk objects"})
+            return
+
+        specs = []
+        spec_indexes = []
+        invalid = []
+        for index, item in enumerate(body):
+            try:
+                specs.append(self._parse_desk_spec(item))
+                spec_indexes.append(index)
+            except ValueError as e:
+                invalid.append({"index": index, "error": str(e)})
+
+        added, errors = self.desk_manager.add_desks(specs)
+        for error in errors:
+            error["index"] = spec_indexes[error["index"]]
+        self._send_response(200, {"created": added, "errors": sorted(invalid + errors, key=lambda error: error["index"])})
+
+    def _send_desk_removal(self):
+        """Remove the desks listed by ID in the request body in one DeskManager call."""
+        try:
+            desk_ids = json.loads(self._read_body())
+        except (TypeError, ValueError):
+            logger.error(f"Invalid data format for DELETE: {self.path}")
+            self._send_response(400, {"error": "Invalid data"})
+            return
+        if not isinstance(desk_ids, list) or not all(isinstance(desk_id, str) for desk_id in desk_ids):
+            logger.error(f"DELETE body is not a list of desk IDs: {self.path}")
+            self._send_response(400, {"error": "Expected a list of desk IDs"})
+            return
+
+        removed, errors = self.desk_manager.remove_desks(desk_ids)
+        self._send_response(200, {"removed": removed, "errors": errors})
+
+    def _read_batch_commands(self):
+        """Read a batch PUT body as (index, desk ID, position) commands plus errors for malformed ones.
+
+        Answers 400 and returns None if the body is not a JSON list.
+        """
+        try:
+            commands = json.loads(self._read_body())
+        except (TypeError, ValueError):
+            logger.error(f"Invalid data format for batch PUT: {self.path}")
+            self._send_response(400, {"error": "Invalid data"})
+            return None
+        if not isinstance(commands, list):
+            logger.error(f"Batch PUT body is not a list: {self.path}")
+            self._send_response(400, {"error": "Expected a list of commands"})
+            return None
+
+        valid_commands = []
+        invalid = []
+        for index, command in enumerate(commands):
+            desk_id = command.get("desk_id") if isinstance(command, dict) else None
+            position_mm = command.get("position_mm") if isinstance(command, dict) else None
+            if not isinstance(desk_id, str):
+                invalid.append({"index": index, "error": "Invalid desk_id"})
+            elif isinstance(position_mm, bool) or not isinstance(position_mm, (int, float)):
+                invalid.append({"index": index, "desk_id": desk_id, "error": "Invalid position_mm"})
+            else:
+                valid_commands.append((index, desk_id, position_mm))
+        return valid_commands, invalid
+
+    def _send_batch_command(self):
+        """Apply a list of {desk_id, position_mm} commands in one DeskManager call."""
+        commands = self._read_batch_commands()
+        if commands is None:
+            return
+        valid_commands, invalid = commands
+        accepted, errors = self.desk_manager.set_target_positions(valid_commands)
+        self._send_response(200, {"accepted": accepted, "errors": sorted(invalid + errors, key=lambda error: error["index"])})
+
+    def _format_cursor(self, cursor):
+        return f"{self.EPOCH}.{cursor}"
+
+    def _parse_cursor(self, value):
+        """Parse a change feed cursor, returning None if it is malformed or from another server process."""
+        epoch, _, cursor = value.partition(".")
+        if epoch != self.EPOCH or not cursor.isdigit():
+            return None
+        return int(cursor)
+
+    def _send_changes(self):
+        """Send the desks changed since the cursor given in the `since` query parameter."""
+        since = self.query.get("since", [""])[-1]
+        if not since:
+            logger.warning(f"Missing since cursor for changes: {self.path}")
+            self._send_response(400, {"error": "Missing since cursor"})
+            return
+
+        cursor = self._parse_cursor(since)
+        changes = self.desk_manager.get_changes_since(cursor) if cursor is not None else None
+        if changes is None:
+            logger.warning(f"Change feed cursor too old or unknown: {since}")
+            self._send_response(410, {"error": "Cursor too old, resync required", "resync": True})
+            return
+
+        new_cursor, desks, removed = changes
+        self._send_response(200, {"cursor": self._format_cursor(new_cursor), "desks": desks, "removed": removed})
+
+    def _send_event_stream(self):
+        """Push desk events as Server-Sent Events until the client disconnects or the simulator stops."""
+        desk_ids = [desk_id for desk_id in self.query.get("desks", [""])[-1].split(",") if desk_id]
+        policy = self.query.get("policy", ["drop-oldest"])[-1]
+        last_event_id = self.headers.get("Last-Event-ID", "")
+        try:
+            max_buffer = int(self.query.get("buffer", [self.SSE_DEFAULT_BUFFER])[-1])
+            subscription = self.desk_manager.events.subscribe(
+                desk_ids or None, max_buffer, policy,
+                int(last_event_id) if last_event_id.isdigit() else None,
+            )
+        except ValueError as e:
+            logger.warning(f"Invalid event stream parameters: {e}")
+            self._send_response(400, {"error": "Invalid event stream parameters"})
+            return
+
+        self._drain_body()
+        # The stream has no length, so it ends by closing the connection.
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("X-Accel-Buffering", "no")
+        self.end_headers()
+        logger.info(f"Event stream opened: desks={desk_ids or 'all'}, policy={policy}, buffer={max_buffer}")
+
+        self.wfile.write(f"retry: {self.SSE_RETRY_MS}\n\n".encode("utf-8"))
+        self._stream_events(subscription)
+
+    def _stream_events(self, subscription):
+        """Write the subscription's events to the client until either side ends the stream.
+
+        Overridden by the asyncio engine, which streams from its event loop instead of a thread.
+        """
+        try:
+            self.wfile.flush()
+            last_write = time.monotonic()
+            while True:
+                chunk, done = self.next_event_chunk(subscription, self.SSE_HEARTBEAT_S, last_write)
+                if chunk:
+                    self.wfile.write(chunk)
+                    self.wfile.flush()
+                    last_write = time.monotonic()
+                if done:
+                    break
+        except OSError as e:
+            logger.info(f"Event stream client disconnected: {e}")
+        finally:
+            subscription.close()
+
+    @classmethod
+    def next_event_chunk(cls, subscription, timeout, last_write):
+        """Wait up to `timeout` seconds for events and return (bytes to send, whether the stream ends).
+
+        The bytes are empty when there is nothing to send yet. A heartbeat comment is sent instead when
+        nothing was written for SSE_HEARTBEAT_S seconds since the `last_write` monotonic time.
+        """
+        try:
+            events = subscription.read(timeout)
+        except SubscriberOverflow as e:
+            logger.warning(f"Event stream subscriber disconnected: {e}")
+            return f"event: overflow\ndata: {json.dumps({'error': str(e)})}\n\n".encode("utf-8"), True
+        if events is None:
+            return b"", True
+        chunk = b""
+        if subscription.dropped:
+            chunk = f"event: dropped\ndata: {json.dumps({'count': subscription.dropped})}\n\n".encode("utf-8")
+            subscription.dropped = 0
+        if events:
+            chunk += b"".join(events)
+        elif not chunk and time.monotonic() - last_write >= cls.SSE_HEARTBEAT_S:
+            chunk = b": heartbeat\n\n"
+        return chunk, False
 
     def _is_valid_path(self):
-        # Path format: /api/<version>/<api_key>/desks[/<desk_id>]
-        self.path_parts = self.path.strip("/").split("/")
+        # Path format: /api/<version>/<api_key>/desks[/<desk_id>][?<query>]
+        url = urlsplit(self.path)
+        self.path_parts = url.path.strip("/").split("/")
+        self.query = parse_qs(url.query)
 
         if len(self.path_parts) < 4 or self.path_parts[0] != "api":
             logger.warning(f"Invalid endpoint: {self.path}")
@@ -66,38 +671,44 @@ class SimpleRESTServer(BaseHTTPRequestHandler):
             self._send_response(400, {"error": "Invalid API version"})
             return False
 
-        logger.info(f"Valid API request: {self.path}")
+        logger.debug("Valid API request: %s", self.path)
         return True
 
     def do_GET(self):
         if not self._is_valid_path():
             return
 
-        logger.info(f"Handling GET request for {self.path}")
+        logger.debug("Handling GET request for %s", self.path)
         if self.path_parts[3] == "desks":
-            if len(self.path_parts) == 4:
+            if len(self.path_parts) == 4 and "expand" in self.query:
+                self._send_fleet_snapshot()
+            elif len(self.path_parts) == 4 and any(param in self.query for param in self.LIST_PARAMS):
+                self._send_desk_page()
+            elif len(self.path_parts) == 4:
                 desk_ids = self.desk_manager.get_desk_ids()
                 self._send_response(200, desk_ids)
+            elif len(self.path_parts) == 5 and self.path_parts[4] == "changes":
+                self._send_changes()
+            elif len(self.path_parts) == 5 and self.path_parts[4] == "events":
+                self._send_event_stream()
             elif len(self.path_parts) == 5:
                 desk_id = self.path_parts[4]
-                desk = self.desk_manager.get_desk_data(desk_id)
-                if desk:
-                    self._send_response(200, desk)
-                else:
+                if not self._send_desk_response(desk_id, None):
                     logger.warning(f"Desk not found: {desk_id}")
                     self._send_response(404, {"error": "Desk not found"})
             elif len(self.path_parts) == 6:
                 desk_id = self.path_parts[4]
                 category = self.path_parts[5]
-                data = self.desk_manager.get_desk_category(desk_id, category)
-                if data:
-                    self._send_response(200, data)
-                else:
+                if not self._send_desk_response(desk_id, category):
                     logger.warning(f"Category not found: {category} for desk {desk_id}")
                     self._send_response(404, {"error": "Category not found"})
             else:
                 logger.warning(f"Invalid path structure for GET: {self.path}")
                 self._send_response(400, {"error": "Invalid path"})
+        elif self.path_parts[3] == "cache" and len(self.path_parts) == 4:
+            self._send_response(200, self.RESPONSE_CACHE.stats())
+        elif self.path_parts[3] == "metrics" and len(self.path_parts) == 4:
+            self._send_body(200, METRICS.render().encode("utf-8"), content_type=METRICS_CONTENT_TYPE)
         else:
             logger.warning(f"Invalid endpoint for GET: {self.path}")
             self._send_response(400, {"error": "Invalid endpoint"})
@@ -106,21 +717,21 @@ class SimpleRESTServer(BaseHTTPRequestHandler):
         if not self._is_valid_path():
             return
 
-        logger.info(f"Handling PUT request for {self.path}")
+        logger.debug("Handling PUT request for %s", self.path)
         if self.path_parts[3] == "desks":
-            if len(self.path_parts) == 6:
+            if len(self.path_parts) == 4:
+                self._send_batch_command()
+            elif len(self.path_parts) == 6:
                 # Update a specific category of a specific desk
                 try:
-                    content_length = int(self.headers["Content-Length"])
-                    post_data = self.rfile.read(content_length)
+                    post_data = self._read_body()
                     update_data = json.loads(post_data)
                     desk_id = self.path_parts[4]
                     category = self.path_parts[5]
-                    success = self.desk_manager.update_desk_category(desk_id, category, update_data)
-                    if success:
-                        current_target_position = self.desk_manager.get_desk(desk_id).get_target_position()
+                    accepted_position = self.desk_manager.update_desk_category(desk_id, category, update_data)
+                    if accepted_position is not None:
                         response_data = {
-                            "position_mm": current_target_position
+                            "position_mm": accepted_position
                         }
                         self._send_response(200, response_data)
                     else:
@@ -140,16 +751,36 @@ class SimpleRESTServer(BaseHTTPRequestHandler):
             self._send_response(400, {"error": "Invalid endpoint"})
 
     def do_POST(self):
-        """Handle unsupported POST method."""
-        logger.warning(f"POST method not allowed: {self.path}")
-        self._send_response(405, {"error": "Method Not Allowed"})
+        if not self._is_valid_path():
+            return
+
+        logger.debug("Handling POST request for %s", self.path)
+        if self.path_parts[3] == "desks" and len(self.path_parts) == 4:
+            self._send_desk_creation()
+        else:
+            logger.warning(f"POST method not allowed: {self.path}")
+            self._send_response(405, {"error": "Method Not Allowed"})
 
     def do_DELETE(self):
-        """Handle unsupported DELETE method."""
-        logger.warning(f"DELETE method not allowed: {self.path}")
-        self._send_response(405, {"error": "Method Not Allowed"})
+        if not self._is_valid_path():
+            return
+
+        logger.debug("Handling DELETE request for %s", self.path)
+        if self.path_parts[3] == "desks" and len(self.path_parts) == 4:
+            self._send_desk_removal()
+        elif self.path_parts[3] == "desks" and len(self.path_parts) == 5:
+            desk_id = self.path_parts[4]
+            if self.desk_manager.remove_desk(desk_id):
+                self._send_response(200, {"desk_id": desk_id})
+            else:
+                self._send_response(404, {"error": "Desk not found"})
+        else:
+            logger.warning(f"DELETE method not allowed: {self.path}")
+            self._send_response(405, {"error": "Method Not Allowed"})
 
     def do_PATCH(self):
         """Handle unsupported PATCH method."""
         logger.warning(f"PATCH method not allowed: {self.path}")
         self._send_response(405, {"error": "Method Not Allowed"})
+
+METRICS.register_collector(SimpleRESTServer.RESPONSE_CACHE.collect_metrics)
@@ -0,0 +1,225 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import logging
+from array import array
+from collections import namedtuple
+from desk import Desk, DeskStatus, round_fraction
+
+logger = logging.getLogger(__name__)
+
+# One saved desk: its config, state, usage counters, error history as a flat array of (time_s, code)
+# pairs, clock and user type.
+DeskRecord = namedtuple("DeskRecord", (
+    "desk_id", "name", "manufacturer", "user", "position_mm", "min_position", "max_position", "speed_mms",
+    "status", "anti_collision", "flags", "activations_counter", "sit_stand_counter", "errors", "clock_s",
+))
+
+class StateFormatError(ValueError):
+    """Raised when a binary state file is not one this version can read."""
+
+# Binary state file layout, all little-endian:
+#   header:  magic, format version, simulated time, simulation speed, desk, error pair and string counts
+#   records: one fixed-size RECORD per desk
+#   errors:  (time_s, error code) int64 pairs; each record points at its own run of them
+#   strings: desk IDs, names and manufacturers as (uint32 length, UTF-8 bytes), each stored once
+MAGIC = b"DESKSNAP"
+VERSION = 1
+HEADER = struct.Struct("<8sH6xddIII")
+RECORD = struct.Struct("<IIIBBBBddddiIII")
+ERROR_PAIR_BYTES = 16
+STRING_LENGTH = struct.Struct("<I")
+# Stored as an index into this tuple; append only, so older files keep their meaning.
+USER_TYPES = ("seated", "standing", "active")
+STATUSES = (DeskStatus.NORMAL, DeskStatus.COLLISION)
+
+def _number(value):
+    """A stored float as the int it was saved from, when it is whole."""
+    return int(value) if value.is_integer() else value
+
+def desk_record(desk, user):
+    """The record of a live desk and its user type value, with the position and clock rounded as the JSON format saves them.
+
+    Callers hold the DeskManager lock.
+    """
+    spec = desk.spec
+    return DeskRecord(desk.desk_id, desk.name, spec.manufacturer, user, round_fraction(desk.position_mm),
+                      spec.min_position, spec.max_position, desk.speed_mms, desk.status, desk.anti_collision,
+                      desk.flags, desk.activations_counter, desk.sit_stand_counter, desk.errors,
+                      round_fraction(desk.clock_s))
+
+def json_record(desk_id, saved):
+    """The record of a desk in the JSON state file format."""
+    desk_data = saved["desk_data"]
+    config = desk_data["config"]
+    state = desk_data["state"]
+    errors = array("q", (value for error in desk_data["lastErrors"][:Desk.MAX_ERROR_COUNT]
+                         for value in (error["time_s"], error["errorCode"])))
+    return DeskRecord(desk_id, config["name"], config["manufacturer"], saved["user"], state["position_mm"],
+                      config.get("min_position_mm", 680), config.get("max_position_mm", 1320), state["speed_mms"],
+                      DeskStatus(state["status"]), state["isAntiCollision"],
+                      sum(bit for name, bit in Desk.FLAG_NAMES if state.get(name)),
+                      desk_data["usage"]["activationsCounter"], desk_data["usage"]["sitStandCounter"], errors,
+                      desk_data["clock_s"])
+
+def restore_desk(record):
+    """Build a desk from a record, without logging."""
+    desk = Desk(record.desk_id, record.name, record.manufacturer, record.position_mm, record.min_position,
+                record.max_position, log=False)
+    desk.speed_mms = record.speed_mms
+    desk.status = record.status
+    desk.anti_collision = record.anti_collision
+    desk.flags = record.flags
+    desk.activations_counter = record.activations_counter
+    desk.sit_stand_counter = record.sit_stand_counter
+    desk.errors = Desk.INITIAL_ERRORS if tuple(record.errors) == Desk.INITIAL_ERRORS else record.errors
+    desk.clock_s = record.clock_s
+    return desk
+
+def write(path, current_time_s, simulation_speed, records):
+    """Write a binary state file, streaming the records to a temporary file that then replaces `path`."""
+    strings = {}
+    errors = array("q")
+
+    def string_ref(value):
+        ref = strings.get(value)
+        if ref is None:
+            ref = strings[value] = len(strings)
+        return ref
+
+    count = 0
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(bytes(HEADER.size))
+        chunk = bytearray()
+        for record in records:
+            error_offset = len(errors) // 2
+            errors.extend(record.errors)
+            chunk += RECORD.pack(
+                string_ref(record.desk_id), string_ref(record.name), string_ref(record.manufacturer),
+                USER_TYPES.index(record.user), STATUSES.index(record.status), record.anti_collision | record.flags << 1,
+                len(record.errors) // 2, record.position_mm, record.min_position, record.max_position, record.clock_s,
+                record.speed_mms, record.activations_counter, record.sit_stand_counter, error_offset,
+            )
+            count += 1
+            if len(chunk) >= 1 << 20:
+                f.write(chunk)
+                chunk.clear()
+        f.write(chunk)
+        if sys.byteorder != "little":
+            errors.byteswap()
+        f.write(errors.tobytes())
+        f.write(b"".join(STRING_LENGTH.pack(len(encoded)) + encoded
+                         for encoded in (value.encode("utf-8") for value in strings)))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, current_time_s, simulation_speed, count, len(errors) // 2, len(strings)))
+    os.replace(temp_path, path)
+    return count
+
+class StateReader:
+    """Memory-maps a binary state file and decodes its desk records one at a time as they are iterated."""
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file cannot be mapped.
+            self.file.close()
+            raise StateFormatError(f"{path} is empty.")
+        try:
+            self._read_header(path)
+        except (StateFormatError, struct.error):
+            self.close()
+            raise
+
+    def _read_header(self, path):
+        magic, version, self.current_time_s, simulation_speed, self.count, error_pairs, string_count = \
+            HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise StateFormatError(f"{path} is not a binary desk state file.")
+        if version != VERSION:
+            raise StateFormatError(f"{path} has state format version {version}; this simulator reads version {VERSION}.")
+        self.current_time_s = _number(self.current_time_s)
+        self.simulation_speed = _number(simulation_speed)
+        self.records_start = HEADER.size
+        errors_start = self.records_start + self.count * RECORD.size
+        strings_start = errors_start + error_pairs * ERROR_PAIR_BYTES
+        if strings_start > len(self.data):
+            raise StateFormatError(f"{path} is truncated.")
+
+        self.errors = array("q")
+        self.errors.frombytes(self.data[errors_start:strings_start])
+        if sys.byteorder != "little":
+            self.errors.byteswap()
+
+        self.strings = []
+        offset = strings_start
+        for _ in range(string_count):
+            (length,) = STRING_LENGTH.unpack_from(self.data, offset)
+            offset += STRING_LENGTH.size
+            self.strings.append(str(self.data[offset:offset + length], "utf-8"))
+            offset += length
+
+    def __iter__(self):
+        strings = self.strings
+        errors = self.errors
+        records = memoryview(self.data)[self.records_start:self.records_start + self.count * RECORD.size]
+        try:
+            for (id_ref, name_ref, manufacturer_ref, user, status, bits, error_count, position_mm, min_position,
+                 max_position, clock_s, speed_mms, activations_counter, sit_stand_counter,
+                 error_offset) in RECORD.iter_unpack(records):
+                yield DeskRecord(
+                    strings[id_ref], strings[name_ref], strings[manufacturer_ref], USER_TYPES[user],
+                    _number(position_mm), _number(min_position), _number(max_position), speed_mms, STATUSES[status],
+                    bool(bits & 1), bits >> 1, activations_counter, sit_stand_counter,
+                    errors[2 * error_offset:2 * (error_offset + error_count)], _number(clock_s),
+                )
+        finally:
+            # The map cannot be closed while a view of it is alive.
+            records.release()
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def convert(source, target):
+    """Convert a state file between the formats: to JSON if `target` ends in .json, otherwise to binary."""
+    if target.endswith(".json"):
+        state = {}
+        with StateReader(source) as reader:
+            for record in reader:
+                data = restore_desk(record).get_data()
+                data["clock_s"] = record.clock_s
+                state[record.desk_id] = {"desk_data": data, "user": record.user}
+            state["current_time_s"] = reader.current_time_s
+            state["simulation_speed"] = reader.simulation_speed
+        with open(target, "w") as f:
+            json.dump(state, f)
+        return len(state) - 2
+    with open(source, "r") as f:
+        state = json.load(f)
+    records = (json_record(desk_id, saved) for desk_id, saved in state.items()
+               if desk_id not in ("current_time_s", "simulation_speed"))
+    return write(target, state.get("current_time_s", 43200), state.get("simulation_speed", 60), records)
+
+"""
+    To convert a state file between JSON and binary, use the following command:
+        python state_file.py data/desks_state.json data/desks_state.bin
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a desk state file between the JSON and binary formats.")
+    parser.add_argument("source", help="State file to read")
+    parser.add_argument("target", help="State file to write; JSON if it ends in .json, otherwise binary")
+    args = parser.parse_args()
+    print(f"Converted {convert(args.source, args.target)} desks from {args.source} to {args.target}.")
@@ -0,0 +1,101 @@
+import csv
+import json
+import sys
+import logging
+from abc import ABC, abstractmethod
+from desk import round_fraction
+
+logger = logging.getLogger(__name__)
+
+class TrajectoryWriter(ABC):
+    """Writes one record for every desk that changed during a tick, for headless runs.
+
+    Each record holds the tick's simulated time, the desk ID, the event (`added`, `move`, `collision`,
+    `power_off` or `power_on`) and the desk's position, speed and status after the tick. Records go
+    through a large write buffer; close() flushes it.
+    """
+    FIELDS = ("time_s", "desk_id", "event", "position_mm", "speed_mms", "status")
+    BUFFER_BYTES = 1 << 20
+
+    def __init__(self, path):
+        if path == "-":
+            self.file = open(sys.stdout.fileno(), "w", buffering=self.BUFFER_BYTES, newline="", closefd=False)
+        else:
+            self.file = open(path, "w", buffering=self.BUFFER_BYTES, newline="")
+        self.powered_off = set()
+        self.records = 0
+
+    def record(self, time_s, changes, desks, powered_off_desks):
+        """Write the records for one tick's changes, a dict of desk ID to changed categories."""
+        rows = []
+        for desk_id, categories in changes.items():
+            desk = desks.get(desk_id)
+            if desk is None:
+                self.powered_off.discard(desk_id)
+                continue
+            if desk_id in powered_off_desks:
+                event = "power_off"
+                self.powered_off.add(desk_id)
+            elif desk_id in self.powered_off:
+                event = "power_on"
+                self.powered_off.discard(desk_id)
+            elif "config" in categories:
+                # Only new desks have every category changed outside a power-on.
+                event = "added"
+            elif "lastErrors" in categories:
+                event = "collision"
+            elif "state" in categories:
+                event = "move"
+            else:
+                continue
+            rows.append((time_s, desk_id, event, round_fraction(desk.position_mm), desk.speed_mms, desk.status.value))
+        if rows:
+            self.records += len(rows)
+            self.write_rows(rows)
+
+    @abstractmethod
+    def write_rows(self, rows):
+        """Write one tick's (time_s, desk_id, event, position_mm, speed_mms, status) rows."""
+
+    def close(self):
+        self.file.close()
+
+class NDJSONTrajectoryWriter(TrajectoryWriter):
+    """One JSON object per line."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.quoted_ids = {}
+
+    def write_rows(self, rows):
+        # Formatted by hand, as json.dumps() per record would dominate the run time; only the ID needs
+        # escaping, and each desk's is escaped once.
+        quoted_ids = self.quoted_ids
+        for row in rows:
+            if row[1] not in quoted_ids:
+                quoted_ids[row[1]] = json.dumps(row[1])
+        self.file.write("".join(
+            f'{{"time_s": {time_s}, "desk_id": {quoted_ids[desk_id]}, "event": "{event}", '
+            f'"position_mm": {position_mm}, "speed_mms": {speed_mms}, "status": "{status}"}}\n'
+            for time_s, desk_id, event, position_mm, speed_mms, status in rows
+        ))
+
+class CSVTrajectoryWriter(TrajectoryWriter):
+    """Comma-separated values with a header line."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.FIELDS)
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+WRITERS = {"ndjson": NDJSONTrajectoryWriter, "csv": CSVTrajectoryWriter}
+
+def open_writer(path, output_format=None):
+    """Open a trajectory writer on `path` ("-" for standard output), picking the format from the extension if not given."""
+    if output_format is None:
+        output_format = "csv" if path.lower().endswith(".csv") else "ndjson"
+    logger.info(f"Writing {output_format} trajectories to {'standard output' if path == '-' else path}.")
+    return WRITERS[output_format](path)
@@ -1,5 +1,6 @@
 from enum import Enum
 import logging
+import random
 
 logger = logging.getLogger(__name__)
 
@@ -10,19 +11,32 @@ class UserType(Enum):
     ACTIVE = "active"
 
 class UserBehavior:
-    """Base class for user behaviors."""
+    """Base class for user behaviors.
+
+    The desk manager calls wake() at the simulated time the behavior asked for, instead of polling
+    every user. Behaviors with WAKE_ON_SETTLE are also woken whenever their desk stops moving.
+    """
+    WAKE_ON_SETTLE = False
+
+    __slots__ = ("desk",)
+
     def __init__(self, desk):
         self.desk = desk
 
-    def simulate(self, time_delta_s):
-        """Simulate user behavior. Override in subclasses."""
-        pass
+    def wake(self, now_s):
+        """Act on the desk at simulated time `now_s` and return when to wake up next, or None. Override in subclasses."""
+        return None
 
     def __repr__(self):
         return f"{self.__class__.__name__}(desk_id={self.desk.desk_id})"
 
 class SeatedUser(UserBehavior):
     """User who always keeps the desk in a seated position."""
+    WAKE_ON_SETTLE = True
+    user_type = UserType.SEATED
+
+    __slots__ = ("preferred_position",)
+
     def __init__(self, desk, preferred_position=0):
         super().__init__(desk)
         if preferred_position < desk.min_position or preferred_position > desk.max_position:
@@ -30,13 +44,20 @@ class SeatedUser(UserBehavior):
 
         self.preferred_position = preferred_position
 
-    def simulate(self, time_delta_s):
-        if self.desk.state["position_mm"] > self.preferred_position:
-            logger.info(f"SeatedUser adjusting desk {self.desk.desk_id} to seated position {self.preferred_position}.")
+    def wake(self, now_s):
+        if self.desk.position_mm > self.preferred_position:
+            logger.info("SeatedUser adjusting desk %s to seated position %s.",
+                        self.desk.desk_id, self.preferred_position, extra={"rate_key": self.desk.desk_id})
             self.desk.set_target_position(self.preferred_position)
+        return None
 
 class StandingUser(UserBehavior):
     """User who always keeps the desk in a standing position."""
+    WAKE_ON_SETTLE = True
+    user_type = UserType.STANDING
+
+    __slots__ = ("preferred_position",)
+
     def __init__(self, desk, preferred_position=0):
         super().__init__(desk)
         if preferred_position < desk.min_position or preferred_position > desk.max_position:
@@ -44,13 +65,19 @@ class StandingUser(UserBehavior):
 
         self.preferred_position = preferred_position
 
-    def simulate(self, time_delta_s):
-        if self.desk.state["position_mm"] < self.preferred_position:
-            logger.info(f"StandingUser adjusting desk {self.desk.desk_id} to standing position {self.preferred_position}.")
+    def wake(self, now_s):
+        if self.desk.position_mm < self.preferred_position:
+            logger.info("StandingUser adjusting desk %s to standing position %s.",
+                        self.desk.desk_id, self.preferred_position, extra={"rate_key": self.desk.desk_id})
             self.desk.set_target_position(self.preferred_position)
+        return None
 
 class ActiveUser(UserBehavior):
     """User who moves between seated and standing positions a few times a day."""
+    user_type = UserType.ACTIVE
+
+    __slots__ = ("position_cycle_time_s", "seated_position", "standing_position", "next_position", "next_change_s")
+
     def __init__(self, desk, position_cycle_time_s=3600, seated_position=0, standing_position=0):
         super().__init__(desk)
 
@@ -66,14 +93,48 @@ class ActiveUser(UserBehavior):
 
         self.standing_position = standing_position
         self.next_position = self.seated_position
-        self.cycle_timer = 0
+        self.next_change_s = None
 
-    def simulate(self, time_delta_s):
-        self.cycle_timer = (self.cycle_timer + time_delta_s) % self.position_cycle_time_s
-
-        if self.cycle_timer < time_delta_s:
+    def wake(self, now_s):
+        # The first wake-up only starts the cycle; the position changes once a full cycle has passed.
+        if self.next_change_s is not None:
             self.next_position = (
-                self.standing_position if self.desk.state["position_mm"] <= self.seated_position else self.seated_position
+                self.standing_position if self.desk.position_mm <= self.seated_position else self.seated_position
             )
-            logger.info(f"ActiveUser adjusting desk {self.desk.desk_id} to {'standing' if self.next_position == self.standing_position else 'seated'} position {self.next_position}.")
+            logger.info("ActiveUser adjusting desk %s to %s position %s.", self.desk.desk_id,
+                        "standing" if self.next_position == self.standing_position else "seated", self.next_position,
+                        extra={"rate_key": self.desk.desk_id})
             self.desk.set_target_position(self.next_position)
+        self.next_change_s = now_s + self.position_cycle_time_s
+        return self.next_change_s
+
+class MarkovUser(UserBehavior):
+    """User who switches between sitting and standing as a two-state Markov chain, with personal habits.
+
+    Each user draws their own mean seated and standing bout lengths around the medians of their
+    UserType, and their own seated and standing heights. The decisions of all Markov users are made
+    together by population.PopulationBehaviorEngine, so wake() is never scheduled.
+    """
+    # Median (seated, standing) bout lengths in simulated seconds, for each user type.
+    BOUT_MEDIANS_S = {
+        UserType.SEATED: (4 * 3600, 10 * 60),
+        UserType.STANDING: (20 * 60, 2 * 3600),
+        UserType.ACTIVE: (3600, 3600),
+    }
+    # Spread of the users' mean bout lengths around the medians, as the sigma of a log-normal distribution.
+    BOUT_SIGMA = 0.5
+    # Mean and standard deviation of the preferred heights, in millimeters.
+    SEATED_HEIGHT_MM = (720, 25)
+    STANDING_HEIGHT_MM = (1100, 50)
+
+    __slots__ = ("user_type", "mean_seated_s", "mean_standing_s", "seated_position", "standing_position", "standing")
+
+    def __init__(self, desk, user_type):
+        super().__init__(desk)
+        self.user_type = user_type
+        median_seated_s, median_standing_s = self.BOUT_MEDIANS_S[user_type]
+        self.mean_seated_s = median_seated_s * random.lognormvariate(0, self.BOUT_SIGMA)
+        self.mean_standing_s = median_standing_s * random.lognormvariate(0, self.BOUT_SIGMA)
+        self.seated_position = round(max(desk.min_position, min(random.gauss(*self.SEATED_HEIGHT_MM), desk.sit_stand_position)))
+        self.standing_position = round(max(desk.sit_stand_position, min(random.gauss(*self.STANDING_HEIGHT_MM), desk.max_position)))
+        self.standing = desk.position_mm >= desk.sit_stand_position
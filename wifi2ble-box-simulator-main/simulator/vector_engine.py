@@ -0,0 +1,183 @@
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from desk import Desk, DeskStatus, round_fraction
+
+logger = logging.getLogger(__name__)
+
+AVAILABLE = np is not None
+
+class VectorTickEngine:
+    """Advances every powered-on desk by one tick with NumPy array operations instead of Desk.update() per desk.
+
+    Positions, targets, speeds, collision flags, sit/stand counters and clocks are kept in arrays with
+    one row per desk. The caller passes the IDs of desks whose targets changed, so a tick only reads the
+    targets that changed; only desks whose data changed are written back, through the same Desk fields
+    and change notifications as Desk.update(). Clocks are kept as each desk's count of clock steps, so they
+    stay exact like Desk.advance_clock(); those of idle desks are written back by flush().
+    """
+
+    def __init__(self, seed=None, step_s=1):
+        if np is None:
+            raise RuntimeError("The numpy tick engine requires NumPy; install it with 'pip install numpy'.")
+        self.rng = np.random.default_rng(seed)
+        # Seconds of desk time covered by one tick.
+        self.step_s = step_s
+        self.fleet_version = None
+        self.desks = []
+        self.rows = {}
+
+    def _rebuild(self, desks, fleet_version):
+        """Load the arrays from the desks after desks were added or removed."""
+        self.flush()
+        self.desks = list(desks.values())
+        self.rows = {desk.desk_id: row for row, desk in enumerate(self.desks)}
+        self.fleet_version = fleet_version
+
+        def column(values, dtype):
+            return np.fromiter(values, dtype, len(self.desks))
+        self.position = column((desk.position_mm for desk in self.desks), np.float64)
+        self.speed = column((desk.speed_mms for desk in self.desks), np.int64)
+        self.min_position = column((desk.min_position for desk in self.desks), np.float64)
+        self.max_position = column((desk.max_position for desk in self.desks), np.float64)
+        self.sit_stand_position = column((desk.sit_stand_position for desk in self.desks), np.float64)
+        self.anti_collision = column((desk.anti_collision for desk in self.desks), np.bool_)
+        self.collision_occurred = column((desk.collision_occurred for desk in self.desks), np.bool_)
+        self.sit_stand_counter = column((desk.sit_stand_counter for desk in self.desks), np.int64)
+        for desk in self.desks:
+            desk.advance_clock(0, self.step_s)
+        self.clock_steps = column((desk.clock_steps for desk in self.desks), np.int64)
+        self.target = column((desk.target_position_mm for desk in self.desks), np.float64)
+
+    def _read_changed_targets(self, changed_targets):
+        while changed_targets:
+            try:
+                desk_id = changed_targets.pop()
+            except KeyError:
+                return
+            row = self.rows.get(desk_id)
+            if row is not None:
+                self.target[row] = self.desks[row].target_position_mm
+
+    def flush(self):
+        """Write the clock steps and pending-collision flags kept only in the arrays back to every desk."""
+        if not self.desks:
+            return
+        for desk, clock_steps, collision_occurred in zip(self.desks, self.clock_steps.tolist(), self.collision_occurred.tolist()):
+            desk.clock_steps = clock_steps
+            desk.collision_occurred = collision_occurred
+
+    def tick(self, desks, powered_off_desks, fleet_version, changed_targets):
+        """Advance the desks not in `powered_off_desks` by one tick and return the IDs of the desks that settled.
+
+        `changed_targets` is a set of desk IDs whose targets changed, emptied as it is read. Callers
+        hold the DeskManager lock.
+        """
+        if fleet_version != self.fleet_version:
+            self._rebuild(desks, fleet_version)
+        if not self.desks:
+            changed_targets.clear()
+            return []
+
+        active = np.ones(len(self.desks), dtype=np.bool_)
+        active[[self.rows[desk_id] for desk_id in powered_off_desks if desk_id in self.rows]] = False
+        self.clock_steps[active] += 1
+
+        # A desk that collided in the previous tick stands still for this one.
+        resting = active & self.collision_occurred
+        self.collision_occurred[resting] = False
+        running = active & ~resting
+
+        self._read_changed_targets(changed_targets)
+        target = self.target
+        previous_position = self.position.copy()
+        previous_speed = self.speed.copy()
+        previous_anti_collision = self.anti_collision.copy()
+
+        up = running & (self.position < target)
+        down = running & (self.position > target)
+        step_mm = Desk.DEFAULT_SPEED_MMS * self.step_s
+        arrived = np.abs(target - self.position) <= step_mm + Desk.POSITION_TOLERANCE_MM
+        self.position[up] = np.minimum(np.where(arrived[up], target[up], self.position[up] + step_mm), self.max_position[up])
+        self.position[down] = np.maximum(np.where(arrived[down], target[down], self.position[down] - step_mm), self.min_position[down])
+        moved = up | down
+        self.speed[up] = Desk.DEFAULT_SPEED_MMS
+        self.speed[down] = -Desk.DEFAULT_SPEED_MMS
+        self.speed[running & ~moved] = 0
+
+        sit_stand = self.sit_stand_position
+        crossed = running & (((previous_position < sit_stand) & (sit_stand <= self.position)) |
+                             ((previous_position > sit_stand) & (sit_stand >= self.position)))
+        self.sit_stand_counter[crossed] += 1
+
+        # Moving again clears a collision; otherwise any movement may collide.
+        self.anti_collision[moved & previous_anti_collision] = False
+        candidates = np.flatnonzero(moved & ~previous_anti_collision)
+        collided = candidates[self.rng.random(len(candidates)) < Desk.collision_chance(self.step_s)]
+        for row in collided.tolist():
+            self._collide(row)
+
+        changed = (self.position != previous_position) | (self.speed != previous_speed) | \
+                  (self.anti_collision != previous_anti_collision)
+        rows = np.flatnonzero(changed | crossed)
+        self._write_back(rows, changed[rows], crossed[rows])
+
+        # Desks that came to a stop, or finished resting after a collision, without colliding again.
+        settled = resting | (running & (previous_speed != 0) & (self.speed == 0) & ~self.collision_occurred)
+        return [self.desks[row].desk_id for row in np.flatnonzero(settled).tolist()]
+
+    def _collide(self, row):
+        """Record a collision through Desk._generate_error(), then bounce the desk back like Desk.update()."""
+        desk = self.desks[row]
+        with desk.lock:
+            desk.clock_steps = int(self.clock_steps[row])
+            desk.position_mm = _number_value(self.position[row])
+            desk._generate_error()
+        self.anti_collision[row] = True
+        self.collision_occurred[row] = True
+        if self.speed[row] > 0:
+            self.position[row] = max(self.position[row] - 10, self.min_position[row])
+        elif self.speed[row] < 0:
+            self.position[row] = min(self.position[row] + 10, self.max_position[row])
+        self.speed[row] = 0
+        desk.target_position_mm = _number_value(self.position[row])
+        self.target[row] = self.position[row]
+
+    def _write_back(self, rows, state_changed, usage_changed):
+        """Copy the array values of the given rows to their desks and notify the change listeners."""
+        columns = zip(
+            rows.tolist(), state_changed.tolist(), usage_changed.tolist(), self.clock_steps[rows].tolist(),
+            self.collision_occurred[rows].tolist(), self.position[rows].tolist(), self.speed[rows].tolist(),
+            self.anti_collision[rows].tolist(), self.sit_stand_counter[rows].tolist(),
+        )
+        for row, state_changed, usage_changed, clock_steps, collision_occurred, position, speed, anti_collision, counter in columns:
+            desk = self.desks[row]
+            with desk.lock:
+                desk.clock_steps = clock_steps
+                desk.collision_occurred = collision_occurred
+                if state_changed:
+                    was_anti_collision = desk.anti_collision
+                    desk.position_mm = _number_value(position)
+                    desk.speed_mms = speed
+                    desk.anti_collision = anti_collision
+                    desk.status = DeskStatus.COLLISION if anti_collision else DeskStatus.NORMAL
+                    if was_anti_collision and not anti_collision:
+                        logger.info("Desk reset from collision: ID=%s, Time=%s, Position=%s", desk.desk_id,
+                                    round_fraction(desk.clock_s), round_fraction(desk.position_mm), extra={"rate_key": desk.desk_id})
+                if usage_changed:
+                    desk.sit_stand_counter = counter
+                if state_changed and usage_changed:
+                    desk._mark_changed("state", "usage")
+                elif state_changed:
+                    desk._mark_changed("state")
+                else:
+                    desk._mark_changed("usage")
+
+def _number_value(value):
+    """Return a position from the float arrays as an int when it is whole, as Desk.update() keeps it."""
+    value = float(value)
+    return int(value) if value.is_integer() else value
@@ -0,0 +1,53 @@
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, "simulator"))
+
+from async_rest_server import AsyncRESTServer
+from desk_manager import DeskManager
+from simple_rest_server import SimpleRESTServer
+from users import UserType
+
+API_KEY = "E9Y2LxT4g1hQZ7aD8nR3mWx5P0qK6pV7"
+DESK_ID = "cd:fb:1a:53:fb:e6"
+OTHER_DESK_ID = "ee:62:5b:b8:73:1d"
+DESKS_PATH = f"/api/v2/{API_KEY}/desks"
+
+@pytest.fixture
+def desk_manager(tmp_path, monkeypatch):
+    """A desk manager with the two default desks, keeping its state files in a temporary directory.
+
+    The simulation does not run on its own; tests advance it with fast_forward().
+    """
+    (tmp_path / "data").mkdir()
+    monkeypatch.chdir(tmp_path)
+    desk_manager = DeskManager(60, seed=1)
+    desk_manager.add_desk(DESK_ID, "DESK 4486", "Desk-O-Matic Co.", UserType.ACTIVE)
+    desk_manager.add_desk(OTHER_DESK_ID, "DESK 6743", "Desk-O-Matic Co.", UserType.STANDING)
+    yield desk_manager
+    desk_manager.events.close()
+
+@pytest.fixture(params=["simple", "asyncio"])
+def server_port(request, desk_manager, monkeypatch):
+    """Serve the desk manager on a free local port with each HTTP engine, and return the port."""
+    monkeypatch.setattr(SimpleRESTServer, "API_KEYS", [API_KEY])
+    if request.param == "simple":
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), lambda *args: SimpleRESTServer(desk_manager, *args))
+        thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+        yield httpd.server_address[1]
+        httpd.shutdown()
+        httpd.server_close()
+    else:
+        server = AsyncRESTServer(desk_manager, max_in_flight=4)
+        thread = threading.Thread(target=server.serve_forever, args=("127.0.0.1", 0), daemon=True)
+        thread.start()
+        assert server.serving.wait(5)
+        yield server.server_address[1]
+        server.shutdown()
+    thread.join(5)
@@ -0,0 +1,337 @@
+import argparse
+import http.client
+import json
+import math
+import os
+import queue
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from simple_api_test import API_KEY, API_VERSION, get_connection
+
+OPERATIONS = ("list", "desk", "category", "put")
+DEFAULT_MIX = "list=1,desk=4,category=4,put=1"
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIMULATOR_MAIN = os.path.join(PROJECT_DIR, "simulator", "main.py")
+
+def parse_mix(text):
+    """Parse a request mix such as "list=1,desk=4" into a list of (operation, weight)."""
+    mix = []
+    for item in text.split(","):
+        operation, _, weight = item.partition("=")
+        operation = operation.strip()
+        if operation not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation '{operation}', expected one of {', '.join(OPERATIONS)}")
+        try:
+            weight = float(weight) if weight else 1.0
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid weight for '{operation}'")
+        if weight > 0:
+            mix.append((operation, weight))
+    if not mix:
+        raise argparse.ArgumentTypeError("the request mix is empty")
+    return mix
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+class Recorder:
+    """Latencies and errors per operation of requests started inside the measurement window."""
+
+    def __init__(self, measure_from=0.0, measure_until=math.inf):
+        self.lock = threading.Lock()
+        self.latencies = {operation: [] for operation in OPERATIONS}
+        self.errors = {}
+        self.measure_from = measure_from
+        self.measure_until = measure_until
+
+    def record(self, operation, started, error=None):
+        if not self.measure_from <= started < self.measure_until:
+            return
+        latency_s = time.perf_counter() - started
+        with self.lock:
+            if error is None:
+                self.latencies[operation].append(latency_s)
+            else:
+                key = f"{operation}:{error}"
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def summary(self, duration_s):
+        def describe(latencies, errors):
+            latencies = sorted(latencies)
+            result = {
+                "requests": len(latencies) + errors,
+                "errors": errors,
+                "throughput_rps": round(len(latencies) / duration_s, 2) if duration_s else 0.0,
+            }
+            for name, fraction in (("p50_ms", 0.50), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+                value = percentile(latencies, fraction)
+                result[name] = round(value * 1000, 3) if value is not None else None
+            result["max_ms"] = round(latencies[-1] * 1000, 3) if latencies else None
+            return result
+
+        with self.lock:
+            by_operation = {}
+            for operation, latencies in self.latencies.items():
+                errors = sum(count for key, count in self.errors.items() if key.startswith(operation + ":"))
+                if latencies or errors:
+                    by_operation[operation] = describe(latencies, errors)
+            overall = describe([value for latencies in self.latencies.values() for value in latencies], sum(self.errors.values()))
+            return {"overall": overall, "by_operation": by_operation, "errors": dict(sorted(self.errors.items()))}
+
+class LoadClient:
+    """One keep-alive connection issuing requests from the configured mix."""
+
+    def __init__(self, args, desk_ids, recorder):
+        self.args = args
+        self.desk_ids = desk_ids
+        self.recorder = recorder
+        self.base_url = f"/api/{API_VERSION}/{API_KEY}/desks"
+        self.connection = None
+        self.random = random.Random()
+
+    def request(self, method, endpoint, body=None):
+        if self.connection is None:
+            self.connection = get_connection(self.args.https, self.args.host, self.args.port)
+            self.connection.timeout = self.args.timeout
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        try:
+            self.connection.request(method, endpoint, body=body, headers=headers)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            self.connection = None
+            raise
+
+    def run(self, operation, started):
+        """Issue one request; latency is measured from `started`, which may be the scheduled send time."""
+        desk_id = self.random.choice(self.desk_ids)
+        try:
+            if operation == "list":
+                status, _ = self.request("GET", self.base_url)
+            elif operation == "desk":
+                status, _ = self.request("GET", f"{self.base_url}/{desk_id}")
+            elif operation == "category":
+                status, _ = self.request("GET", f"{self.base_url}/{desk_id}/state")
+            else:
+                body = json.dumps({"position_mm": self.random.randint(680, 1320)})
+                status, _ = self.request("PUT", f"{self.base_url}/{desk_id}/state", body)
+        except (http.client.HTTPException, OSError) as e:
+            self.recorder.record(operation, started, type(e).__name__)
+            return
+        self.recorder.record(operation, started, None if status < 400 else str(status))
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+def choose_operations(mix, seed=None):
+    """Endless stream of operations drawn from the weighted mix."""
+    rng = random.Random(seed)
+    operations = [operation for operation, _ in mix]
+    weights = [weight for _, weight in mix]
+    while True:
+        yield from rng.choices(operations, weights, k=256)
+
+def run_closed_loop(args, desk_ids, recorder, deadline):
+    """Each of --concurrency clients sends its next request as soon as the previous one completes."""
+    def worker():
+        client = LoadClient(args, desk_ids, recorder)
+        operations = choose_operations(args.mix)
+        try:
+            while time.perf_counter() < deadline:
+                client.run(next(operations), time.perf_counter())
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {}
+
+def run_open_loop(args, desk_ids, recorder, deadline):
+    """Send --rate requests per second on a fixed schedule, whether or not earlier requests have completed.
+
+    Latency is measured from each request's scheduled send time, so time spent waiting for a free
+    client counts against the server instead of being hidden (no coordinated omission).
+    Requests still queued when the schedule ends were never sent and are reported as unsent.
+    """
+    pending = queue.Queue()
+
+    def worker():
+        client = LoadClient(args, desk_ids, recorder)
+        try:
+            while True:
+                item = pending.get()
+                if item is None:
+                    return
+                client.run(*item)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+
+    operations = choose_operations(args.mix)
+    interval = 1.0 / args.rate
+    scheduled = 0
+    next_send = time.perf_counter()
+    while next_send < deadline:
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        pending.put((next(operations), next_send))
+        scheduled += 1
+        next_send += interval
+
+    unsent = 0
+    while True:
+        try:
+            pending.get_nowait()
+            unsent += 1
+        except queue.Empty:
+            break
+    for _ in threads:
+        pending.put(None)
+    for thread in threads:
+        thread.join()
+    return {"scheduled": scheduled, "unsent": unsent}
+
+def fetch_desk_ids(args):
+    client = LoadClient(args, [], Recorder())
+    try:
+        status, body = client.request("GET", client.base_url)
+    finally:
+        client.close()
+    if status != 200:
+        raise RuntimeError(f"Listing desks failed with status {status}")
+    desk_ids = json.loads(body)
+    if args.desks:
+        desk_ids = desk_ids[:args.desks]
+    return desk_ids
+
+def start_server(args):
+    """Start simulator/main.py on --port and wait until it accepts requests.
+
+    The server runs in a temporary directory holding copies of the API keys and desk state,
+    so the state it saves on shutdown does not overwrite data/desks_state.json.
+    """
+    workdir = tempfile.mkdtemp(prefix="simulator-load-")
+    for relative_path in ("config/api_keys.json", "data/desks_state.json"):
+        source = os.path.join(PROJECT_DIR, relative_path)
+        if os.path.exists(source):
+            os.makedirs(os.path.join(workdir, os.path.dirname(relative_path)), exist_ok=True)
+            shutil.copy(source, os.path.join(workdir, relative_path))
+
+    command = [sys.executable, SIMULATOR_MAIN, "--port", str(args.port), "--log-level", "WARNING"] + args.server_args
+    if args.https:
+        command.append("--https")
+    process = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    process.workdir = workdir
+    give_up = time.monotonic() + 30
+    while time.monotonic() < give_up:
+        if process.poll() is not None:
+            stop_server(process)
+            raise RuntimeError(f"Simulator exited with code {process.returncode}")
+        try:
+            fetch_desk_ids(args)
+            return process
+        except (http.client.HTTPException, OSError, RuntimeError, ValueError):
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError("Simulator did not start within 30 seconds")
+
+def stop_server(process):
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    shutil.rmtree(process.workdir, ignore_errors=True)
+
+def print_report(report):
+    config = report["config"]
+    print(f"Mode: {config['mode']}, concurrency: {config['concurrency']}, duration: {config['duration_s']} s")
+    print(f"{'operation':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    rows = list(report["results"]["by_operation"].items()) + [("overall", report["results"]["overall"])]
+    for name, row in rows:
+        cells = [row[key] if row[key] is not None else "-" for key in ("p50_ms", "p95_ms", "p99_ms", "max_ms")]
+        print(f"{name:<10} {row['requests']:>9} {row['errors']:>7} {row['throughput_rps']:>9} " + " ".join(f"{cell:>8}" for cell in cells))
+    for key, count in report["results"]["errors"].items():
+        print(f"  error {key}: {count}")
+    if report.get("unsent"):
+        print(f"  {report['unsent']} of {report['scheduled']} scheduled requests were never sent; the clients could not keep up with --rate")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate load against the Desk Management REST API and report latency percentiles.")
+    parser.add_argument("--https", action="store_true", help="Use HTTPS for requests")
+    parser.add_argument("--host", type=str, default="localhost", help="Server host (default: localhost)")
+    parser.add_argument("--port", type=int, default=8000, help="Server port (default: 8000)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of concurrent keep-alive connections (default: 16)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Measured duration in seconds (default: 10)")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Seconds of load before measuring starts (default: 1)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"Weighted request mix (default: {DEFAULT_MIX})")
+    parser.add_argument("--rate", type=float, default=None, help="Open-loop mode: send this many requests per second on a fixed schedule")
+    parser.add_argument("--desks", type=int, default=0, help="Only address the first N desks of the listing (default: all)")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Per-request timeout in seconds (default: 10)")
+    parser.add_argument("--json", type=str, default=None, help="Write the report as JSON to this file, or '-' for standard output")
+    parser.add_argument("--start-server", action="store_true", help="Start simulator/main.py on --port for the run and stop it afterwards")
+    parser.add_argument("--server-args", nargs=argparse.REMAINDER, default=[], help="Extra arguments for simulator/main.py with --start-server; must come last")
+
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+
+    server = start_server(args) if args.start_server else None
+    try:
+        desk_ids = fetch_desk_ids(args)
+        if not desk_ids:
+            sys.exit("The server has no desks to address.")
+
+        measure_from = time.perf_counter() + args.warmup
+        deadline = measure_from + args.duration
+        recorder = Recorder(measure_from, deadline)
+        if args.rate is None:
+            details = run_closed_loop(args, desk_ids, recorder, deadline)
+        else:
+            details = run_open_loop(args, desk_ids, recorder, deadline)
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    report = {
+        "config": {
+            "mode": "open-loop" if args.rate is not None else "closed-loop",
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "mix": dict(args.mix),
+            "desks": len(desk_ids),
+            "server_args": args.server_args if args.start_server else None,
+        },
+        "results": recorder.summary(args.duration),
+        **details,
+    }
+    if args.json == "-":
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
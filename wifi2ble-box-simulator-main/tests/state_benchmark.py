@@ -0,0 +1,63 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, "simulator"))
+
+from desk_manager import DeskManager
+from users import UserType
+
+FORMATS = ("json", "binary")
+
+def create_state(desks):
+    """Save a fleet of `desks` desks in both state formats in the current directory."""
+    desk_manager = DeskManager(60)
+    desk_manager.add_desks([{"user_type": UserType.ACTIVE}] * desks)
+    for state_format in FORMATS:
+        desk_manager.state_format = state_format
+        desk_manager.save_state()
+
+def measure(state_format):
+    """Time loading and saving the state in one format, as the server does at startup and shutdown."""
+    started = time.perf_counter()
+    desk_manager = DeskManager(60, state_format=state_format)
+    startup_s = time.perf_counter() - started
+    started = time.perf_counter()
+    desk_manager.save_state()
+    return {"desks": len(desk_manager.desks), "startup_s": startup_s, "save_s": time.perf_counter() - started}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark loading and saving the desk state file in the JSON and binary formats.")
+    parser.add_argument("--desks", type=int, default=100000, help="Number of desks in the saved fleet (default: 100000)")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh processes timed per format (default: 3)")
+    parser.add_argument("--log-level", type=str, default="INFO", help="Logging level of the timed processes, as logging costs part of the time (default: INFO)")
+    parser.add_argument("--measure", choices=FORMATS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()), stream=open(os.devnull, "w"))
+
+    if args.measure:
+        print(json.dumps(measure(args.measure)))
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        os.mkdir("data")
+        print(f"Creating a state of {args.desks} desks...")
+        create_state(args.desks)
+        for state_format, path in (("json", DeskManager.STATE_FILE), ("binary", DeskManager.BINARY_STATE_FILE)):
+            print(f"{state_format} state file: {os.path.getsize(path) / 1e6:.1f} MB")
+        for state_format in FORMATS:
+            # Each run in a fresh process, so nothing is cached from creating the state or from earlier runs.
+            runs = [json.loads(subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--measure", state_format, "--log-level", args.log_level],
+                check=True, capture_output=True, text=True).stdout) for _ in range(args.repeat)]
+            print(f"{state_format}: startup {statistics.median(run['startup_s'] for run in runs):.2f} s, "
+                  f"save {statistics.median(run['save_s'] for run in runs):.2f} s "
+                  f"(median of {args.repeat} runs, {runs[0]['desks']} desks)")
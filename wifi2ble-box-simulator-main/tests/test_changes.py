@@ -0,0 +1,61 @@
+import http.client
+import json
+
+from conftest import DESK_ID, DESKS_PATH, OTHER_DESK_ID
+
+def get(port, path):
+    """Send a GET request and return the status, headers and decoded JSON body."""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        return response.status, response, json.loads(response.read())
+    finally:
+        connection.close()
+
+def snapshot_cursor(port):
+    status, response, _ = get(port, f"{DESKS_PATH}?expand=all")
+    assert status == 200
+    return response.getheader("X-Changes-Cursor")
+
+def test_changes_since_the_snapshot(server_port, desk_manager):
+    cursor = snapshot_cursor(server_port)
+    status, _, body = get(server_port, f"{DESKS_PATH}/changes?since={cursor}")
+    assert status == 200
+    assert body == {"cursor": cursor, "desks": {}, "removed": []}
+
+    desk_manager.set_target_positions([(0, DESK_ID, 1300)])
+    desk_manager.remove_desk(OTHER_DESK_ID)
+    desk_manager.fast_forward(60)
+
+    status, _, body = get(server_port, f"{DESKS_PATH}/changes?since={cursor}")
+    assert status == 200
+    assert body["cursor"] != cursor
+    assert body["desks"][DESK_ID]["state"] == desk_manager.get_desk_category(DESK_ID, "state")
+    assert body["removed"] == [OTHER_DESK_ID]
+
+    status, _, body_again = get(server_port, f"{DESKS_PATH}/changes?since={body['cursor']}")
+    assert status == 200
+    assert body_again == {"cursor": body["cursor"], "desks": {}, "removed": []}
+
+def test_cursor_older_than_the_journal_is_gone(server_port, desk_manager):
+    cursor = snapshot_cursor(server_port)
+    desk_manager.JOURNAL_MAX_RECORDS = 1
+    for position_mm in (900, 1300):
+        desk_manager.set_target_positions([(0, DESK_ID, position_mm)])
+        desk_manager.fast_forward(60)
+
+    status, _, body = get(server_port, f"{DESKS_PATH}/changes?since={cursor}")
+    assert status == 410
+    assert body["resync"] is True
+
+def test_malformed_or_foreign_cursor_is_gone(server_port):
+    epoch, _, number = snapshot_cursor(server_port).partition(".")
+    for cursor in ("nonsense", f"{epoch}.x", f"{'0' * len(epoch)}.{number}", f"{epoch}.{int(number) + 1}"):
+        status, _, body = get(server_port, f"{DESKS_PATH}/changes?since={cursor}")
+        assert status == 410, cursor
+        assert body["resync"] is True
+
+def test_missing_cursor_is_a_bad_request(server_port):
+    status, _, _ = get(server_port, f"{DESKS_PATH}/changes")
+    assert status == 400
@@ -0,0 +1,41 @@
+import random
+
+import pytest
+
+import vector_engine
+from desk import Desk
+from desk_manager import DeskManager
+from users import UserType
+
+pytestmark = pytest.mark.skipif(not vector_engine.AVAILABLE, reason="the numpy tick engine needs NumPy")
+
+def simulate(tick_engine, **settings):
+    """Run a fixed fleet for a simulated day, with one batch command halfway, and return its exported state."""
+    # Users and power failures draw from the random module, the NumPy engines from their own seeded generators.
+    random.seed(7)
+    desk_manager = DeskManager(60, tick_engine=tick_engine, seed=3, **settings)
+    try:
+        desk_manager.add_desks([
+            {"desk_id": f"aa:00:00:00:00:{index:02x}", "user_type": list(UserType)[index % len(UserType)]}
+            for index in range(30)
+        ])
+        desk_manager.fast_forward(12 * 3600)
+        desk_manager.set_target_positions([(0, "aa:00:00:00:00:01", 1234.5), (1, "aa:00:00:00:00:02", 700)])
+        desk_manager.fast_forward(12 * 3600)
+        return desk_manager.export_state()
+    finally:
+        desk_manager.events.close()
+
+@pytest.mark.parametrize("behavior_engine", ["object", "population"])
+@pytest.mark.parametrize("tick_hz, desk_time", [(1, "real"), (3, "real"), (3, "simulated")])
+def test_numpy_tick_engine_matches_the_object_engine(tmp_path, monkeypatch, behavior_engine, tick_hz, desk_time):
+    (tmp_path / "data").mkdir()
+    monkeypatch.chdir(tmp_path)
+    # Collisions and power failures are drawn from different random streams by the two engines, so leave them out.
+    monkeypatch.setattr(Desk, "COLLISION_CHANCE", 0.0)
+    monkeypatch.setattr(DeskManager, "POWER_OFF_MEAN_INTERVAL_S", 10 ** 12)
+    settings = {"tick_hz": tick_hz, "desk_time": desk_time, "behavior_engine": behavior_engine}
+
+    expected = simulate("object", **settings)
+    assert sum(saved["desk_data"]["usage"]["activationsCounter"] for saved in expected.values() if isinstance(saved, dict)) > 0
+    assert simulate("numpy", **settings) == expected
@@ -0,0 +1,132 @@
+import json
+import socket
+
+import pytest
+
+from conftest import DESK_ID, DESKS_PATH, OTHER_DESK_ID
+from desk import DeskStatus
+from event_stream import EventBroadcaster, SubscriberOverflow
+
+def position_events(*desk_ids):
+    return [(desk_id, "position", {"desk_id": desk_id}) for desk_id in desk_ids]
+
+def desk_ids_of(events):
+    return [json.loads(event.decode("utf-8").split("data: ", 1)[1])["desk_id"] for event in events]
+
+def test_subscription_only_gets_its_desks():
+    broadcaster = EventBroadcaster()
+    everything = broadcaster.subscribe()
+    one_desk = broadcaster.subscribe([DESK_ID])
+    broadcaster.publish(position_events(DESK_ID, OTHER_DESK_ID, DESK_ID))
+    assert desk_ids_of(everything.read(0)) == [DESK_ID, OTHER_DESK_ID, DESK_ID]
+    assert desk_ids_of(one_desk.read(0)) == [DESK_ID, DESK_ID]
+    assert one_desk.read(0) == []
+
+def test_drop_oldest_keeps_the_newest_matching_events():
+    broadcaster = EventBroadcaster()
+    subscription = broadcaster.subscribe([DESK_ID], max_buffer=3)
+    broadcaster.publish(position_events(*[DESK_ID] * 5, *[OTHER_DESK_ID] * 10))
+    events = subscription.read(0)
+    assert [event.split(b"\n", 1)[0] for event in events] == [b"id: 3", b"id: 4", b"id: 5"]
+    # Only the two older events of its own desk were skipped; the other desk's events never count.
+    assert subscription.dropped == 2
+
+def test_disconnect_policy_raises_on_overflow():
+    broadcaster = EventBroadcaster()
+    subscription = broadcaster.subscribe(max_buffer=2, policy="disconnect")
+    broadcaster.publish(position_events(DESK_ID, DESK_ID))
+    assert len(subscription.read(0)) == 2
+    broadcaster.publish(position_events(DESK_ID, DESK_ID, DESK_ID))
+    with pytest.raises(SubscriberOverflow):
+        subscription.read(0)
+
+def test_events_that_left_the_ring_count_as_dropped(monkeypatch):
+    monkeypatch.setattr(EventBroadcaster, "RING_SIZE", 4)
+    broadcaster = EventBroadcaster()
+    subscription = broadcaster.subscribe([DESK_ID])
+    broadcaster.publish(position_events(DESK_ID, OTHER_DESK_ID, DESK_ID, OTHER_DESK_ID, DESK_ID, DESK_ID))
+    # The first two events left the ring unread, so they count as dropped whichever desk they were for.
+    assert desk_ids_of(subscription.read(0)) == [DESK_ID, DESK_ID, DESK_ID]
+    assert subscription.dropped == 2
+
+def test_last_event_id_resumes_after_it():
+    broadcaster = EventBroadcaster()
+    broadcaster.publish(position_events(DESK_ID, OTHER_DESK_ID, DESK_ID))
+    subscription = broadcaster.subscribe(last_event_id=1)
+    assert desk_ids_of(subscription.read(0)) == [OTHER_DESK_ID, DESK_ID]
+    assert broadcaster.subscribe(last_event_id=99).read(0) == []
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        EventBroadcaster().subscribe(policy="block")
+
+def test_closed_broadcaster_ends_subscriptions():
+    broadcaster = EventBroadcaster()
+    subscription = broadcaster.subscribe()
+    broadcaster.close()
+    assert subscription.read(1) is None
+
+def test_status_changes_before_subscribing_are_not_reported(desk_manager):
+    desk = desk_manager.desks[DESK_ID]
+    for status in (DeskStatus.COLLISION, DeskStatus.NORMAL, DeskStatus.COLLISION):
+        desk.status = status
+        desk_manager._on_desk_changed(DESK_ID, {"state"})
+        desk_manager.fast_forward(60)
+
+    subscription = desk_manager.events.subscribe([DESK_ID])
+    desk_manager._on_desk_changed(DESK_ID, {"state"})
+    desk_manager.fast_forward(60)
+    assert b"event: status" not in b"".join(subscription.read(0))
+    desk.status = DeskStatus.NORMAL
+    desk_manager._on_desk_changed(DESK_ID, {"state"})
+    desk_manager.fast_forward(60)
+    assert b"event: status" in b"".join(subscription.read(0))
+
+def open_stream(port, query):
+    """Open an event stream and return the socket with a buffered reader positioned after the retry field."""
+    sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+    stream = sock.makefile("rb")
+    sock.sendall(f"GET {DESKS_PATH}/events?{query} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+    assert stream.readline().split()[1] == b"200"
+    headers = {}
+    while (line := stream.readline().rstrip(b"\r\n")):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.lower()] = value.strip()
+    assert headers["content-type"] == "text/event-stream"
+    assert read_event(stream) == {"retry": "3000"}
+    return sock, stream
+
+def read_event(stream):
+    """Read one Server-Sent Event and return its fields."""
+    fields = {}
+    while (line := stream.readline().rstrip(b"\n")):
+        name, _, value = line.decode("utf-8").partition(": ")
+        fields[name] = value
+    return fields
+
+def test_event_stream_sends_the_requested_desks(server_port, desk_manager):
+    sock, stream = open_stream(server_port, f"desks={DESK_ID}")
+    with sock, stream:
+        desk_manager.events.publish(position_events(OTHER_DESK_ID, DESK_ID))
+        event = read_event(stream)
+        assert event["event"] == "position"
+        assert json.loads(event["data"]) == {"desk_id": DESK_ID}
+
+def test_event_stream_reports_dropped_events(server_port, desk_manager):
+    sock, stream = open_stream(server_port, "buffer=2")
+    with sock, stream:
+        desk_manager.events.publish(position_events(*[DESK_ID] * 5))
+        assert read_event(stream) == {"event": "dropped", "data": json.dumps({"count": 3})}
+        assert [read_event(stream)["id"] for _ in range(2)] == ["4", "5"]
+
+def test_event_stream_overflow_closes_the_stream(server_port, desk_manager):
+    sock, stream = open_stream(server_port, "buffer=1&policy=disconnect")
+    with sock, stream:
+        desk_manager.events.publish(position_events(DESK_ID, DESK_ID))
+        assert read_event(stream)["event"] == "overflow"
+        assert stream.read(1) == b""
+
+def test_event_stream_rejects_an_unknown_policy(server_port):
+    with socket.create_connection(("127.0.0.1", server_port), timeout=5) as sock, sock.makefile("rb") as stream:
+        sock.sendall(f"GET {DESKS_PATH}/events?policy=block HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+        assert stream.readline().split()[1] == b"400"
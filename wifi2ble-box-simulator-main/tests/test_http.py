@@ -0,0 +1,156 @@
+import json
+import socket
+import zlib
+
+import pytest
+
+from conftest import DESK_ID, DESKS_PATH, OTHER_DESK_ID
+from simple_rest_server import SimpleRESTServer
+
+def read_response(stream):
+    """Read one response from a socket's buffered reader and return the status line, headers and body."""
+    status_line = stream.readline().decode("latin-1").rstrip("\r\n")
+    assert status_line, "connection closed before the response"
+    headers = {}
+    while (line := stream.readline().decode("latin-1").rstrip("\r\n")):
+        name, _, value = line.partition(":")
+        headers[name.lower()] = value.strip()
+    body = stream.read(int(headers.get("content-length", 0)))
+    return status_line, headers, body
+
+def connect(port):
+    """Open a connection to the server and return the socket with a buffered reader of it."""
+    sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+    return sock, sock.makefile("rb")
+
+def request(connection, method, path, body=b"", headers=""):
+    """Send one HTTP/1.1 request on a connection from connect() and read its response."""
+    sock, stream = connection
+    sock.sendall(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n{headers}\r\n".encode("latin-1") + body)
+    return read_response(stream)
+
+def test_malformed_request_line_gets_json_error(server_port):
+    sock, stream = connect(server_port)
+    with sock, stream:
+        sock.sendall(b"GARBAGE\r\n\r\n")
+        status_line, headers, body = read_response(stream)
+        assert status_line.split()[1] == "400"
+        assert headers["content-type"] == "application/json"
+        assert "error" in json.loads(body)
+        assert headers["connection"] == "close"
+        assert stream.read(1) == b""
+
+def test_keep_alive_serves_requests_on_one_connection(server_port):
+    connection = sock, stream = connect(server_port)
+    with sock, stream:
+        for _ in range(3):
+            status_line, headers, body = request(connection, "GET", f"{DESKS_PATH}/{DESK_ID}")
+            assert status_line.split()[1] == "200"
+            assert headers.get("connection") != "close"
+            assert json.loads(body)["config"]["name"] == "DESK 4486"
+
+def test_pipelined_requests_are_answered_in_order(server_port):
+    sock, stream = connect(server_port)
+    with sock, stream:
+        sock.sendall(b"".join(
+            f"GET {DESKS_PATH}/{desk_id}/config HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1")
+            for desk_id in (DESK_ID, OTHER_DESK_ID, DESK_ID)
+        ))
+        names = [json.loads(read_response(stream)[2])["name"] for _ in range(3)]
+        assert names == ["DESK 4486", "DESK 6743", "DESK 4486"]
+
+def test_http_1_0_closes_the_connection(server_port):
+    sock, stream = connect(server_port)
+    with sock, stream:
+        sock.sendall(f"GET {DESKS_PATH} HTTP/1.0\r\n\r\n".encode("latin-1"))
+        status_line, _, body = read_response(stream)
+        assert status_line.split()[1] == "200"
+        assert set(json.loads(body)) == {DESK_ID, OTHER_DESK_ID}
+        assert stream.read(1) == b""
+
+@pytest.mark.parametrize("method, path, status", [
+    ("GET", f"{DESKS_PATH}/00:00:00:00:00:00", "404"),
+    ("GET", f"{DESKS_PATH}/{DESK_ID}/nothing", "404"),
+    ("GET", f"/api/v2/{'x' * 32}/desks", "401"),
+    ("GET", "/api/v1/desks", "400"),
+    ("PATCH", f"{DESKS_PATH}/{DESK_ID}", "405"),
+    ("POST", f"{DESKS_PATH}/{DESK_ID}", "405"),
+])
+def test_errors_are_json_and_keep_the_connection(server_port, method, path, status):
+    connection = sock, stream = connect(server_port)
+    with sock, stream:
+        status_line, headers, body = request(connection, method, path, b'{"position_mm": 900}')
+        assert status_line.split()[1] == status
+        assert headers["content-type"] == "application/json"
+        assert "error" in json.loads(body)
+        # The unread request body was drained, so the next request on the connection is parsed cleanly.
+        status_line, _, _ = request(connection, "GET", f"{DESKS_PATH}/{DESK_ID}")
+        assert status_line.split()[1] == "200"
+
+@pytest.mark.parametrize("path", [f"{DESKS_PATH}/{DESK_ID}", f"{DESKS_PATH}/{DESK_ID}/state"])
+def test_unchanged_desk_answers_not_modified(server_port, path):
+    connection = sock, stream = connect(server_port)
+    with sock, stream:
+        _, headers, _ = request(connection, "GET", path)
+        etag = headers["etag"]
+        assert etag.startswith('W/"')
+        for if_none_match in (etag, etag.removeprefix("W/"), f'W/"other", {etag}', "*"):
+            status_line, headers, body = request(connection, "GET", path, headers=f"If-None-Match: {if_none_match}\r\n")
+            assert status_line.split()[1] == "304"
+            assert headers["etag"] == etag
+            assert body == b""
+        status_line, _, _ = request(connection, "GET", path, headers='If-None-Match: W/"other"\r\n')
+        assert status_line.split()[1] == "200"
+
+def test_changed_desk_gets_a_new_etag(server_port, desk_manager):
+    path = f"{DESKS_PATH}/{DESK_ID}"
+    connection = sock, stream = connect(server_port)
+    with sock, stream:
+        _, headers, _ = request(connection, "GET", path)
+        etag = headers["etag"]
+        request(connection, "PUT", f"{path}/state", json.dumps({"position_mm": 1300}).encode("utf-8"))
+        desk_manager.fast_forward(60)
+        status_line, headers, body = request(connection, "GET", path, headers=f"If-None-Match: {etag}\r\n")
+        assert status_line.split()[1] == "200"
+        assert headers["etag"] != etag
+        assert json.loads(body) == desk_manager.get_desk_data(DESK_ID)
+
+def test_compressed_and_plain_responses_share_the_etag(server_port, monkeypatch):
+    monkeypatch.setattr(SimpleRESTServer, "COMPRESSION_MIN_BYTES", 0)
+    path = f"{DESKS_PATH}/{DESK_ID}"
+    connection = sock, stream = connect(server_port)
+    with sock, stream:
+        _, plain_headers, _ = request(connection, "GET", path)
+        _, gzip_headers, _ = request(connection, "GET", path, headers="Accept-Encoding: gzip\r\n")
+        assert gzip_headers["content-encoding"] == "gzip"
+        assert gzip_headers["etag"] == plain_headers["etag"]
+        status_line, _, _ = request(connection, "GET", path, headers=f"Accept-Encoding: gzip\r\nIf-None-Match: {plain_headers['etag']}\r\n")
+        assert status_line.split()[1] == "304"
+
+@pytest.mark.parametrize("accept_encoding, content_encoding", [
+    ("gzip", "gzip"),
+    ("deflate", "deflate"),
+    ("deflate, gzip", "gzip"),
+    ("gzip;q=0.5, deflate", "deflate"),
+    ("gzip;q=0, deflate;q=0", None),
+    ("*", "gzip"),
+    ("br", None),
+])
+def test_compression_follows_accept_encoding(server_port, monkeypatch, accept_encoding, content_encoding):
+    monkeypatch.setattr(SimpleRESTServer, "COMPRESSION_MIN_BYTES", 0)
+    connection = sock, stream = connect(server_port)
+    with sock, stream:
+        _, _, plain_body = request(connection, "GET", f"{DESKS_PATH}/{DESK_ID}")
+        _, headers, body = request(connection, "GET", f"{DESKS_PATH}/{DESK_ID}", headers=f"Accept-Encoding: {accept_encoding}\r\n")
+        assert headers["vary"] == "Accept-Encoding"
+        assert headers.get("content-encoding") == content_encoding
+        if content_encoding:
+            body = zlib.decompress(body, SimpleRESTServer.COMPRESSION_WBITS[content_encoding])
+        assert body == plain_body
+
+def test_small_bodies_are_not_compressed(server_port):
+    connection = sock, stream = connect(server_port)
+    with sock, stream:
+        _, headers, body = request(connection, "GET", f"{DESKS_PATH}/{DESK_ID}/usage", headers="Accept-Encoding: gzip\r\n")
+        assert "content-encoding" not in headers
+        assert "activationsCounter" in json.loads(body)
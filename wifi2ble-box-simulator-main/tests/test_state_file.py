@@ -0,0 +1,58 @@
+import json
+import os
+import struct
+
+import pytest
+
+import state_file
+from conftest import DESK_ID, PROJECT_DIR
+from desk_manager import DeskManager
+from users import UserType
+
+SAMPLE_STATE_FILE = os.path.join(PROJECT_DIR, "data", "desks_state.json")
+
+def test_json_to_binary_and_back_is_lossless(tmp_path):
+    binary_path = str(tmp_path / "desks_state.bin")
+    json_path = str(tmp_path / "desks_state.json")
+    with open(SAMPLE_STATE_FILE) as f:
+        state = json.load(f)
+
+    count = len(state) - 2
+    assert state_file.convert(SAMPLE_STATE_FILE, binary_path) == count
+    assert state_file.convert(binary_path, json_path) == count
+    with open(json_path) as f:
+        assert json.load(f) == state
+
+def test_binary_state_round_trip_through_the_desk_manager(desk_manager):
+    # Longer than a 16-bit length prefix could hold.
+    long_name = "DESK " + "x" * 70000
+    desk_manager.add_desk("aa:bb:cc:dd:ee:ff", long_name, "Ünïcode Desks", UserType.SEATED)
+    desk_manager.set_target_positions([(0, DESK_ID, 1234.5)])
+    desk_manager.fast_forward(3600)
+    desk_manager.state_format = "binary"
+    desk_manager.save_state()
+
+    restored = DeskManager(60, seed=1, state_format="binary")
+    try:
+        assert restored.current_time_s == desk_manager.current_time_s
+        assert restored.export_state() == desk_manager.export_state()
+        assert restored.get_desk_category("aa:bb:cc:dd:ee:ff", "config")["name"] == long_name
+    finally:
+        restored.events.close()
+
+def test_reader_rejects_other_files(tmp_path):
+    path = tmp_path / "desks_state.bin"
+    state_file.convert(SAMPLE_STATE_FILE, str(path))
+    data = path.read_bytes()
+
+    path.write_bytes(b"NOTSNAP!" + data[8:])
+    with pytest.raises(state_file.StateFormatError, match="not a binary desk state file"):
+        state_file.StateReader(str(path))
+
+    path.write_bytes(data[:8] + struct.pack("<H", state_file.VERSION + 1) + data[10:])
+    with pytest.raises(state_file.StateFormatError, match="format version"):
+        state_file.StateReader(str(path))
+
+    path.write_bytes(data[:state_file.HEADER.size + state_file.RECORD.size])
+    with pytest.raises(state_file.StateFormatError, match="truncated"):
+        state_file.StateReader(str(path))